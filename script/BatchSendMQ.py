@@ -1,10 +1,17 @@
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from urllib.parse import quote_plus
 import logging
 import os
+import sys
+import json
+import time
+import argparse
+import queue
+import threading
 import pika
-from pika.exceptions import AMQPConnectionError
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List
 from dotenv import load_dotenv
 
 # 配置日志
@@ -16,39 +23,385 @@ logger = logging.getLogger(__name__)
 # 加载环境变量
 load_dotenv()
 
+current_file_name = os.path.splitext(os.path.basename(__file__))[0].upper()
 
-def search_db(db_engine: create_engine, query: str) -> pd.DataFrame:
-    return pd.read_sql(query, db_engine)
+# 每个通道未确认消息数的上限，以及并行的连接数（每个连接一个通道、一个线程）
+DEFAULT_WINDOW = int(os.getenv(f"{current_file_name}_WINDOW", "1000"))
+DEFAULT_CHANNELS = int(os.getenv(f"{current_file_name}_CHANNELS", "4"))
+# 进度日志间隔（秒）
+PROGRESS_INTERVAL = 5
+# 每次从数据库读取并发送的 id 数
+DEFAULT_PAGE_SIZE = int(os.getenv(f"{current_file_name}_PAGE_SIZE", "50000"))
+# 断点续传的检查点文件
+CHECKPOINT_PATH = os.getenv(
+    f"{current_file_name}_CHECKPOINT", "batch_send_mq.checkpoint.json"
+)
+
+
+def search_db(
+    db_engine: create_engine, query: str, params: dict = None
+) -> pd.DataFrame:
+    return pd.read_sql(text(query) if params else query, db_engine, params=params)
+
+
+# 按 id 键集分页读取，每页只取 id 大于上一页最后一个 id 的 page_size 条，内存占用与总量无关
+def iter_id_pages(
+    db_engine: create_engine, since: str, after_id: int = 0, page_size: int = None
+) -> Iterator[list]:
+    page_size = page_size or DEFAULT_PAGE_SIZE
+    while True:
+        ids = search_db(
+            db_engine,
+            """
+            select id from ebp_service_buyer_product
+            where modify_time > :since and id > :after_id
+            order by id limit :page_size
+            """,
+            {"since": since, "after_id": after_id, "page_size": page_size},
+        )["id"].tolist()
+        if not ids:
+            return
+        yield ids
+        after_id = ids[-1]
+
+
+# 检查点记录已全部确认的最后一个 id；modify_time 条件不同或上次已全部发送完成时不沿用
+def load_checkpoint(path: str, since: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("since") != since or checkpoint.get("completed"):
+        return 0
+    return checkpoint["last_id"]
+
+
+def save_checkpoint(
+    path: str, since: str, last_id: int, completed: bool = False
+) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"since": since, "last_id": int(last_id), "completed": completed}, f)
+    os.replace(tmp_path, path)
+
+
+class PublishStats:
+    def __init__(self, total: int = 0):
+        """
+        所有通道共享的发送进度
+        :param total: 已提交的消息总数，分页发送时逐页累加
+        """
+        self.total = total
+        self.published = 0
+        self.confirmed = 0
+        self.nacked = 0
+        self.returned = 0
+        self.started_at = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add(self, **counts: int) -> None:
+        with self.lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def log(self) -> None:
+        elapsed = time.perf_counter() - self.started_at
+        logger.info(
+            f"已发送 {self.published}/{self.total}，已确认 {self.confirmed}，"
+            f"拒绝 {self.nacked}，退回 {self.returned}，"
+            f"{self.confirmed / elapsed if elapsed else 0:.0f} 条/秒"
+        )
+
+
+class ConfirmPublisher:
+    def __init__(
+        self,
+        parameters: pika.ConnectionParameters,
+        queue_name: str,
+        exchange: str,
+        routing_key: str,
+        window: int,
+        stats: PublishStats,
+    ):
+        """
+        在一个 SelectConnection 通道上以发布确认模式异步发送消息，
+        未确认的消息数不超过 window，收到确认后继续发送；
+        连接在 run() 的线程中保持打开，其他线程通过 submit() 追加消息，close() 后退出
+        """
+        self.parameters = parameters
+        self.queue_name = queue_name
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.window = window
+        self.stats = stats
+        self.connection = None
+        self.channel = None
+        self.ready = False
+        # 其他线程提交的消息体，由 ioloop 线程取出发送
+        self.incoming = queue.Queue()
+        self.bodies: List[str] = []
+        self.next_index = 0
+        self.delivery_tag = 0
+        # delivery_tag -> 消息下标，按发送顺序排列
+        self.pending: Dict[int, int] = {}
+        self.failed: List[str] = []
+        # 已提交的消息全部得到确认（或连接已断开）时置位
+        self.idle = threading.Event()
+        self.idle.set()
+        self.idle_lock = threading.Lock()
+        self.finishing = False
+        self.closing = False
+        self.closed = False
+
+    # 发送通过 submit() 提交的消息，直到 close() 或连接中断
+    def run(self) -> None:
+        self.connection = pika.SelectConnection(
+            self.parameters,
+            on_open_callback=self.on_connection_open,
+            on_open_error_callback=self.on_connection_open_error,
+            on_close_callback=self.on_connection_closed,
+        )
+        self.connection.ioloop.start()
+        # 连接中断时未确认和未发送的消息都算失败
+        self.failed += [self.bodies[index] for index in self.pending.values()]
+        self.failed += self.bodies[self.next_index :]
+        self.pending.clear()
+        self.next_index = len(self.bodies)
+        self.closed = True
+        self.drain_incoming()
+        self.idle.set()
+
+    def drain_incoming(self) -> List[str]:
+        bodies = []
+        while True:
+            try:
+                bodies.extend(self.incoming.get_nowait())
+            except queue.Empty:
+                break
+        if self.closed:
+            self.failed += bodies
+            return []
+        return bodies
+
+    # 可以在任意线程调用；连接已断开时消息直接算作失败
+    def submit(self, bodies: List[str]) -> None:
+        with self.idle_lock:
+            self.idle.clear()
+            self.incoming.put(bodies)
+        self.wakeup()
+
+    def close(self) -> None:
+        self.finishing = True
+        self.wakeup()
+
+    # 通知 ioloop 线程处理新提交的消息
+    def wakeup(self) -> None:
+        if self.closed:
+            self.drain_incoming()
+            self.idle.set()
+        elif self.connection is not None:
+            self.connection.ioloop.add_callback_threadsafe(self.publish)
+
+    # 取出并清空已失败的消息体，应在 idle 置位后调用
+    def take_failed(self) -> List[str]:
+        failed, self.failed = self.failed, []
+        return failed
+
+    def on_connection_open(self, connection) -> None:
+        connection.channel(on_open_callback=self.on_channel_open)
 
+    def on_connection_open_error(self, connection, error) -> None:
+        logger.error(f"无法连接到RabbitMQ服务器: {error}")
+        connection.ioloop.stop()
 
+    def on_connection_closed(self, connection, reason) -> None:
+        if not self.closing:
+            logger.error(f"RabbitMQ 连接中断: {reason}")
+        connection.ioloop.stop()
+
+    def on_channel_open(self, channel) -> None:
+        self.channel = channel
+        channel.add_on_close_callback(self.on_channel_closed)
+        channel.add_on_return_callback(self.on_return)
+        channel.queue_declare(
+            queue=self.queue_name, durable=True, callback=self.on_queue_declared
+        )
+
+    # 通道被服务端关闭（如交换机不存在）时关闭连接，结束 ioloop
+    def on_channel_closed(self, channel, reason) -> None:
+        if not self.closing:
+            logger.error(f"RabbitMQ 通道关闭: {reason}")
+            self.closing = True
+            self.connection.close()
+
+    def on_queue_declared(self, frame) -> None:
+        self.channel.confirm_delivery(
+            self.on_delivery_confirmation, callback=self.on_confirm_selected
+        )
+
+    def on_confirm_selected(self, frame) -> None:
+        self.ready = True
+        self.publish()
+
+    # 在窗口内尽量多地发送；已提交的消息全部确认后置位 idle，close() 后关闭连接
+    def publish(self) -> None:
+        if not self.ready or self.closing:
+            return
+        self.bodies += self.drain_incoming()
+        published = 0
+        while len(self.pending) < self.window and self.next_index < len(self.bodies):
+            self.channel.basic_publish(
+                exchange=self.exchange,
+                routing_key=self.routing_key,
+                body=self.bodies[self.next_index],
+                properties=pika.BasicProperties(
+                    delivery_mode=2,  # 使消息持久化
+                ),
+                mandatory=True,
+            )
+            self.delivery_tag += 1
+            self.pending[self.delivery_tag] = self.next_index
+            self.next_index += 1
+            published += 1
+        if published:
+            self.stats.add(published=published)
+        if not self.pending and self.next_index >= len(self.bodies):
+            # 已确认的消息体不再需要保留
+            self.bodies = []
+            self.next_index = 0
+            with self.idle_lock:
+                if self.incoming.empty():
+                    self.idle.set()
+            if self.finishing:
+                self.closing = True
+                self.connection.close()
+
+    # multiple 为 True 时确认 delivery_tag 及之前的全部消息
+    def on_delivery_confirmation(self, frame) -> None:
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        tags = [method.delivery_tag]
+        if method.multiple:
+            tags = [tag for tag in self.pending if tag <= method.delivery_tag]
+        for tag in tags:
+            index = self.pending.pop(tag, None)
+            if index is not None and not acked:
+                self.failed.append(self.bodies[index])
+        if acked:
+            self.stats.add(confirmed=len(tags))
+        else:
+            self.stats.add(nacked=len(tags))
+        self.publish()
+
+    # 没有匹配队列的消息（mandatory）会先被退回，之后同样会收到确认
+    def on_return(self, channel, method, properties, body) -> None:
+        self.failed.append(body.decode())
+        self.stats.add(returned=1)
+
+
+# 每 batch_size 个 id 合并为一条消息，消息体为逗号分隔的 id（消费端需要支持多个 id）
+def build_bodies(ids: list, batch_size: int = 1) -> List[str]:
+    return [
+        ",".join(str(message_id) for message_id in ids[i : i + batch_size])
+        for i in range(0, len(ids), batch_size)
+    ]
+
+
+class PublisherPool:
+    def __init__(
+        self,
+        parameters: pika.ConnectionParameters,
+        queue_name: str,
+        routing_key: str,
+        channels: int = None,
+        window: int = None,
+        exchange: str = "elastic.job.exchange.topic",
+    ):
+        """
+        多个 ConfirmPublisher 组成的发送池，连接在多次 send() 之间保持打开，
+        发送进度在整个池的生命周期内累计
+        :param channels: 并行的连接数（每个连接一个通道、一个线程）
+        :param window: 每个连接未确认消息数上限
+        """
+        self.stats = PublishStats()
+        self.publishers = [
+            ConfirmPublisher(
+                parameters,
+                queue_name,
+                exchange,
+                routing_key,
+                window or DEFAULT_WINDOW,
+                self.stats,
+            )
+            for _ in range(channels or DEFAULT_CHANNELS)
+        ]
+        # pika 的连接不是线程安全的，每个线程使用自己的连接
+        self.executor = ThreadPoolExecutor(max_workers=len(self.publishers))
+        self.futures = [
+            self.executor.submit(publisher.run) for publisher in self.publishers
+        ]
+
+    def __enter__(self) -> "PublisherPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # 把消息分给各个连接并等待全部确认，返回发送失败的消息体
+    def send(self, messages: list) -> List[str]:
+        bodies = [str(message) for message in messages]
+        if not bodies:
+            return []
+        self.stats.add(total=len(bodies))
+        channels = len(self.publishers)
+        for i, publisher in enumerate(self.publishers):
+            if bodies[i::channels]:
+                publisher.submit(bodies[i::channels])
+        while not all(
+            publisher.idle.wait(PROGRESS_INTERVAL) for publisher in self.publishers
+        ):
+            self.stats.log()
+        self.stats.log()
+        failed = [
+            body for publisher in self.publishers for body in publisher.take_failed()
+        ]
+        if failed:
+            logger.error(f"{len(failed)} 条消息发送失败，例如: {failed[:10]}")
+        return failed
+
+    def close(self) -> None:
+        for publisher in self.publishers:
+            publisher.close()
+        wait(self.futures)
+        self.executor.shutdown()
+
+
+# 以发布确认模式通过多个连接并行发送，返回发送失败的消息体
 def send_messages(
     parameters: pika.ConnectionParameters,
     queue_name: str,
     routing_key: str,
     messages: list,
+    channels: int = None,
+    window: int = None,
+    exchange: str = "elastic.job.exchange.topic",
+) -> List[str]:
+    channels = min(channels or DEFAULT_CHANNELS, len(messages))
+    if not channels:
+        return []
+    with PublisherPool(
+        parameters, queue_name, routing_key, channels, window, exchange
+    ) as pool:
+        return pool.send(messages)
+
+
+def main(
+    since: str,
+    batch_size: int = 1,
+    channels: int = None,
+    window: int = None,
+    restart: bool = False,
 ) -> None:
-    try:
-        with pika.BlockingConnection(parameters) as connection:
-            with connection.channel() as channel:
-                channel.queue_declare(queue=queue_name, durable=True)
-                for message in messages:
-                    channel.basic_publish(
-                        exchange="elastic.job.exchange.topic",
-                        routing_key=routing_key,
-                        body=str(message),
-                        properties=pika.BasicProperties(
-                            delivery_mode=2,  # 使消息持久化
-                        ),
-                        mandatory=True,
-                    )
-                    print(f" Send msg : '{message}'")
-    except AMQPConnectionError as error:
-        print(f"无法连接到RabbitMQ服务器: {error}")
-    except Exception as error:
-        print(f"发生错误: {error}")
-
-
-def main() -> None:
     # URL 编码
     encoded_db_username = quote_plus(os.getenv("DB_USERNAME"))
     encoded_db_password = quote_plus(os.getenv("DB_PASSWORD"))
@@ -56,8 +409,6 @@ def main() -> None:
     db_engine = create_engine(
         f"mysql+mysqlconnector://{encoded_db_username}:{encoded_db_password}@{os.getenv('DB_HOSTNAME')}/bwcecatalog"
     )
-    sql = "select id from ebp_service_buyer_product where modify_time > '2024-07-23'"
-    df = search_db(db_engine, sql)["id"].drop_duplicates().tolist()
 
     # RabbitMQ 服务器连接参数
     credentials = pika.PlainCredentials(
@@ -69,13 +420,50 @@ def main() -> None:
         virtual_host="/",  # 默认虚拟主机，如果不同请修改
         credentials=credentials,
     )
-    send_messages(
+
+    last_id = 0 if restart else load_checkpoint(CHECKPOINT_PATH, since)
+    if last_id:
+        logger.info(f"从检查点继续，跳过 id <= {last_id}")
+    total = 0
+    failed = []
+    # 连接在各页之间保持打开，只在每页结束时等待全部确认
+    with PublisherPool(
         parameters,
         "elastic.job.queue.syncEproductByProductId",
         "elastic.job.routing.key.syncEproductByProductId",
-        df,
-    )
+        channels=channels,
+        window=window,
+    ) as pool:
+        for ids in iter_id_pages(db_engine, since, last_id):
+            failed = pool.send(build_bodies(ids, batch_size))
+            # 一页全部确认后才推进检查点，失败时下次从这一页重新发送
+            if failed:
+                logger.error(
+                    f"id {ids[0]} ~ {ids[-1]} 未全部发送成功，"
+                    f"下次从 {last_id} 之后继续"
+                )
+                break
+            last_id = ids[-1]
+            save_checkpoint(CHECKPOINT_PATH, since, last_id)
+            total += len(ids)
+            logger.info(f"已完成 {total} 个 id，检查点 {last_id}")
+    if failed:
+        sys.exit(1)
+    # 标记本次已全部完成，之后以同样条件运行时从头发送
+    save_checkpoint(CHECKPOINT_PATH, since, last_id, completed=True)
+    logger.info(f"发送完成，共 {total} 个 id")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="发送商品同步消息")
+    parser.add_argument(
+        "--since", default="2024-07-23", help="同步 modify_time 晚于该时间的商品"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=1, help="每条消息包含的商品 id 数"
+    )
+    parser.add_argument("--channels", type=int, help="并行的连接数")
+    parser.add_argument("--window", type=int, help="每个连接未确认消息数上限")
+    parser.add_argument("--restart", action="store_true", help="忽略检查点，从头发送")
+    args = parser.parse_args()
+    main(args.since, args.batch_size, args.channels, args.window, args.restart)
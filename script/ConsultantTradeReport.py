@@ -1,174 +1,243 @@
 import os
-import sys
 import pandas as pd
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from urllib.parse import quote_plus
-import logging
 from datetime import datetime, timedelta
-from EmailSender import EmailSender
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
-)
-logger = logging.getLogger(__name__)
+from typing import Dict, List
+from monthly_fact_store import FactSource, MonthlyFactStore, load_months, month_bounds
+from query_runner import to_cents
+from report_runner import QuerySpec, ReportRunner, ReportSpec, run_reports
 
 # 获取文件名（不带扩展名）
 current_file_name = os.path.splitext(os.path.basename(__file__))[0].upper()
 
-# 加载环境变量
-load_dotenv()
-
+SHEET_NAMES = ["SQL（总计）", "订单明细", "售后明细"]
 
-def search_db(db_engine: create_engine, query: str) -> pd.DataFrame:
-    return pd.read_sql(query, db_engine)
-
-
-def check_required_env_vars() -> bool:
-    required_vars = [
-        "DB_USERNAME",
-        "DB_PASSWORD",
-        "DB_HOSTNAME",
-        "SENDER_EMAIL",
-        "EMAIL_PASSWORD",
-        f"{current_file_name}_RECEIVER_EMAIL",
-        f"{current_file_name}_CC_EMAIL",
-    ]
-    for var in required_vars:
-        if not os.getenv(var):
-            logger.error(f"缺少必要的环境变量: {var}")
-            return False
-    return True
 
-
-def generate_excel(dataframes: list, sheet_names: list, output_file: str):
-    with pd.ExcelWriter(output_file) as writer:
-        for df, sheet_name in zip(dataframes, sheet_names):
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-
-def get_last_month() -> str:
+def get_last_month(date: datetime = None) -> str:
     """
     获取上个月的月份，格式为'YYYY-MM'
     """
-    last_month = datetime.now().replace(day=1) - timedelta(days=1)
+    last_month = (date or datetime.now()).replace(day=1) - timedelta(days=1)
     return last_month.strftime("%Y-%m")
 
 
-if __name__ == "__main__":
-    if not check_required_env_vars():
-        sys.exit(1)
-    # 从环境变量获取配置
-    encoded_db_username = os.getenv("DB_USERNAME")
-    encoded_db_password = os.getenv("DB_PASSWORD")
-    db_hostname = os.getenv("DB_HOSTNAME")
-    sender_email = os.getenv("SENDER_EMAIL")
-    receiver_email = os.getenv(f"{current_file_name}_RECEIVER_EMAIL")
-    cc_email = os.getenv(f"{current_file_name}_CC_EMAIL")
-    password = os.getenv("EMAIL_PASSWORD")
-    db_engine = create_engine(
-        f"mysql+mysqlconnector://{quote_plus(encoded_db_username)}:{quote_plus(encoded_db_password)}@{db_hostname}/crm"
-    )
-    try:
-        last_month = get_last_month()
-        queries = [
-            f"""
-                select
-                user.username as '顾问',
-                if(u_count is not null, u_count, 0) as '下单客户数',
-                if(o_count is not null, o_count, 0) as '订单数量',
-                if(o_amount is not null, o_amount, 0) as '订单总金额',
-                if(a_amount is not null, a_amount, 0)  as '售后总金额'
-                from crm_user user
-                left join
-                (
-                select owner, count(*) as 'u_count', sum(count) as 'o_count', sum(amount) as 'o_amount' from 
-                (
-                    select crm_customer.owner, crm_customer.id, crm_customer.platform_account, crm_customer.name, sum(o.receivable) as amount, count(*) as count from crm_customer
-                    left join 
-                    (
-                        select p_order_id as id, sum(receivable) as receivable, customer_id from bwcmall.bo_order 
-                        where record_status=1 and order_status not in (0, 4, 6) and left(payment_date,7)='{last_month}' group by p_order_id
-                    ) as o on o.customer_id=crm_customer.platform_account
-                    where crm_customer.record_status and crm_customer.owner is not null 
-                        and crm_customer.platform_account is not null
-                        and o.id is not null
-                    group by crm_customer.owner, crm_customer.id order by crm_customer.owner
-                ) as o group by o.owner
-                ) as odata on user.id=odata.owner
-                left join
-                (
-                select owner, sum(amount) as 'a_amount' from
-                (
-                    select crm_customer.owner, crm_customer.id, crm_customer.platform_account, crm_customer.name, sum(o.amount) as amount, count(*) as count from crm_customer
-                    left join bwcmall.bo_order_after_sale o on o.record_status=1 and o.after_sale_status=8 and o.customer_id=crm_customer.platform_account
-                    where crm_customer.record_status and crm_customer.owner is not null
-                        and crm_customer.platform_account is not null
-                        and o.id is not null and left(o.modify_time,7)='{last_month}'
-                    group by crm_customer.owner, crm_customer.id order by crm_customer.owner
-                ) as a  group by a.owner
-                ) as oafter on user.id=oafter.owner
-                where u_count > 0
-            """,
-            f"""
-                select 
-                user.username as '顾问',
-                odata.name as '客户名称',
-                odata.count as '订单数量',
-                odata.amount as '订单总金额'
-                from
-                (
+# 三个工作表的查询，相互独立；统计月份通过绑定参数 :month_start / :month_end 传入（半开区间）
+def build_queries() -> List[str]:
+    return [
+        """
+            select
+            user.username as '顾问',
+            if(u_count is not null, u_count, 0) as '下单客户数',
+            if(o_count is not null, o_count, 0) as '订单数量',
+            if(o_amount is not null, o_amount, 0) as '订单总金额',
+            if(a_amount is not null, a_amount, 0)  as '售后总金额'
+            from crm_user user
+            left join
+            (
+            select owner, count(*) as 'u_count', sum(count) as 'o_count', sum(amount) as 'o_amount' from 
+            (
                 select crm_customer.owner, crm_customer.id, crm_customer.platform_account, crm_customer.name, sum(o.receivable) as amount, count(*) as count from crm_customer
-                left join
+                left join 
                 (
-                select p_order_id as id, sum(receivable) as receivable, customer_id from bwcmall.bo_order 
-                where record_status=1 and order_status not in (0, 4, 6) and left(payment_date,7)='{last_month}' group by p_order_id
+                    select p_order_id as id, sum(receivable) as receivable, customer_id from bwcmall.bo_order 
+                    where record_status=1 and order_status not in (0, 4, 6) and payment_date >= :month_start and payment_date < :month_end group by p_order_id
                 ) as o on o.customer_id=crm_customer.platform_account
                 where crm_customer.record_status and crm_customer.owner is not null 
-                and crm_customer.platform_account is not null
-                and o.id is not null
+                    and crm_customer.platform_account is not null
+                    and o.id is not null
                 group by crm_customer.owner, crm_customer.id order by crm_customer.owner
-                ) as odata
-                left join crm_user user on user.id=odata.owner
-            """,
-            f"""
-                select
-                user.username as '顾问', 
-                oafter.name as '客户名称',
-                oafter.count as '售后单数',
-                oafter.amount as '售后总金额'
-                from
-                (
+            ) as o group by o.owner
+            ) as odata on user.id=odata.owner
+            left join
+            (
+            select owner, sum(amount) as 'a_amount' from
+            (
                 select crm_customer.owner, crm_customer.id, crm_customer.platform_account, crm_customer.name, sum(o.amount) as amount, count(*) as count from crm_customer
                 left join bwcmall.bo_order_after_sale o on o.record_status=1 and o.after_sale_status=8 and o.customer_id=crm_customer.platform_account
-                where crm_customer.record_status and crm_customer.owner is not null 
+                where crm_customer.record_status and crm_customer.owner is not null
                     and crm_customer.platform_account is not null
-                    and o.id is not null and left(o.modify_time,7)='{last_month}'
+                    and o.id is not null and o.modify_time >= :month_start and o.modify_time < :month_end
                 group by crm_customer.owner, crm_customer.id order by crm_customer.owner
-                ) as oafter 
-                left join crm_user user on user.id=oafter.owner
+            ) as a  group by a.owner
+            ) as oafter on user.id=oafter.owner
+            where u_count > 0
+        """,
+        """
+            select 
+            user.username as '顾问',
+            odata.name as '客户名称',
+            odata.count as '订单数量',
+            odata.amount as '订单总金额'
+            from
+            (
+            select crm_customer.owner, crm_customer.id, crm_customer.platform_account, crm_customer.name, sum(o.receivable) as amount, count(*) as count from crm_customer
+            left join
+            (
+            select p_order_id as id, sum(receivable) as receivable, customer_id from bwcmall.bo_order 
+            where record_status=1 and order_status not in (0, 4, 6) and payment_date >= :month_start and payment_date < :month_end group by p_order_id
+            ) as o on o.customer_id=crm_customer.platform_account
+            where crm_customer.record_status and crm_customer.owner is not null 
+            and crm_customer.platform_account is not null
+            and o.id is not null
+            group by crm_customer.owner, crm_customer.id order by crm_customer.owner
+            ) as odata
+            left join crm_user user on user.id=odata.owner
+        """,
+        """
+            select
+            user.username as '顾问', 
+            oafter.name as '客户名称',
+            oafter.count as '售后单数',
+            oafter.amount as '售后总金额'
+            from
+            (
+            select crm_customer.owner, crm_customer.id, crm_customer.platform_account, crm_customer.name, sum(o.amount) as amount, count(*) as count from crm_customer
+            left join bwcmall.bo_order_after_sale o on o.record_status=1 and o.after_sale_status=8 and o.customer_id=crm_customer.platform_account
+            where crm_customer.record_status and crm_customer.owner is not null 
+                and crm_customer.platform_account is not null
+                and o.id is not null and o.modify_time >= :month_start and o.modify_time < :month_end
+            group by crm_customer.owner, crm_customer.id order by crm_customer.owner
+            ) as oafter 
+            left join crm_user user on user.id=oafter.owner
+        """,
+    ]
+
+
+def month_params(month_first: str, next_month_first: str) -> dict:
+    return {"month_start": month_first, "month_end": next_month_first}
+
+
+# 按月、按客户汇总的订单和售后数据，三个工作表都可以由它计算得到
+def build_customer_fact_queries(
+    month_first: str, next_month_first: str
+) -> Dict[str, QuerySpec]:
+    params = month_params(month_first, next_month_first)
+    return {
+        "订单": QuerySpec(
+            "crm",
+            """
+            select
+            crm_customer.owner as '顾问ID',
+            user.username as '顾问',
+            crm_customer.id as '客户ID',
+            crm_customer.name as '客户名称',
+            count(*) as '单数',
+            sum(o.receivable) as '金额'
+            from crm_customer
+            join
+            (
+            select p_order_id as id, sum(receivable) as receivable, customer_id from bwcmall.bo_order
+            where record_status=1 and order_status not in (0, 4, 6)
+                and payment_date >= :month_start and payment_date < :month_end
+            group by p_order_id
+            ) as o on o.customer_id=crm_customer.platform_account
+            left join crm_user user on user.id=crm_customer.owner
+            where crm_customer.record_status and crm_customer.owner is not null
+                and crm_customer.platform_account is not null
+            group by crm_customer.owner, crm_customer.id
             """,
-        ]
-        sheet_names = ["SQL（总计）", "订单明细", "售后明细"]
-        dataframes = []
-
-        for query in queries:
-            df = search_db(db_engine, query)
-            dataframes.append(df)
-
-        output_file = f"consultant_trade_report_{last_month}.xlsx"
-        generate_excel(dataframes, sheet_names, output_file)
-
-        # 发送邮件
-        email_sender = EmailSender(sender_email, password)
-        subject = f"顾问交易报告 - {last_month}"
-        body = f"请查看附件中的{last_month}月顾问交易报告。"
-        email_sender.send_email(output_file, receiver_email, cc_email, subject, body)
-
-        # 删除文件
-        os.remove(output_file)
-    except Exception as e:
-        logger.error(f"发生错误: {e}")
-    finally:
-        db_engine.dispose()
+            params=params,
+        ),
+        "售后": QuerySpec(
+            "crm",
+            """
+            select
+            crm_customer.owner as '顾问ID',
+            user.username as '顾问',
+            crm_customer.id as '客户ID',
+            crm_customer.name as '客户名称',
+            count(*) as '单数',
+            sum(o.amount) as '金额'
+            from crm_customer
+            join bwcmall.bo_order_after_sale o on o.record_status=1 and o.after_sale_status=8
+                and o.customer_id=crm_customer.platform_account
+                and o.modify_time >= :month_start and o.modify_time < :month_end
+            left join crm_user user on user.id=crm_customer.owner
+            where crm_customer.record_status and crm_customer.owner is not null
+                and crm_customer.platform_account is not null
+            group by crm_customer.owner, crm_customer.id
+            """,
+            params=params,
+        ),
+    }
+
+
+# 查询结果转换为按月汇总行，金额以分为单位存储
+def to_customer_facts(results: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    df_facts = pd.concat(
+        [df.assign(类型=kind) for kind, df in results.items()], ignore_index=True
+    )
+    df_facts["金额"] = to_cents(df_facts["金额"])
+    return df_facts
+
+
+# 按月、类型（订单 / 售后）、客户物化的汇总表
+CUSTOMER_FACTS = FactSource(
+    name="consultant_customer_month",
+    build_queries=build_customer_fact_queries,
+    transform=to_customer_facts,
+)
+
+
+# 由按客户汇总的数据计算三个工作表，与 build_queries 的结果一致
+def build_sheets_from_facts(df_facts: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    df_facts = df_facts.assign(金额=df_facts["金额"] / 100).sort_values(
+        ["顾问ID", "客户ID"]
+    )
+    df_orders = df_facts[df_facts["类型"] == "订单"]
+    df_after_sales = df_facts[df_facts["类型"] == "售后"]
+
+    df_summary = df_orders.groupby(["顾问ID", "顾问"], as_index=False).agg(
+        下单客户数=("客户ID", "count"),
+        订单数量=("单数", "sum"),
+        订单总金额=("金额", "sum"),
+    )
+    df_summary = df_summary.merge(
+        df_after_sales.groupby("顾问ID", as_index=False).agg(售后总金额=("金额", "sum")),
+        on="顾问ID",
+        how="left",
+    ).fillna({"售后总金额": 0})
+
+    return {
+        SHEET_NAMES[0]: df_summary.drop(columns="顾问ID"),
+        SHEET_NAMES[1]: df_orders[["顾问", "客户名称", "单数", "金额"]].rename(
+            columns={"单数": "订单数量", "金额": "订单总金额"}
+        ),
+        SHEET_NAMES[2]: df_after_sales[["顾问", "客户名称", "单数", "金额"]].rename(
+            columns={"单数": "售后单数", "金额": "售后总金额"}
+        ),
+    }
+
+
+def build_report_spec(date: datetime = None) -> ReportSpec:
+    last_month = get_last_month(date)
+    # 配置了按月汇总存储时从汇总表读取，缺失的月份会先物化
+    fact_store = MonthlyFactStore.from_env()
+
+    def process(
+        results: Dict[str, pd.DataFrame], runner: ReportRunner
+    ) -> Dict[str, pd.DataFrame]:
+        df_facts = load_months(runner, fact_store, CUSTOMER_FACTS, [last_month])
+        return build_sheets_from_facts(df_facts)
+
+    if fact_store:
+        queries = {}
+    else:
+        params = month_params(*month_bounds(last_month))
+        queries = {
+            sheet_name: QuerySpec("crm", query, params=params)
+            for sheet_name, query in zip(SHEET_NAMES, build_queries())
+        }
+
+    return ReportSpec(
+        name=current_file_name,
+        subject=f"顾问交易报告 - {last_month}",
+        body=f"请查看附件中的{last_month}月顾问交易报告。",
+        output_file=f"consultant_trade_report_{last_month}.xlsx",
+        period=last_month,
+        queries=queries,
+        process=process if fact_store else None,
+    )
+
+
+if __name__ == "__main__":
+    run_reports([build_report_spec()])
@@ -1,8 +1,94 @@
+import io
+import os
+import re
+import uuid
+import base64
+import hashlib
+import shutil
+import logging
 import smtplib
+import tempfile
+import threading
+import zipfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from email.generator import BytesGenerator
+from email.message import Message
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
-from email import encoders
+from typing import Callable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 连接被服务端关闭或超时时重新连接后重试
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, TimeoutError, ConnectionError)
+# 附件按块读取并 base64 编码，57 字节的倍数编码后正好是完整的 76 字符行
+ATTACHMENT_CHUNK_SIZE = 57 * 1024
+# 超过该大小（字节）的附件压缩为 zip 后发送，未设置时不压缩
+ZIP_THRESHOLD = int(os.getenv("EMAIL_SENDER_ZIP_THRESHOLD", "0"))
+# 单封邮件编码后的大小上限，超过时附件拆分到多封邮件中发送
+MAX_MESSAGE_BYTES = int(
+    os.getenv("EMAIL_SENDER_MAX_MESSAGE_BYTES", str(50 * 1024 * 1024))
+)
+# 单个附件超过上限时复制到该目录，邮件正文中改为文件链接
+FILE_DROP_DIR = os.getenv("EMAIL_SENDER_FILE_DROP_DIR")
+# 文件链接的前缀（如共享盘或下载地址），未设置时使用文件在 FILE_DROP_DIR 中的路径
+FILE_DROP_URL = os.getenv("EMAIL_SENDER_FILE_DROP_URL")
+
+
+@dataclass
+class Email:
+    """
+    一封带附件的邮件
+    :param file_path: 附件路径，没有附件时为 None
+    :param receiver_email: 收件人
+    :param cc_email: 抄送人，多个以逗号分隔
+    :param subject: 主题
+    :param body: 正文
+    :param attachments: 更多附件路径
+    :param message_id: 邮件的 Message-ID（不含尖括号），拆分为多封时每封加上序号
+    """
+
+    file_path: Optional[str]
+    receiver_email: str
+    cc_email: Optional[str]
+    subject: str
+    body: str
+    attachments: List[str] = field(default_factory=list)
+    message_id: Optional[str] = None
+
+    @property
+    def paths(self) -> List[str]:
+        return ([self.file_path] if self.file_path else []) + self.attachments
+
+    @property
+    def to_addrs(self) -> List[str]:
+        return [self.receiver_email] + (
+            self.cc_email.split(",") if self.cc_email else []
+        )
+
+
+# base64 编码后的大小（含每 76 个字符的换行）
+def encoded_size(path: str) -> int:
+    lines = -(-os.path.getsize(path) // 57)
+    return lines * 78
+
+
+# 以 CRLF 换行展开 MIME 对象，非 ASCII 的头部按 RFC 2047 编码
+def _flatten(message: Message) -> bytes:
+    buffer = io.BytesIO()
+    BytesGenerator(buffer, policy=message.policy.clone(linesep="\r\n")).flatten(message)
+    # SMTP DATA 中以 . 开头的行需要再加一个 .
+    return re.sub(rb"(?m)^\.", b"..", buffer.getvalue())
+
+
+# 逐块读取文件并输出 base64 行，内存中只保留一个块
+def _iter_base64(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while chunk := f.read(ATTACHMENT_CHUNK_SIZE):
+            yield base64.encodebytes(chunk).replace(b"\n", b"\r\n")
 
 
 class EmailSender:
@@ -12,11 +98,195 @@ class EmailSender:
         password: str,
         smtp_server: str = "smtp.exmail.qq.com",
         smtp_port: int = 465,
+        use_ssl: bool = True,
+        pool_size: int = None,
+        timeout: float = 60,
     ):
+        """
+        通过 SMTP 发送邮件，已登录的连接在发送之间复用
+        :param use_ssl: 使用 SMTP_SSL 连接，本地替身服务可以关闭
+        :param pool_size: 最多保留的空闲连接数，也是 send_many 的并行连接数
+        :param timeout: 连接和收发的超时时间（秒）
+        """
         self.sender_email = sender_email
         self.password = password
         self.smtp_server = smtp_server
         self.smtp_port = smtp_port
+        self.use_ssl = use_ssl
+        self.pool_size = pool_size or int(os.getenv("EMAIL_SENDER_POOL_SIZE", "3"))
+        self.timeout = timeout
+        self._idle: List[smtplib.SMTP] = []
+        self._idle_lock = threading.Lock()
+
+    # 从环境变量创建，EMAIL_SMTP_SERVER / EMAIL_SMTP_PORT / EMAIL_SMTP_SSL 可指向本地替身服务
+    @classmethod
+    def from_env(cls) -> "EmailSender":
+        return cls(
+            os.getenv("SENDER_EMAIL"),
+            os.getenv("EMAIL_PASSWORD"),
+            smtp_server=os.getenv("EMAIL_SMTP_SERVER", "smtp.exmail.qq.com"),
+            smtp_port=int(os.getenv("EMAIL_SMTP_PORT", "465")),
+            use_ssl=os.getenv("EMAIL_SMTP_SSL", "1") == "1",
+        )
+
+    def __enter__(self) -> "EmailSender":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        server = smtp_class(self.smtp_server, self.smtp_port, timeout=self.timeout)
+        if self.password:
+            server.login(self.sender_email, self.password)
+        return server
+
+    # 优先复用空闲连接，没有时新建连接并登录
+    def _acquire(self) -> smtplib.SMTP:
+        with self._idle_lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    # 用完的连接放回空闲列表，超过 pool_size 的直接关闭
+    def _release(self, server: smtplib.SMTP) -> None:
+        with self._idle_lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(server)
+                return
+        self._quit(server)
+
+    @staticmethod
+    def _quit(server: smtplib.SMTP) -> None:
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    # 关闭所有空闲连接
+    def close(self) -> None:
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for server in idle:
+            self._quit(server)
+
+    # 按块生成邮件内容：头部和正文一次生成，附件边读文件边编码，不在内存中拼出整封邮件
+    def iter_message(
+        self,
+        email: Email,
+        subject: str,
+        body: str,
+        paths: List[str],
+        message_id: str = None,
+    ) -> Iterator[bytes]:
+        boundary = f"==============={uuid.uuid4().hex}=="
+        message = MIMEMultipart(boundary=boundary)
+        message["From"] = self.sender_email
+        message["To"] = email.receiver_email
+        if email.cc_email:
+            message["Cc"] = email.cc_email
+        message["Subject"] = subject
+        if message_id:
+            message["Message-ID"] = f"<{message_id}>"
+        message.attach(MIMEText(body, "plain"))
+        head = _flatten(message)
+        closing = f"--{boundary}--\r\n".encode()
+        yield head[: -len(closing)]
+
+        for path in paths:
+            part = MIMEBase("application", "octet-stream")
+            part["Content-Transfer-Encoding"] = "base64"
+            part.add_header(
+                "Content-Disposition",
+                "attachment",
+                filename=("utf-8", "", os.path.basename(path)),
+            )
+            part.set_payload("")
+            yield f"--{boundary}\r\n".encode() + _flatten(part)
+            yield from _iter_base64(path)
+            yield b"\r\n"
+        yield closing
+
+    # 超过 ZIP_THRESHOLD 的附件压缩到临时目录中
+    def compress(self, path: str, tmp_dir: str) -> str:
+        if not ZIP_THRESHOLD or os.path.getsize(path) <= ZIP_THRESHOLD:
+            return path
+        zip_path = os.path.join(tmp_dir, f"{os.path.basename(path)}.zip")
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.write(path, os.path.basename(path))
+        return zip_path
+
+    # 将超大附件复制到 FILE_DROP_DIR，返回邮件中使用的链接；
+    # 文件名带内容哈希，重试或重复发送同一文件时复用已复制的文件
+    def drop_file(self, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(ATTACHMENT_CHUNK_SIZE):
+                digest.update(chunk)
+        name = f"{digest.hexdigest()[:16]}_{os.path.basename(path)}"
+        drop_path = os.path.join(FILE_DROP_DIR, name)
+        if not os.path.exists(drop_path):
+            os.makedirs(FILE_DROP_DIR, exist_ok=True)
+            # 先复制到临时文件再改名，避免中断时留下不完整的文件
+            tmp_path = f"{drop_path}.{uuid.uuid4().hex[:8]}.tmp"
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, drop_path)
+        if FILE_DROP_URL:
+            return f"{FILE_DROP_URL.rstrip('/')}/{name}"
+        return os.path.abspath(os.path.join(FILE_DROP_DIR, name))
+
+    # 按大小上限把附件分配到一封或多封邮件，返回 [(主题, 正文, 附件路径)]
+    def plan_messages(self, email: Email, tmp_dir: str) -> List[tuple]:
+        groups, links, size = [[]], [], 0
+        for path in (self.compress(path, tmp_dir) for path in email.paths):
+            path_size = encoded_size(path)
+            if path_size > MAX_MESSAGE_BYTES:
+                if FILE_DROP_DIR:
+                    links.append(self.drop_file(path))
+                    continue
+                logger.warning(
+                    f"附件 {path} 超过邮件大小上限且未设置 EMAIL_SENDER_FILE_DROP_DIR，"
+                    "仍作为附件发送"
+                )
+            if groups[-1] and size + path_size > MAX_MESSAGE_BYTES:
+                groups.append([])
+                size = 0
+            groups[-1].append(path)
+            size += path_size
+
+        body = email.body
+        if links:
+            body += "\n\n附件过大，请通过以下链接获取：\n" + "\n".join(links)
+        if len(groups) == 1:
+            return [(email.subject, body, groups[0])]
+        return [
+            (f"{email.subject}（{i}/{len(groups)}）", body, group)
+            for i, group in enumerate(groups, 1)
+        ]
+
+    # 在一个连接上依次发送多封邮件，结束后连接放回空闲列表；
+    # 因异常退出时连接状态未知，直接关闭而不放回
+    @contextmanager
+    def session(self) -> Iterator["SmtpSession"]:
+        session = SmtpSession(self)
+        try:
+            yield session
+        except BaseException:
+            session.discard()
+            raise
+        finally:
+            if session.server is not None:
+                self._release(session.server)
+
+    def send(
+        self,
+        email: Email,
+        skip_parts: int = 0,
+        on_part_sent: Callable[[int], None] = None,
+    ) -> None:
+        with self.session() as session:
+            session.send(email, skip_parts, on_part_sent)
 
     def send_email(
         self,
@@ -26,24 +296,138 @@ class EmailSender:
         subject: str,
         body: str,
     ) -> None:
-        message = MIMEMultipart()
-        message["From"] = self.sender_email
-        message["To"] = receiver_email
-        message["Cc"] = cc_email
-        message["Subject"] = subject
+        self.send(Email(file_path, receiver_email, cc_email, subject, body))
 
-        message.attach(MIMEText(body, "plain"))
+    # 通过最多 pool_size 个连接并行发送，返回与 emails 顺序一致的异常列表（成功为 None）
+    def send_many(
+        self, emails: List[Email], max_workers: int = None
+    ) -> List[Optional[Exception]]:
+        if not emails:
+            return []
+        workers = min(max_workers or self.pool_size, len(emails))
+        errors: List[Optional[Exception]] = [None] * len(emails)
 
-        with open(file_path, "rb") as attachment:
-            part = MIMEBase("application", "octet-stream")
-            part.set_payload(attachment.read())
+        # 每个线程占用一个连接，按顺序发送分到的邮件
+        def send_batch(indexes: List[int]) -> None:
+            with self.session() as session:
+                for index in indexes:
+                    try:
+                        session.send(emails[index])
+                    except Exception as e:
+                        errors[index] = e
 
-        encoders.encode_base64(part)
-        part.add_header("Content-Disposition", f"attachment; filename= {file_path}")
-        message.attach(part)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [
+                executor.submit(send_batch, list(range(i, len(emails), workers)))
+                for i in range(workers)
+            ]:
+                future.result()
+        return errors
 
-        with smtplib.SMTP_SSL(self.smtp_server, self.smtp_port) as server:
-            server.login(self.sender_email, self.password)
-            server.send_message(
-                message, to_addrs=[receiver_email] + cc_email.split(",")
-            )
+
+class SmtpSession:
+    def __init__(self, sender: EmailSender):
+        """
+        占用一个已登录的 SMTP 连接，在连接断开或超时时透明地重连
+        :param sender: 提供连接池的 EmailSender
+        """
+        self.sender = sender
+        self.server: Optional[smtplib.SMTP] = None
+
+    # 附件拆分为多封时，skip_parts 跳过之前已发送的前几封，
+    # 每封发送成功后以序号（从 1 开始）调用 on_part_sent，便于失败后从下一封继续
+    def send(
+        self,
+        email: Email,
+        skip_parts: int = 0,
+        on_part_sent: Callable[[int], None] = None,
+    ) -> None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            messages = self.sender.plan_messages(email, tmp_dir)
+            for index, (subject, body, paths) in enumerate(messages, 1):
+                if index <= skip_parts:
+                    continue
+                message_id = email.message_id
+                if message_id and len(messages) > 1:
+                    message_id = f"{index}.{message_id}"
+                self.send_chunks(
+                    lambda: self.sender.iter_message(
+                        email, subject, body, paths, message_id
+                    ),
+                    email.to_addrs,
+                )
+                if on_part_sent:
+                    on_part_sent(index)
+
+    # 发送一封邮件；chunks 每次调用重新生成邮件内容，重连后可以重发
+    def send_chunks(
+        self, chunks: Callable[[], Iterator[bytes]], to_addrs: List[str]
+    ) -> None:
+        if self.server is None:
+            self.server = self.sender._acquire()
+        try:
+            self._send_or_discard(chunks, to_addrs)
+            return
+        except RECONNECT_ERRORS:
+            pass
+        except smtplib.SMTPResponseException as e:
+            # 421 表示服务端即将关闭连接（如空闲超时）
+            if e.smtp_code != 421:
+                raise
+        # 空闲连接可能已被服务端关闭，用新连接重试一次
+        self.server = self.sender._connect()
+        self._send_or_discard(chunks, to_addrs)
+
+    # 出错时连接可能停在 MAIL 或 DATA 中间（如读取附件失败时邮件只写了一半），
+    # 继续使用会把下一封邮件的命令写进这封邮件的内容；
+    # 除全部收件人被拒绝（已 RSET）外，出错后都关闭连接，下一封使用新连接
+    def _send_or_discard(
+        self, chunks: Callable[[], Iterator[bytes]], to_addrs: List[str]
+    ) -> None:
+        try:
+            self._send_data(chunks(), to_addrs)
+        except smtplib.SMTPRecipientsRefused:
+            raise
+        except BaseException:
+            self.discard()
+            raise
+
+    def discard(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+    # 与 smtplib 相同，RSET 时连接已断开则忽略
+    def _rset(self) -> None:
+        try:
+            self.server.rset()
+        except smtplib.SMTPServerDisconnected:
+            pass
+
+    # 与 smtplib.sendmail 相同的 MAIL / RCPT / DATA 流程，DATA 内容逐块写入连接
+    def _send_data(self, chunks: Iterator[bytes], to_addrs: List[str]) -> None:
+        server = self.server
+        server.ehlo_or_helo_if_needed()
+        code, response = server.mail(self.sender.sender_email)
+        if code != 250:
+            self._rset()
+            raise smtplib.SMTPSenderRefused(code, response, self.sender.sender_email)
+        refused = {}
+        for addr in to_addrs:
+            code, response = server.rcpt(addr)
+            if code not in (250, 251):
+                refused[addr] = (code, response)
+        if len(refused) == len(to_addrs):
+            self._rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, response = server.docmd("DATA")
+        if code != 354:
+            self._rset()
+            raise smtplib.SMTPDataError(code, response)
+        for chunk in chunks:
+            server.send(chunk)
+        code, response = server.docmd(".")
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+        if refused:
+            logger.warning(f"部分收件人被拒绝: {refused}")
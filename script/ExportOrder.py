@@ -1,12 +1,16 @@
 import pandas as pd
+import argparse
 import logging
 import os
-import sys
 from sqlalchemy import create_engine
-from urllib.parse import quote_plus
-from dotenv import load_dotenv
 from typing import List
-from EmailSender import EmailSender
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from query_runner import TEMP_TABLE_THRESHOLD, fetch_by_ids, run_query, unique_ids
+from query_cache import QueryCache
+from order_profit_store import OrderProfitStore
+from stream_export import SUPPORTED_FORMATS, read_keyset_chunks, write_chunks
+from report_runner import ReportRunner, ReportSpec, run_reports
 
 # 配置日志
 logging.basicConfig(
@@ -17,55 +21,107 @@ logger = logging.getLogger(__name__)
 # 获取文件名（不带扩展名）
 current_file_name = os.path.splitext(os.path.basename(__file__))[0].upper()
 
-# 加载环境变量
-load_dotenv()
-
-
-def fetch_data(engine: create_engine, sql: str) -> pd.DataFrame:
-    return pd.read_sql(sql, engine)
+# 按 (create_time, id) 键集分页读取，{keyset} 处由 read_keyset_chunks 追加翻页条件；
+# InnoDB 的 create_time 索引隐含主键 id，翻页查询可以直接走该索引
+QUERY_ORDER = """
+SELECT id, terminal_name, create_time, sn, bwc_order_id, order_status 
+FROM ko_order 
+WHERE record_status = 1 AND bwc_order_id IS NOT NULL AND order_status != 2 AND create_time >= '2024-01-01'
+{keyset}
+ORDER BY create_time DESC, id DESC
+LIMIT :page_size
+"""
+QUERY_ORDER_KEYSET = ["create_time", "id"]
+
+# 导出文件各列的类型，parquet 按此声明 schema，某一块中整列为空时类型也不会变化
+EXPORT_DTYPES = {
+    "用户名称": "string",
+    "下单时间": "string",
+    "订单号": "string",
+    "bwc_order_id": "string",
+    "订单状态": "string",
+    "总金额": "float64",
+    "cost": "float64",
+    "毛利": "float64",
+}
+
+
+# 通过共享的查询执行器访问数据库，并发批次受每个数据库的并发上限约束
+def fetch_data(
+    engine: create_engine,
+    sql: str,
+    cache: QueryCache = None,
+    name: str = None,
+    params: dict = None,
+) -> pd.DataFrame:
+    return run_query(engine, sql, cache=cache, params=params, name=name)
 
 
-def fetch_order_data(order_ids: List[int], engine: create_engine) -> pd.DataFrame:
-    order_ids_str = ", ".join(map(str, order_ids))
-    order_sql = f"""
+def fetch_order_data(
+    order_ids: List[int], engine: create_engine, temp_table_threshold: int = None
+) -> pd.DataFrame:
+    order_sql = """
     SELECT id as order_id, p_order_id as bwc_order_id, receivable 
     FROM bo_order 
-    WHERE record_status = 1 AND p_order_id IN ({order_ids_str})
+    WHERE record_status = 1 AND p_order_id IN :ids
     """
-    df_order = fetch_data(engine, order_sql)
+    df_order = fetch_by_ids(
+        engine,
+        order_sql,
+        order_ids,
+        temp_table_threshold=temp_table_threshold,
+        name="order",
+    )
 
-    o_ids_str = ", ".join(map(str, df_order["order_id"].tolist()))
-    order_after_sql = f"""
+    order_after_sql = """
     SELECT order_id, SUM(IFNULL(amount, 0)) as sales_after_amount 
     FROM bo_order_after_sale 
-    WHERE record_status = 1 AND order_id IN ({o_ids_str}) AND after_sale_status = 8
+    WHERE record_status = 1 AND order_id IN :ids AND after_sale_status = 8
     GROUP BY order_id
     """
-    df_order_after = fetch_data(engine, order_after_sql)
+    df_order_after = fetch_by_ids(
+        engine,
+        order_after_sql,
+        df_order["order_id"],
+        temp_table_threshold=temp_table_threshold,
+        name="order_after_sale",
+    )
 
     rs = pd.merge(df_order, df_order_after, on="order_id", how="left").fillna(0)
     rs["order_amount"] = rs["receivable"] - rs["sales_after_amount"]
     return rs.drop(columns=["receivable", "sales_after_amount"])
 
 
-def fetch_purchase_data(order_ids: List[int], engine) -> pd.DataFrame:
-    order_ids_str = ", ".join(map(str, order_ids))
-    purchase_sql = f"""
+def fetch_purchase_data(
+    order_ids: List[int], engine, temp_table_threshold: int = None
+) -> pd.DataFrame:
+    purchase_sql = """
     SELECT p.id as purchase_id, p.payable as purchase_amount, r.order_id 
     FROM bo_purchase p 
     LEFT JOIN bo_order_purchase_rela r ON p.id = r.purchase_id
-    WHERE p.record_status = 1 AND r.record_status = 1 AND p.purchase_status != 2 AND r.order_id IN ({order_ids_str})       
+    WHERE p.record_status = 1 AND r.record_status = 1 AND p.purchase_status != 2 AND r.order_id IN :ids
     """
-    df_purchase = fetch_data(engine, purchase_sql)
+    df_purchase = fetch_by_ids(
+        engine,
+        purchase_sql,
+        order_ids,
+        temp_table_threshold=temp_table_threshold,
+        name="purchase",
+    )
 
-    purchase_ids_str = ", ".join(map(str, df_purchase["purchase_id"].tolist()))
-    purchase_after_sql = f"""
+    purchase_after_sql = """
     SELECT purchase_id, SUM(IFNULL(amount, 0)) as purchase_after_amount 
     FROM bo_purchase_after_sale 
-    WHERE record_status = 1 AND purchase_id IN ({purchase_ids_str})  
+    WHERE record_status = 1 AND purchase_id IN :ids  
     GROUP BY purchase_id 
     """
-    df_purchase_after = fetch_data(engine, purchase_after_sql)
+    df_purchase_after = fetch_by_ids(
+        engine,
+        purchase_after_sql,
+        df_purchase["purchase_id"],
+        temp_table_threshold=temp_table_threshold,
+        name="purchase_after_sale",
+    )
 
     rs = pd.merge(df_purchase, df_purchase_after, on="purchase_id", how="left").fillna(
         0
@@ -74,40 +130,207 @@ def fetch_purchase_data(order_ids: List[int], engine) -> pd.DataFrame:
     return rs.drop(columns=["purchase_amount", "purchase_after_amount"])
 
 
+# 处理单个批次：查询订单和采购数据，按 bwc_order_id 汇总金额、成本和毛利
+def process_batch(
+    batch_order_ids: List[int],
+    engine: create_engine,
+    temp_table_threshold: int = None,
+) -> pd.DataFrame:
+    df_order_batch = fetch_order_data(batch_order_ids, engine, temp_table_threshold)
+    df_purchase_batch = fetch_purchase_data(
+        df_order_batch["order_id"].tolist(), engine, temp_table_threshold
+    )
+
+    df_purchase_summary = (
+        df_purchase_batch.groupby("order_id").agg({"cost": "sum"}).reset_index()
+    )
+    df_result = pd.merge(df_order_batch, df_purchase_summary, on="order_id", how="left")
+    df_result = (
+        df_result.groupby("bwc_order_id")
+        .agg({"order_amount": "sum", "cost": "sum"})
+        .reset_index()
+    )
+    df_result["profit"] = df_result["order_amount"] - df_result["cost"]
+    return df_result
+
+
+# 多个批次同时在途，每个批次的结果先收集到列表中，最后统一合并
+def process_batches(
+    p_order_ids: List[int],
+    bwcmall_engine: create_engine,
+    batch_size: int,
+    max_workers: int,
+) -> List[pd.DataFrame]:
+    batches = [
+        p_order_ids[i : i + batch_size] for i in range(0, len(p_order_ids), batch_size)
+    ]
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(process_batch, batch, bwcmall_engine): index
+            for index, batch in enumerate(batches)
+        }
+        for future in as_completed(futures):
+            logger.info(f"第 {futures[future] + 1}/{len(batches)} 批次的数据查询完成")
+            results.append(future.result())
+    return results
+
+
 def process_data(
-    df_kestrel_order: pd.DataFrame, bwcmall_engine: create_engine
+    df_kestrel_order: pd.DataFrame,
+    bwcmall_engine: create_engine,
+    batch_size: int = None,
+    max_workers: int = None,
+    temp_table_threshold: int = None,
 ) -> pd.DataFrame:
     p_order_ids = df_kestrel_order["bwc_order_id"].tolist()
-    batch_size = 1000
-    df_calculate_data = pd.DataFrame()
-
-    for i in range(0, len(p_order_ids), batch_size):
-        batch_order_ids = p_order_ids[i : i + batch_size]
-        logger.info(f"查询第 {i // batch_size + 1} 批次的数据")
-        df_order_batch = fetch_order_data(batch_order_ids, bwcmall_engine)
-        df_purchase_batch = fetch_purchase_data(
-            df_order_batch["order_id"].tolist(), bwcmall_engine
-        )
+    if batch_size is None:
+        batch_size = int(os.getenv(f"{current_file_name}_BATCH_SIZE", "1000"))
+    if max_workers is None:
+        max_workers = int(os.getenv(f"{current_file_name}_MAX_WORKERS", "4"))
+    # id 总数超过临时表阈值时不再分批：每一步查询对全部 id（及关联出的订单 / 采购 id）
+    # 各使用一个临时表在服务端关联；分批时批内 id 远少于阈值，按分块 IN 查询
+    temp_table_threshold = temp_table_threshold or TEMP_TABLE_THRESHOLD
+    if len(unique_ids(p_order_ids)) > temp_table_threshold:
+        results = [process_batch(p_order_ids, bwcmall_engine, temp_table_threshold)]
+    else:
+        results = process_batches(p_order_ids, bwcmall_engine, batch_size, max_workers)
+
+    df_calculate_data = (
+        pd.concat(results, ignore_index=True)
+        if results
+        else pd.DataFrame(columns=["bwc_order_id", "order_amount", "cost", "profit"])
+    )
+    return pd.merge(
+        df_kestrel_order, df_calculate_data, on="bwc_order_id", how="left"
+    ).fillna(0)
 
-        df_purchase_summary = (
-            df_purchase_batch.groupby("order_id").agg({"cost": "sum"}).reset_index()
-        )
-        df_result = pd.merge(
-            df_order_batch, df_purchase_summary, on="order_id", how="left"
-        )
-        df_result = (
-            df_result.groupby("bwc_order_id")
-            .agg({"order_amount": "sum", "cost": "sum"})
-            .reset_index()
+
+# 查询自 since 以来订单、售后、采购、采购售后有变动的 bwc_order_id
+def fetch_changed_order_ids(engine: create_engine, since: str) -> set:
+    changed_sql = """
+    SELECT p_order_id AS bwc_order_id FROM bo_order WHERE modify_time >= :since
+    UNION
+    SELECT o.p_order_id FROM bo_order_after_sale s
+    JOIN bo_order o ON s.order_id = o.id
+    WHERE s.modify_time >= :since
+    UNION
+    SELECT o.p_order_id FROM bo_purchase p
+    JOIN bo_order_purchase_rela r ON p.id = r.purchase_id
+    JOIN bo_order o ON r.order_id = o.id
+    WHERE p.modify_time >= :since OR r.modify_time >= :since
+    UNION
+    SELECT o.p_order_id FROM bo_purchase_after_sale pas
+    JOIN bo_order_purchase_rela r ON pas.purchase_id = r.purchase_id
+    JOIN bo_order o ON r.order_id = o.id
+    WHERE pas.modify_time >= :since
+    """
+    df_changed = fetch_data(
+        engine, changed_sql, name="changed_order_ids", params={"since": since}
+    )
+    return set(df_changed["bwc_order_id"].dropna().tolist())
+
+
+def fetch_db_now(engine: create_engine) -> str:
+    return str(fetch_data(engine, "SELECT NOW() AS now", name="db_now")["now"].iloc[0])
+
+
+# 开始一次增量计算：返回新水位，以及自上次水位以来有变动的订单（None 表示需要全量重建）
+def begin_incremental(
+    bwcmall_engine: create_engine, store: OrderProfitStore, full_rebuild: bool = False
+) -> tuple:
+    # 先取数据库时间作为新水位，运行期间发生的变更会在下次运行时被重新计算
+    new_watermark = fetch_db_now(bwcmall_engine)
+    watermark = None if full_rebuild else store.get_watermark()
+    if watermark is None:
+        logger.info("全量重建订单毛利数据")
+        store.clear()
+        return new_watermark, None
+
+    changed_ids = fetch_changed_order_ids(bwcmall_engine, watermark)
+    logger.info(f"自 {watermark} 以来变动的订单 {len(changed_ids)} 条")
+    return new_watermark, changed_ids
+
+
+# 只重新计算本地存储中没有的订单以及有变动的订单，其余直接从本地存储读取
+def enrich_from_store(
+    df_kestrel_order: pd.DataFrame,
+    bwcmall_engine: create_engine,
+    store: OrderProfitStore,
+    changed_ids: set = None,
+) -> pd.DataFrame:
+    order_ids = set(df_kestrel_order["bwc_order_id"])
+    if changed_ids is None:
+        stale_ids = order_ids
+    else:
+        missing_ids = order_ids - set(store.load(list(order_ids))["bwc_order_id"])
+        stale_ids = missing_ids | (changed_ids & order_ids)
+
+    if stale_ids:
+        df_recalculated = process_data(
+            pd.DataFrame({"bwc_order_id": list(stale_ids)}), bwcmall_engine
         )
-        df_result["profit"] = df_result["order_amount"] - df_result["cost"]
-        df_calculate_data = pd.concat([df_calculate_data, df_result], ignore_index=True)
+        store.upsert(df_recalculated)
 
     return pd.merge(
-        df_kestrel_order, df_calculate_data, on="bwc_order_id", how="left"
+        df_kestrel_order,
+        store.load(list(order_ids)),
+        on="bwc_order_id",
+        how="left",
     ).fillna(0)
 
 
+def process_data_incremental(
+    df_kestrel_order: pd.DataFrame,
+    bwcmall_engine: create_engine,
+    store: OrderProfitStore,
+    full_rebuild: bool = False,
+) -> pd.DataFrame:
+    new_watermark, changed_ids = begin_incremental(bwcmall_engine, store, full_rebuild)
+    df_result = enrich_from_store(df_kestrel_order, bwcmall_engine, store, changed_ids)
+    store.set_watermark(new_watermark)
+    return df_result
+
+
+# 流式导出：分页读取销售数据，逐页补充毛利并写入文件，内存占用与订单总数无关；
+# 每页是一次独立查询，补充毛利期间不占着 kestrel 上未读完的结果集
+def export_orders_streaming(
+    kestrel_engine: create_engine,
+    bwcmall_engine: create_engine,
+    store: OrderProfitStore,
+    query_order: str,
+    output_file: str,
+    full_rebuild: bool = False,
+    chunksize: int = 5000,
+) -> str:
+    new_watermark, changed_ids = begin_incremental(bwcmall_engine, store, full_rebuild)
+
+    def enriched_chunks():
+        for index, df_chunk in enumerate(
+            read_keyset_chunks(
+                kestrel_engine,
+                query_order,
+                QUERY_ORDER_KEYSET,
+                chunksize,
+                descending=True,
+            )
+        ):
+            logger.info(f"处理第 {index + 1} 块销售数据，共 {len(df_chunk)} 条")
+            df_chunk = format_data(
+                enrich_from_store(
+                    df_chunk.drop(columns=["id"]), bwcmall_engine, store, changed_ids
+                )
+            )
+            # 在导出之前将 bwc_order_id 转换为字符串类型
+            df_chunk["bwc_order_id"] = df_chunk["bwc_order_id"].astype(str)
+            yield df_chunk
+
+    write_chunks(enriched_chunks(), output_file, dtypes=EXPORT_DTYPES)
+    # 全部数据块处理完成后才推进水位
+    store.set_watermark(new_watermark)
+    return output_file
+
+
 def format_data(df: pd.DataFrame) -> pd.DataFrame:
     df.rename(
         columns={
@@ -133,73 +356,47 @@ def format_data(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def check_required_env_vars() -> bool:
-    required_vars = [
-        "DB_USERNAME",
-        "DB_PASSWORD",
-        "DB_HOSTNAME",
-        "SENDER_EMAIL",
-        "EMAIL_PASSWORD",
-        f"{current_file_name}_RECEIVER_EMAIL",
-        f"{current_file_name}_CC_EMAIL",
-    ]
-    for var in required_vars:
-        if not os.getenv(var):
-            logger.error(f"缺少必要的环境变量: {var}")
-            return False
-    return True
+def build_report_spec(
+    date: datetime = None, full_rebuild: bool = False, output_format: str = "xlsx"
+) -> ReportSpec:
+    # 导出范围不随日期变化，date 只作为这次快照的期间（发件箱中每个日期的快照发送一次）
+    date = date or datetime.now()
+    file_name = f"order_export.{output_format}"
 
+    # 流式导出，不经过通用的查询和 Excel 生成步骤
+    def export(runner: ReportRunner) -> str:
+        store = OrderProfitStore(
+            os.getenv(f"{current_file_name}_STORE_PATH", "export_order_store.db")
+        )
+        return export_orders_streaming(
+            runner.get_engine("kestrel"),
+            runner.get_engine("bwcmall"),
+            store,
+            QUERY_ORDER,
+            file_name,
+            full_rebuild=full_rebuild,
+        )
+
+    return ReportSpec(
+        name=current_file_name,
+        subject="订单报表",
+        body="请查收附件中的订单报表。",
+        output_file=file_name,
+        period=f"{date:%Y-%m-%d}",
+        export=export,
+    )
 
-if __name__ == "__main__":
 
-    if not check_required_env_vars():
-        sys.exit(1)
-
-    # 从环境变量获取配置
-    encoded_db_username = os.getenv("DB_USERNAME")
-    encoded_db_password = os.getenv("DB_PASSWORD")
-    db_hostname = os.getenv("DB_HOSTNAME")
-    sender_email = os.getenv("SENDER_EMAIL")
-    receiver_email = os.getenv(f"{current_file_name}_RECEIVER_EMAIL")
-    cc_email = os.getenv(f"{current_file_name}_CC_EMAIL")
-    password = os.getenv("EMAIL_PASSWORD")
-
-    # 创建数据库引擎
-    kestrel_engine = create_engine(
-        f"mysql+mysqlconnector://{quote_plus(encoded_db_username)}:{quote_plus(encoded_db_password)}@{db_hostname}/kestrel"
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出订单报表")
+    parser.add_argument(
+        "--full", action="store_true", help="忽略本地结果存储，全量重新计算订单毛利"
     )
-    bwcmall_engine = create_engine(
-        f"mysql+mysqlconnector://{quote_plus(encoded_db_username)}:{quote_plus(encoded_db_password)}@{db_hostname}/bwcmall"
+    parser.add_argument(
+        "--format",
+        choices=SUPPORTED_FORMATS,
+        default="xlsx",
+        help="导出文件格式，不需要 Excel 的收件人可以使用 csv.gz 或 parquet",
     )
-    try:
-        query_order = """
-        SELECT terminal_name, create_time, sn, bwc_order_id, order_status 
-        FROM ko_order 
-        WHERE record_status = 1 AND bwc_order_id IS NOT NULL AND order_status != 2 AND create_time >= '2024-01-01'
-        ORDER BY create_time DESC 
-        """
-        df_kestrel_order = fetch_data(kestrel_engine, query_order)
-        logger.info(f"销售数据查询完成，查询到 {len(df_kestrel_order)} 条记录")
-
-        df_calculate_data = process_data(df_kestrel_order, bwcmall_engine)
-        df_formatted = format_data(df_calculate_data)
-
-        # 在导出之前将 bwc_order_id 转换为字符串类型
-        df_formatted["bwc_order_id"] = df_formatted["bwc_order_id"].astype(str)
-
-        file_name = "order_export.xlsx"
-        df_formatted.to_excel(file_name, index=False)
-
-        email_body = "请查收附件中的订单报表。"
-        email_sender = EmailSender(sender_email, password)
-        email_sender.send_email(
-            file_name, receiver_email, cc_email, "订单报表", email_body
-        )
-        os.remove(file_name)
-        logger.info(f"Excel文件 {file_name} 已删除")
-
-    except Exception as e:
-        logger.error(f"发生错误: {e}")
-    finally:
-        kestrel_engine.dispose()
-        bwcmall_engine.dispose()
+    args = parser.parse_args()
+    run_reports([build_report_spec(full_rebuild=args.full, output_format=args.format)])
@@ -6,6 +6,7 @@ import logging
 import aiohttp
 import asyncio
 from dotenv import load_dotenv
+from query_runner import fetch_in_chunks
 
 # 配置日志
 logging.basicConfig(
@@ -22,10 +23,6 @@ def read_excel(file_path: str, sheet_name: str, start_row: int = 1) -> pd.DataFr
     return pd.read_excel(file_path, sheet_name=sheet_name, skiprows=start_row)
 
 
-def search_db(db_engine: create_engine, query: str) -> pd.DataFrame:
-    return pd.read_sql(query, db_engine)
-
-
 async def download_image(
     session: aiohttp.ClientSession, resource: str, spu_directory: str
 ) -> None:
@@ -82,44 +79,41 @@ def main() -> None:
         df = read_excel("./data/delData.xlsx", "商品信息", 4)
         # 获取第一列数据
         goods_ids = df.iloc[:, 0].drop_duplicates().tolist()
-        goods_ids_str = ", ".join(map(str, goods_ids))
 
         # 获取商品对应的sku和spu信息
-        get_goods_sku_spu_sql = f"""
+        get_goods_sku_spu_sql = """
         select g.id as goods_id ,g.name as goods_name , s.id as sku_id,s.name as sku_name,spu.id as spu_id,spu.name as spu_name from bc_shop_goods g 
         left join bc_shop_goods_sku_rela gsr on g.id = gsr.goods_id 
         left join bp_sku s on gsr.sku_id = s.id
         left join bp_spu spu on s.spu_id = spu.id
-        where g.id in ({goods_ids_str}) 
+        where g.id in :ids
         and g.record_status = 1
         and gsr.record_status = 1
         and s.record_status = 1
         and spu.record_status = 1 
         """
-        df_goods_sku_spu = search_db(db_engine, get_goods_sku_spu_sql)
+        df_goods_sku_spu = fetch_in_chunks(db_engine, get_goods_sku_spu_sql, goods_ids)
 
         # 获取spu对应的图片信息
         spu_ids = df_goods_sku_spu["spu_id"].drop_duplicates().tolist()
-        spu_ids_str = ", ".join(map(str, spu_ids))
-        get_spu_pic_sql = f"""
+        get_spu_pic_sql = """
         select sr.spu_id,r.resources from bp_spu_res_rela sr 
         left join bs_resources r on sr.resources_id = r.id 
         where sr.record_status = 1 and r.record_status = 1
-        and sr.spu_id in ({spu_ids_str}) 
+        and sr.spu_id in :ids
         """
-        df_spu_pic = search_db(db_engine, get_spu_pic_sql)
+        df_spu_pic = fetch_in_chunks(db_engine, get_spu_pic_sql, spu_ids)
         df_spu_pic_grouped = df_spu_pic.groupby("spu_id")
 
         # 获取sku对应的图片信息
         sku_ids = df_goods_sku_spu["sku_id"].drop_duplicates().tolist()
-        sku_ids_str = ", ".join(map(str, sku_ids))
-        get_sku_res_sql = f"""
+        get_sku_res_sql = """
         select sr.sku_id,r.resources from bp_sku_res_rela sr 
         left join bs_resources r on sr.resources_id = r.id 
         where sr.record_status = 1 and r.record_status = 1
-        and sr.sku_id in ({sku_ids_str}) 
+        and sr.sku_id in :ids
         """
-        df_sku_pic = search_db(db_engine, get_sku_res_sql)
+        df_sku_pic = fetch_in_chunks(db_engine, get_sku_res_sql, sku_ids)
 
         for spu_id, group in df_goods_sku_spu.groupby("spu_id"):
             df_filtered_sku_pic = df_sku_pic[
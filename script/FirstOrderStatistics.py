@@ -1,37 +1,25 @@
 import os
-import sys
 import pandas as pd
-from dotenv import load_dotenv
 from sqlalchemy import create_engine
-from urllib.parse import quote_plus
-import logging
 from datetime import datetime, timedelta
-from EmailSender import EmailSender
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
-)
-logger = logging.getLogger(__name__)
-
+from query_runner import fetch_by_ids, run_query
+from query_cache import QueryCache
+from report_runner import QuerySpec, ReportRunner, ReportSpec, run_reports
+from typing import Dict
 
 # 获取文件名（不带扩展名）
 current_file_name = os.path.splitext(os.path.basename(__file__))[0].upper()
 
 
-# 加载环境变量
-load_dotenv()
-
-
-def search_db(db_engine: create_engine, query: str) -> pd.DataFrame:
-    return pd.read_sql(query, db_engine)
-
-
-def generate_excel(df: pd.DataFrame) -> str:
-    # 生成Excel文件
-    excel_file = "result.xlsx"
-    df.to_excel(excel_file, index=False)
-    return excel_file
+# name 为查询名称，用于查询指标日志和汇总
+def search_db(
+    db_engine: create_engine,
+    query: str,
+    cache: QueryCache = None,
+    name: str = None,
+    params: dict = None,
+) -> pd.DataFrame:
+    return run_query(db_engine, query, cache=cache, params=params, name=name)
 
 
 def get_previous_two_months(date: datetime = None):
@@ -49,109 +37,231 @@ def get_previous_two_months(date: datetime = None):
     )
 
 
-def check_required_env_vars() -> bool:
-    required_vars = [
-        "DB_USERNAME",
-        "DB_PASSWORD",
-        "DB_HOSTNAME",
-        "SENDER_EMAIL",
-        "EMAIL_PASSWORD",
-        f"{current_file_name}_RECEIVER_EMAIL",
-        f"{current_file_name}_CC_EMAIL",
+# 有效订单条件：正常状态、订单类型为 2、排除待确认和已取消
+VALID_ORDER_CONDITION = (
+    "record_status = 1 and order_type = 2 and order_status not in (0,2)"
+)
+# customer_type 经过左关联后可能是字符串、整数或带空值的浮点数，统一转为数值再映射
+CUSTOMER_TYPE_MAP = {1: "终端", 2: "贸易商"}
+
+
+# 查询中统计窗口的绑定参数：首单时间在 (two_months_ago, current_month] 内的客户为新客，
+# 金额按 last_month 分为前两个月
+def period_params(two_months_ago: str, last_month: str, current_month: str) -> dict:
+    return {
+        "two_months_ago": two_months_ago,
+        "last_month": last_month,
+        "current_month": current_month,
+    }
+
+
+# 一次扫描 ko_order 完成首单统计：ROW_NUMBER 按客户取首单（同一时间取最小订单号），
+# 同一遍中用窗口 SUM 计算两个月的金额；首单须按全部历史订单排序，窗口条件只能在排序后过滤，
+# 否则窗口之前下过单的老客户会被误算为新客
+def build_order_query() -> str:
+    return f"""
+        select t.crop_name as crop_name,case t.customer_type when '1' then '终端' when '2' then '贸易商' end as customer_type,
+        o.create_time as order_time,o.bwc_order_id as bwc_order_id,
+        o.two_months_ago_amount as two_months_ago_amount,
+        o.last_month_amount as last_month_amount
+        from (
+            select user_terminal_info_id,create_time,bwc_order_id,
+            row_number() over (
+                partition by user_terminal_info_id order by create_time,bwc_order_id
+            ) as rn,
+            sum(case when create_time > :two_months_ago and create_time <= :last_month then receivable else 0 end)
+                over (partition by user_terminal_info_id) as two_months_ago_amount,
+            sum(case when create_time > :last_month then receivable else 0 end)
+                over (partition by user_terminal_info_id) as last_month_amount
+            from ko_order
+            where {VALID_ORDER_CONDITION} and create_time <= :current_month
+        ) o
+        left join kc_user_terminal_info t on o.user_terminal_info_id = t.id
+        where o.rn = 1 and o.create_time > :two_months_ago
+    """
+
+
+# pandas 端聚合的备用方案：只拉取统计窗口内的有效订单，再排除窗口之前已有有效订单的客户，
+# 剩下客户在窗口内的第一单即为首单
+def fetch_first_orders_pandas(
+    kestrel_engine: create_engine,
+    two_months_ago: str,
+    last_month: str,
+    current_month: str,
+) -> pd.DataFrame:
+    df_orders = search_db(
+        kestrel_engine,
+        f"""
+        select user_terminal_info_id,create_time,bwc_order_id,receivable from ko_order
+        where {VALID_ORDER_CONDITION}
+        and create_time > :two_months_ago and create_time <= :current_month
+        """,
+        name="window_orders",
+        params=period_params(two_months_ago, last_month, current_month),
+    )
+    df_returning = fetch_by_ids(
+        kestrel_engine,
+        f"""
+        select distinct user_terminal_info_id from ko_order
+        where {VALID_ORDER_CONDITION}
+        and create_time <= :two_months_ago and user_terminal_info_id in :ids
+        """,
+        df_orders["user_terminal_info_id"],
+        params={"two_months_ago": two_months_ago},
+        name="returning_customers",
+    )
+    df_orders = df_orders[
+        ~df_orders["user_terminal_info_id"].isin(df_returning["user_terminal_info_id"])
     ]
-    for var in required_vars:
-        if not os.getenv(var):
-            logger.error(f"缺少必要的环境变量: {var}")
-            return False
-    return True
+    return aggregate_first_orders(
+        df_orders, kestrel_engine, two_months_ago, last_month, current_month
+    )
 
 
-if __name__ == "__main__":
-    if not check_required_env_vars():
-        sys.exit(1)
-
-    # 从环境变量获取配置
-    encoded_db_username = os.getenv("DB_USERNAME")
-    encoded_db_password = os.getenv("DB_PASSWORD")
-    db_hostname = os.getenv("DB_HOSTNAME")
-    sender_email = os.getenv("SENDER_EMAIL")
-    receiver_email = os.getenv(f"{current_file_name}_RECEIVER_EMAIL")
-    cc_email = os.getenv(f"{current_file_name}_CC_EMAIL")
-    password = os.getenv("EMAIL_PASSWORD")
-
-    # 创建数据库引擎
-    kestrel_engine = create_engine(
-        f"mysql+mysqlconnector://{quote_plus(encoded_db_username)}:{quote_plus(encoded_db_password)}@{db_hostname}/kestrel"
+def aggregate_first_orders(
+    df_orders: pd.DataFrame,
+    kestrel_engine: create_engine,
+    two_months_ago: str,
+    last_month: str,
+    current_month: str,
+) -> pd.DataFrame:
+    two_months_ago, last_month, current_month = map(
+        pd.Timestamp, (two_months_ago, last_month, current_month)
     )
-    bwcmall_engine = create_engine(
-        f"mysql+mysqlconnector://{quote_plus(encoded_db_username)}:{quote_plus(encoded_db_password)}@{db_hostname}/bwcmall"
+    df_orders = df_orders.assign(create_time=pd.to_datetime(df_orders["create_time"]))
+    df_orders = df_orders.sort_values(
+        ["user_terminal_info_id", "create_time", "bwc_order_id"]
     )
-    try:
-        (
-            two_months_ago_desc,
-            last_month_desc,
-            two_months_ago,
-            last_month,
-            current_month,
-        ) = get_previous_two_months()
-        subject = f"【{two_months_ago} 至 {current_month}】新客首单统计"
-        query_order = f"""
-            select t.crop_name as crop_name,case t.customer_type when '1' then '终端' when '2' then '贸易商' end as customer_type,
-            temp.first_order as order_time,temp.first_order_id as bwc_order_id
-            ,(select IFNULL(sum(receivable),0) from ko_order where record_status = 1
-            and order_type = 2 and order_status not in (0,2)
-            and user_terminal_info_id = temp.user_terminal_info_id
-            and create_time > '{two_months_ago}' and create_time <= '{last_month}') as two_months_ago_amount
-            ,(select IFNULL(sum(receivable),0) from ko_order where record_status = 1
-            and order_type = 2 and order_status not in (0,2)
-            and user_terminal_info_id = temp.user_terminal_info_id
-            and create_time > '{last_month}' and create_time <= '{current_month}') as last_month_amount
-            from (
-            select user_terminal_info_id,create_time as first_order,bwc_order_id as first_order_id from ko_order where record_status = 1
-            and order_type = 2 and order_status not in (0,2)
-            group by user_terminal_info_id) temp
-            left join kc_user_terminal_info t on temp.user_terminal_info_id = t.id
-            where temp.first_order > '{two_months_ago}' and temp.first_order <= '{current_month}'
-        """
-        order_data_df = search_db(kestrel_engine, query_order)
-        o_ids_str = ", ".join(map(str, order_data_df["bwc_order_id"].tolist()))
-        query_advisor = f"""
-            select o.id as bwc_order_id,c.first_name as advisor_name from bo_order o
-            left join bs_crm_user_rela cur on o.customer_id = cur.customer_id
-            left join bc_customer c on cur.crm_user_id = c.user_id
-            where o.record_status = 1  and c.record_status = 1
-            and o.id in ({o_ids_str})
-        """
-        advisor_data_df = search_db(bwcmall_engine, query_advisor)
-        df_result = pd.merge(
-            order_data_df, advisor_data_df, on="bwc_order_id", how="left"
+    df_first = df_orders.drop_duplicates("user_terminal_info_id", keep="first")
+    df_first = df_first[
+        (df_first["create_time"] > two_months_ago)
+        & (df_first["create_time"] <= current_month)
+    ][["user_terminal_info_id", "create_time", "bwc_order_id"]]
+
+    df_window = df_orders[
+        (df_orders["create_time"] > two_months_ago)
+        & (df_orders["create_time"] <= current_month)
+        & df_orders["user_terminal_info_id"].isin(df_first["user_terminal_info_id"])
+    ]
+    is_two_months_ago = df_window["create_time"] <= last_month
+    df_amount = (
+        df_window.assign(
+            two_months_ago_amount=df_window["receivable"].where(is_two_months_ago, 0),
+            last_month_amount=df_window["receivable"].where(~is_two_months_ago, 0),
         )
-        # 移除某一列
-        df_result.drop(columns=["bwc_order_id"], inplace=True)
-        df_result.rename(
-            columns={
-                "crop_name": "公司名称",
-                "customer_type": "客户类型",
-                "order_time": "首单时间",
-                "two_months_ago_amount": two_months_ago_desc,
-                "last_month_amount": last_month_desc,
-                "advisor_name": "顾问名称",
-            },
-            inplace=True,
+        .groupby("user_terminal_info_id")
+        .agg({"two_months_ago_amount": "sum", "last_month_amount": "sum"})
+        .reset_index()
+    )
+
+    df_result = df_first.merge(df_amount, on="user_terminal_info_id", how="left")
+    df_terminal = fetch_by_ids(
+        kestrel_engine,
+        "select id,crop_name,customer_type from kc_user_terminal_info where id in :ids",
+        df_result["user_terminal_info_id"],
+        name="terminals",
+    )
+    df_result = df_result.merge(
+        df_terminal, left_on="user_terminal_info_id", right_on="id", how="left"
+    )
+    df_result["customer_type"] = pd.to_numeric(
+        df_result["customer_type"], errors="coerce"
+    ).map(CUSTOMER_TYPE_MAP)
+    df_result[["two_months_ago_amount", "last_month_amount"]] = df_result[
+        ["two_months_ago_amount", "last_month_amount"]
+    ].fillna(0)
+    return df_result.rename(columns={"create_time": "order_time"})[
+        [
+            "crop_name",
+            "customer_type",
+            "order_time",
+            "bwc_order_id",
+            "two_months_ago_amount",
+            "last_month_amount",
+        ]
+    ]
+
+
+# 补充首单对应的顾问，并整理为导出格式
+def build_result(
+    order_data_df: pd.DataFrame,
+    bwcmall_engine: create_engine,
+    two_months_ago_desc: str,
+    last_month_desc: str,
+) -> pd.DataFrame:
+    query_advisor = """
+        select o.id as bwc_order_id,c.first_name as advisor_name from bo_order o
+        left join bs_crm_user_rela cur on o.customer_id = cur.customer_id
+        left join bc_customer c on cur.crm_user_id = c.user_id
+        where o.record_status = 1  and c.record_status = 1
+        and o.id in :ids
+    """
+    advisor_data_df = fetch_by_ids(
+        bwcmall_engine, query_advisor, order_data_df["bwc_order_id"], name="advisors"
+    )
+    df_result = pd.merge(order_data_df, advisor_data_df, on="bwc_order_id", how="left")
+    # 移除某一列
+    df_result.drop(columns=["bwc_order_id"], inplace=True)
+    df_result.rename(
+        columns={
+            "crop_name": "公司名称",
+            "customer_type": "客户类型",
+            "order_time": "首单时间",
+            "two_months_ago_amount": two_months_ago_desc,
+            "last_month_amount": last_month_desc,
+            "advisor_name": "顾问名称",
+        },
+        inplace=True,
+    )
+    df_result["首单时间"] = df_result["首单时间"].dt.strftime("%Y年%m月%d日")
+    return df_result
+
+
+def build_report_spec(date: datetime = None) -> ReportSpec:
+    (
+        two_months_ago_desc,
+        last_month_desc,
+        two_months_ago,
+        last_month,
+        current_month,
+    ) = get_previous_two_months(date)
+    is_pandas_aggregation = os.getenv(f"{current_file_name}_PANDAS_AGGREGATION") == "1"
+
+    queries = {}
+    if not is_pandas_aggregation:
+        queries["order"] = QuerySpec(
+            "kestrel",
+            build_order_query(),
+            params=period_params(two_months_ago, last_month, current_month),
         )
-        df_result["首单时间"] = df_result["首单时间"].dt.strftime("%Y年%m月%d日")
-        excel_file = generate_excel(df_result)
 
-        email_body = "请查收附件中的前两个月新客首单统计。"
-        email_sender = EmailSender(sender_email, password)
-        email_sender.send_email(
-            excel_file, receiver_email, cc_email, subject, email_body
+    def process(
+        results: Dict[str, pd.DataFrame], runner: ReportRunner
+    ) -> Dict[str, pd.DataFrame]:
+        if is_pandas_aggregation:
+            order_data_df = fetch_first_orders_pandas(
+                runner.get_engine("kestrel"), two_months_ago, last_month, current_month
+            )
+        else:
+            order_data_df = results["order"]
+        df_result = build_result(
+            order_data_df,
+            runner.get_engine("bwcmall"),
+            two_months_ago_desc,
+            last_month_desc,
         )
+        return {"Sheet1": df_result}
+
+    return ReportSpec(
+        name=current_file_name,
+        subject=f"【{two_months_ago} 至 {current_month}】新客首单统计",
+        body="请查收附件中的前两个月新客首单统计。",
+        output_file="result.xlsx",
+        period=f"{two_months_ago}~{current_month}",
+        queries=queries,
+        process=process,
+    )
 
-        # 删除文件
-        os.remove(excel_file)
-    except Exception as e:
-        logger.error(f"发生错误: {str(e)}")
-    finally:
-        kestrel_engine.dispose()
-        bwcmall_engine.dispose()
+
+if __name__ == "__main__":
+    run_reports([build_report_spec()])
@@ -1,53 +1,24 @@
 import os
-import sys
+import json
 import pandas as pd
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from urllib.parse import quote_plus
-import logging
 from datetime import datetime, timedelta
-from EmailSender import EmailSender
-from typing import List
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+from monthly_fact_store import (
+    FactSource,
+    MonthlyFactStore,
+    load_months,
+    previous_months,
 )
-logger = logging.getLogger(__name__)
+from query_runner import to_cents
+from report_runner import QuerySpec, ReportRunner, ReportSpec, run_reports
+from typing import Dict, List
 
 # 获取文件名（不带扩展名）
 current_file_name = os.path.splitext(os.path.basename(__file__))[0].upper()
 
-# 加载环境变量
-load_dotenv()
-
-
-# 搜索数据库
-def search_db(db_engine: create_engine, query: str) -> pd.DataFrame:
-    return pd.read_sql(query, db_engine)
-
-
-# 检查必要的环境变量
-def check_required_env_vars() -> bool:
-    required_vars = [
-        "DB_USERNAME",
-        "DB_PASSWORD",
-        "DB_HOSTNAME",
-        "SENDER_EMAIL",
-        "EMAIL_PASSWORD",
-        f"{current_file_name}_RECEIVER_EMAIL",
-        f"{current_file_name}_CC_EMAIL",
-    ]
-    for var in required_vars:
-        if not os.getenv(var):
-            logger.error(f"缺少必要的环境变量: {var}")
-            return False
-    return True
-
 
 # 获取上个月和当前月份的第一天
-def get_last_and_current_month_first_day() -> tuple:
-    today = datetime.now()
+def get_last_and_current_month_first_day(date: datetime = None) -> tuple:
+    today = date or datetime.now()
     first_day_of_current_month = today.replace(day=1)
     last_day_of_previous_month = first_day_of_current_month - timedelta(days=1)
     first_day_of_previous_month = last_day_of_previous_month.replace(day=1)
@@ -57,25 +28,37 @@ def get_last_and_current_month_first_day() -> tuple:
     ), first_day_of_current_month.strftime("%Y-%m-%d")
 
 
-# 执行查询 type 0 表示 渠道商，type 1 表示 终端
-def execute_queries(
-    db_engine: create_engine, last_month_first: str, current_month_first: str, type: int
-) -> List[pd.DataFrame]:
-    query_conditions = {
-        0: {"order_sn": "%D%", "purchase_sn": "%C%"},  # 渠道商
-        1: {"order_sn": "%G%", "purchase_sn": "%Z%"},  # 终端
-    }
+# 查询结果列类型：明细品类的金额先按浮点读取，合并为一级品类后再转为以分为单位的整数
+PROFIT_DTYPES = {"总价": "float64"}
+# 四个查询结果依次对应的指标，以及计算毛利时的符号
+MEASURES = {"销售收入": 1, "销售售后": -1, "采购成本": -1, "采购售后": 1}
+# 品类分类映射配置，可通过 PROFITANALYSISREPORT_BUCKET_CONFIG 指定其他文件
+DEFAULT_BUCKET_CONFIG = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "data",
+    "profit_category_buckets.json",
+)
 
-    if type not in query_conditions:
-        raise ValueError("type 必须是 0 或 1")
 
-    conditions = query_conditions[type]
+# 分段条件 type 0 表示 渠道商，type 1 表示 终端
+SEGMENT_SHEETS = {0: "贸易商数据", 1: "终端数据"}
+QUERY_CONDITIONS = {
+    0: {"order_sn": "%D%", "purchase_sn": "%C%"},  # 渠道商
+    1: {"order_sn": "%G%", "purchase_sn": "%Z%"},  # 终端
+}
+
 
-    queries = [
-        f"""
+# 四类事实数据的查询模板：(SQL模板, 金额表达式, 单号字段, 条件键)
+# 模板中 {measures} 为聚合列，{segment_filter} 为单号过滤条件；统计区间通过绑定参数
+# :period_start / :period_end 传入（半开区间），按明细品类分组，一级品类在内存中映射
+def build_fact_queries() -> list:
+    return [
+        (
+            """
         SELECT 
-            osc.name AS '一级品类', 
-            ROUND(SUM(item.price * item.quantity), 2) AS '总价'
+            sc.id AS '品类ID', 
+            {measures}
         FROM bo_order_item item
         LEFT JOIN bo_order o ON item.order_id = o.id
         LEFT JOIN bc_shop_goods_sku_rela gsr ON item.goods_id = gsr.goods_id
@@ -83,21 +66,25 @@ def execute_queries(
         LEFT JOIN bp_spu spu ON bs.spu_id = spu.id
         LEFT JOIN bp_spu_category_rela src ON spu.id = src.spu_id
         LEFT JOIN bp_spu_category sc ON sc.id = src.spu_category_id
-        LEFT JOIN bp_spu_category osc ON osc.id = IF(sc.parent_id = 0, sc.id, SUBSTRING_INDEX(sc.path, ',', 1))
         WHERE 
             item.record_status = 1 
             AND src.record_status = 1 
             AND gsr.record_status = 1 
             AND item.p_order_item_id != 0
-            AND o.deliver_time >= '{last_month_first}'
-            AND o.deliver_time < '{current_month_first}'
-            AND o.sn LIKE '{conditions['order_sn']}'
-        GROUP BY osc.id
+            AND o.deliver_time >= :period_start
+            AND o.deliver_time < :period_end
+            AND {segment_filter}
+        GROUP BY sc.id
         """,
-        f"""
+            "item.price * item.quantity",
+            "o.sn",
+            "order_sn",
+        ),
+        (
+            """
         SELECT 
-            osc.name AS '一级品类',
-            ROUND(SUM(item.total_price), 2) AS '总价'
+            sc.id AS '品类ID',
+            {measures}
         FROM bo_order_after_sale_item item
         LEFT JOIN bo_order_after_sale s ON item.order_after_sale_id = s.id
         LEFT JOIN bo_order o ON s.order_id = o.id
@@ -106,23 +93,27 @@ def execute_queries(
         LEFT JOIN bp_spu spu ON bs.spu_id = spu.id
         LEFT JOIN bp_spu_category_rela src ON spu.id = src.spu_id
         LEFT JOIN bp_spu_category sc ON sc.id = src.spu_category_id
-        LEFT JOIN bp_spu_category osc ON osc.id = IF(sc.parent_id = 0, sc.id, SUBSTRING_INDEX(sc.path, ',', 1))
         WHERE 
             item.record_status = 1 
             AND src.record_status = 1 
             AND gsr.record_status = 1
             AND s.after_sale_status = 8
             AND (
-                (o.deliver_time >= '{last_month_first}' AND o.deliver_time < '{current_month_first}' AND s.modify_time < '{current_month_first}')
-                OR (s.modify_time >= '{last_month_first}' AND s.modify_time < '{current_month_first}' AND o.deliver_time < '{last_month_first}')
+                (o.deliver_time >= :period_start AND o.deliver_time < :period_end AND s.modify_time < :period_end)
+                OR (s.modify_time >= :period_start AND s.modify_time < :period_end AND o.deliver_time < :period_start)
             )
-            AND o.sn LIKE '{conditions['order_sn']}'
-        GROUP BY osc.id
+            AND {segment_filter}
+        GROUP BY sc.id
         """,
-        f"""
+            "item.total_price",
+            "o.sn",
+            "order_sn",
+        ),
+        (
+            """
         SELECT 
-            osc.name AS '一级品类', 
-            ROUND(SUM(item.total_purchase_price), 2) AS '总价'
+            sc.id AS '品类ID', 
+            {measures}
         FROM bo_purchase_item item
         LEFT JOIN bo_purchase p ON item.purchase_id = p.id
         LEFT JOIN bo_order o ON p.order_sn = o.sn
@@ -130,7 +121,6 @@ def execute_queries(
         LEFT JOIN bp_spu spu ON bs.spu_id = spu.id
         LEFT JOIN bp_spu_category_rela src ON spu.id = src.spu_id
         LEFT JOIN bp_spu_category sc ON sc.id = src.spu_category_id
-        LEFT JOIN bp_spu_category osc ON osc.id = IF(sc.parent_id = 0, sc.id, SUBSTRING_INDEX(sc.path, ',', 1))
         LEFT JOIN (
             SELECT bspr.shipping_id, bspr.purchase_id, sh.start_time 
             FROM bl_shipping_purchase_rela bspr
@@ -142,15 +132,20 @@ def execute_queries(
             item.record_status = 1 
             AND src.record_status = 1 
             AND o.order_status IN (2,3,5)
-            AND ps.start_time >= '{last_month_first}'
-            AND ps.start_time < '{current_month_first}'
-            AND p.sn LIKE '{conditions['purchase_sn']}'
-        GROUP BY osc.id
+            AND ps.start_time >= :period_start
+            AND ps.start_time < :period_end
+            AND {segment_filter}
+        GROUP BY sc.id
         """,
-        f"""
+            "item.total_purchase_price",
+            "p.sn",
+            "purchase_sn",
+        ),
+        (
+            """
         SELECT 
-            osc.name AS '一级品类', 
-            ROUND(SUM(item.total_price), 2) AS '总价'
+            sc.id AS '品类ID', 
+            {measures}
         FROM bo_purchase_after_sale_item item
         LEFT JOIN bo_purchase_after_sale pas ON item.purchase_after_sale_id = pas.id
         LEFT JOIN bo_purchase p ON item.purchase_id = p.id
@@ -159,7 +154,6 @@ def execute_queries(
         LEFT JOIN bp_spu spu ON bs.spu_id = spu.id
         LEFT JOIN bp_spu_category_rela src ON spu.id = src.spu_id
         LEFT JOIN bp_spu_category sc ON sc.id = src.spu_category_id
-        LEFT JOIN bp_spu_category osc ON osc.id = IF(sc.parent_id = 0, sc.id, SUBSTRING_INDEX(sc.path, ',', 1))
         LEFT JOIN (
             SELECT bspr.shipping_id, bspr.purchase_id, sh.start_time 
             FROM bl_shipping_purchase_rela bspr
@@ -173,135 +167,334 @@ def execute_queries(
             AND pas.after_sale_status != 3 
             AND o.order_status IN (2,3,5)
             AND (
-                (ps.start_time >= '{last_month_first}' AND ps.start_time < '{current_month_first}' AND pas.create_time < '{current_month_first}')
-                OR (pas.create_time >= '{last_month_first}' AND pas.create_time < '{current_month_first}' AND ps.start_time < '{last_month_first}')
+                (ps.start_time >= :period_start AND ps.start_time < :period_end AND pas.create_time < :period_end)
+                OR (pas.create_time >= :period_start AND pas.create_time < :period_end AND ps.start_time < :period_start)
             )
-            AND p.sn LIKE '{conditions['purchase_sn']}'
-        GROUP BY osc.id
+            AND {segment_filter}
+        GROUP BY sc.id
         """,
+            "item.total_price",
+            "p.sn",
+            "purchase_sn",
+        ),
     ]
 
-    return [search_db(db_engine, query) for query in queries]
 
+# 生成单个分段的四个查询 type 0 表示 渠道商，type 1 表示 终端
+def build_segment_queries(type: int) -> List[str]:
+    if type not in QUERY_CONDITIONS:
+        raise ValueError("type 必须是 0 或 1")
 
-def categorize(category: str) -> str:
-    if category in ["刀具", "量具"]:
-        return "刀具"
-    elif category == "电气控制":
-        return "电气控制"
-    else:
-        return "其他"
+    conditions = QUERY_CONDITIONS[type]
+    return [
+        template.format(
+            measures=f"SUM({amount}) AS '总价'",
+            segment_filter=f"{sn_column} LIKE '{conditions[key]}'",
+        )
+        for template, amount, sn_column, key in build_fact_queries()
+    ]
+
+
+# 单次扫描同时查询所有分段：每类事实数据只查一次，按单号条件分段聚合
+# 返回的每个查询结果含 品类ID 以及每个分段的 总价_{type} / 行数_{type} 列
+def build_segmented_queries(types: List[int] = None) -> List[str]:
+    types = list(QUERY_CONDITIONS) if types is None else types
+    invalid_types = [t for t in types if t not in QUERY_CONDITIONS]
+    if invalid_types:
+        raise ValueError(f"不支持的 type: {invalid_types}")
+
+    queries = []
+    for template, amount, sn_column, key in build_fact_queries():
+        # 同一单号可能同时满足多个分段条件，使用条件聚合而不是 CASE 打标，保证与分段查询结果一致
+        measures = ",\n            ".join(
+            f"SUM(IF({sn_column} LIKE '{QUERY_CONDITIONS[t][key]}', {amount}, 0)) AS '总价_{t}', "
+            f"SUM({sn_column} LIKE '{QUERY_CONDITIONS[t][key]}') AS '行数_{t}'"
+            for t in types
+        )
+        segment_filter = " OR ".join(
+            f"{sn_column} LIKE '{QUERY_CONDITIONS[t][key]}'" for t in types
+        )
+        queries.append(
+            template.format(measures=measures, segment_filter=f"({segment_filter})")
+        )
+    return queries
 
 
-def process_query_results(df_list: List[pd.DataFrame]) -> pd.DataFrame:
-    # 确保我们有4个DataFrame
-    assert len(df_list) == 4, "需要4个查询结果"
+def segmented_dtypes(types: List[int] = None) -> Dict[str, str]:
+    dtypes = {}
+    for t in list(QUERY_CONDITIONS) if types is None else types:
+        dtypes.update({f"总价_{t}": "float64", f"行数_{t}": "int64"})
+    return dtypes
 
-    # 重命名列以反映数据的含义
-    df_list[0] = df_list[0].rename(columns={"总价": "销售收入"})
-    df_list[1] = df_list[1].rename(columns={"总价": "销售售后"})
-    df_list[2] = df_list[2].rename(columns={"总价": "采购成本"})
-    df_list[3] = df_list[3].rename(columns={"总价": "采购售后"})
 
-    # 合并所有DataFrame
-    merged_df = df_list[0].merge(df_list[1], on="一级品类", how="outer")
-    merged_df = merged_df.merge(df_list[2], on="一级品类", how="outer")
-    merged_df = merged_df.merge(df_list[3], on="一级品类", how="outer")
+# 统计区间的绑定参数，半开区间 [period_start, period_end)
+def period_params(last_month_first: str, current_month_first: str) -> dict:
+    return {"period_start": last_month_first, "period_end": current_month_first}
 
-    # 填充NaN值为0
-    merged_df = merged_df.fillna(0)
 
-    # 应用分类规则
-    merged_df["分类"] = merged_df["一级品类"].apply(categorize)
+# 品类表很小，整表读取后在内存中计算一级品类
+CATEGORY_QUERY = "SELECT id, parent_id, path, name FROM bp_spu_category"
 
-    # 按新分类进行分组并汇总
-    grouped_df = (
-        merged_df.groupby("分类")
-        .agg(
-            {"销售收入": "sum", "销售售后": "sum", "采购成本": "sum", "采购售后": "sum"}
-        )
-        .reset_index()
+
+# 预先计算 品类ID -> 一级品类名称，代替逐行 IF(... SUBSTRING_INDEX(sc.path, ',', 1)) 关联
+def build_top_level_category_map(df_categories: pd.DataFrame) -> pd.Series:
+    top_level_ids = pd.to_numeric(
+        df_categories["id"].where(
+            df_categories["parent_id"] == 0,
+            df_categories["path"].astype(str).str.split(",").str[0],
+        ),
+        errors="coerce",
     )
+    names = df_categories.set_index("id")["name"]
+    return pd.Series(top_level_ids.map(names).values, index=df_categories["id"])
+
+
+# 按明细品类分组的查询结果映射为一级品类并合并；金额在合并之后才换算为分，
+# 与按一级品类 ROUND(SUM(...), 2) 一样每个一级品类只舍入一次
+def to_top_level(df: pd.DataFrame, category_map: pd.Series) -> pd.DataFrame:
+    df = df.assign(一级品类=df["品类ID"].map(category_map)).drop(columns="品类ID")
+    df = df.groupby("一级品类", dropna=False, sort=False).sum().reset_index()
+    for column in df.columns:
+        if column.startswith("总价"):
+            df[column] = to_cents(df[column])
+    df["一级品类"] = df["一级品类"].astype("category")
+    return df
+
+
+# 将单次扫描的结果按分段拆分为与分段查询（build_segment_queries）相同结构的结果列表
+def split_segments(df_list: List[pd.DataFrame], types: List[int] = None) -> dict:
+    types = list(QUERY_CONDITIONS) if types is None else types
+    segments = {}
+    for t in types:
+        segment_list = []
+        for df in df_list:
+            # 只保留该分段有数据的品类，与分段查询中 GROUP BY 的结果保持一致
+            segment_df = df.loc[df[f"行数_{t}"] > 0, ["一级品类", f"总价_{t}"]]
+            segment_list.append(
+                segment_df.rename(columns={f"总价_{t}": "总价"}).reset_index(drop=True)
+            )
+        segments[t] = segment_list
+    return segments
+
 
-    # 计算毛利和毛利率
-    grouped_df["毛利"] = (
-        grouped_df["销售收入"]
-        - grouped_df["销售售后"]
-        - (grouped_df["采购成本"] - grouped_df["采购售后"])
+# 读取 一级品类 -> 分类 的映射配置，未配置的品类归入默认分类
+def load_category_buckets(config_file: str = None) -> tuple:
+    config_file = config_file or os.getenv(
+        f"{current_file_name}_BUCKET_CONFIG", DEFAULT_BUCKET_CONFIG
     )
-    # 重新排序列
-    grouped_df = grouped_df[
-        [
-            "分类",
-            "销售收入",
-            "销售售后",
-            "采购成本",
-            "采购售后",
-            "毛利",
+    with open(config_file, encoding="utf-8") as f:
+        config = json.load(f)
+    return config["buckets"], config.get("default", "其他")
+
+
+# 向量化映射分类：分类类型的列只对类别做一次查找
+def map_categories(
+    categories: pd.Series, buckets: Dict[str, str], default: str
+) -> pd.Series:
+    return categories.map(buckets).astype(object).fillna(default)
+
+
+# 多分段、多指标一次性汇总：所有结果纵向拼接后做一次 pivot_table
+# segments 为 {分段: [各指标的查询结果]}，measures 为 {指标名称: 计入毛利的符号}
+def rollup_segments(
+    segments: Dict[int, List[pd.DataFrame]],
+    measures: Dict[str, int] = None,
+    category_buckets: tuple = None,
+    amount_in_cents: bool = False,
+) -> Dict[int, pd.DataFrame]:
+    measures = measures or MEASURES
+    buckets, default = category_buckets or load_category_buckets()
+    frames = []
+    for segment, df_list in segments.items():
+        if len(df_list) != len(measures):
+            raise ValueError(f"需要{len(measures)}个查询结果，实际为{len(df_list)}个")
+        for df, measure in zip(df_list, measures):
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "分段": segment,
+                        "指标": measure,
+                        "分类": map_categories(df["一级品类"], buckets, default),
+                        "总价": df["总价"].astype("float64"),
+                    }
+                )
+            )
+
+    pivot_df = pd.concat(frames, ignore_index=True).pivot_table(
+        index=["分段", "分类"],
+        columns="指标",
+        values="总价",
+        aggfunc="sum",
+        fill_value=0,
+    )
+    pivot_df = pivot_df.reindex(columns=list(measures), fill_value=0)
+    # 计算毛利：收入类指标为正，成本类指标为负
+    pivot_df["毛利"] = sum(
+        pivot_df[measure] * sign for measure, sign in measures.items()
+    )
+    if amount_in_cents:
+        pivot_df = pivot_df / 100
+
+    results = {}
+    for segment in segments:
+        if segment in pivot_df.index.get_level_values("分段"):
+            grouped_df = pivot_df.xs(segment, level="分段").reset_index()
+        else:
+            grouped_df = pd.DataFrame(
+                {"分类": pd.Series(dtype=object)}
+                | {column: pd.Series(dtype="float64") for column in [*measures, "毛利"]}
+            )
+        grouped_df.columns.name = None
+
+        # 添加合计行
+        total_row = grouped_df.sum(numeric_only=True).to_frame().T
+        total_row["分类"] = "合计"
+        results[segment] = pd.concat([grouped_df, total_row], ignore_index=True)[
+            ["分类", *measures, "毛利"]
         ]
+    return results
+
+
+# amount_in_cents 表示金额列以分为单位（to_top_level 换算），结果会换算回元
+def process_query_results(
+    df_list: List[pd.DataFrame], amount_in_cents: bool = False
+) -> pd.DataFrame:
+    return rollup_segments({0: df_list}, amount_in_cents=amount_in_cents)[0]
+
+
+# 单次扫描查询的结果转换为按月汇总行：分段、指标、一级品类、总价（分）
+def to_category_facts(results: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    segments = split_segments(collect_fact_results(results, "fact"))
+    frames = [
+        pd.DataFrame(
+            {
+                "分段": segment,
+                "指标": measure,
+                "一级品类": df["一级品类"].astype(object),
+                "总价": df["总价"],
+            }
+        )
+        for segment, df_list in segments.items()
+        for measure, df in zip(MEASURES, df_list)
     ]
+    return pd.concat(frames, ignore_index=True)
+
+
+# 按月汇总的数据还原为 rollup_segments 需要的 {分段: [各指标的查询结果]}
+def facts_to_segments(df_facts: pd.DataFrame) -> Dict[int, List[pd.DataFrame]]:
+    return {
+        segment: [
+            df_facts.loc[
+                (df_facts["分段"] == segment) & (df_facts["指标"] == measure),
+                ["一级品类", "总价"],
+            ].reset_index(drop=True)
+            for measure in MEASURES
+        ]
+        for segment in QUERY_CONDITIONS
+    }
 
-    # 添加合计行
-    total_row = grouped_df.sum(numeric_only=True).to_frame().T
-    total_row["分类"] = "合计"
-
-    final_df = pd.concat([grouped_df, total_row], ignore_index=True)
 
-    return final_df
+def build_category_fact_queries(
+    last_month_first: str, current_month_first: str
+) -> Dict[str, QuerySpec]:
+    params = period_params(last_month_first, current_month_first)
+    queries = {
+        f"fact_{i}": QuerySpec("bwcmall", query, segmented_dtypes(), params)
+        for i, query in enumerate(build_segmented_queries())
+    }
+    queries["categories"] = QuerySpec("bwcmall", CATEGORY_QUERY)
+    return queries
 
 
-def generate_excel(dataframes: List[pd.DataFrame], sheet_names: list, output_file: str):
-    with pd.ExcelWriter(output_file) as writer:
-        for df, sheet_name in zip(dataframes, sheet_names):
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
+# 取出某一组的四个查询结果（前缀_0 ~ 前缀_3），映射为一级品类
+def collect_fact_results(
+    results: Dict[str, pd.DataFrame], prefix: str
+) -> List[pd.DataFrame]:
+    category_map = build_top_level_category_map(results["categories"])
+    return [
+        to_top_level(results[f"{prefix}_{i}"], category_map)
+        for i in range(len(MEASURES))
+    ]
 
 
-if __name__ == "__main__":
-    # 在主函数开始处添加以下设置
-    pd.set_option("display.float_format", lambda x: "%.2f" % x)
+# 按月、分段、指标、一级品类物化的汇总表
+CATEGORY_FACTS = FactSource(
+    name="profit_category_month",
+    build_queries=build_category_fact_queries,
+    transform=to_category_facts,
+)
 
-    if not check_required_env_vars():
-        sys.exit(1)
-
-    encoded_db_username = os.getenv("DB_USERNAME")
-    encoded_db_password = os.getenv("DB_PASSWORD")
-    db_hostname = os.getenv("DB_HOSTNAME")
-    sender_email = os.getenv("SENDER_EMAIL")
-    receiver_email = os.getenv(f"{current_file_name}_RECEIVER_EMAIL")
-    cc_email = os.getenv(f"{current_file_name}_CC_EMAIL")
-    password = os.getenv("EMAIL_PASSWORD")
-    db_engine = create_engine(
-        f"mysql+mysqlconnector://{quote_plus(encoded_db_username)}:{quote_plus(encoded_db_password)}@{db_hostname}/bwcmall"
-    )
-    try:
-        last_month_first, current_month_first = get_last_and_current_month_first_day()
 
-        # 渠道商
-        trafficker_list = execute_queries(
-            db_engine, last_month_first, current_month_first, 0
-        )
-        # 终端
-        terminal_list = execute_queries(
-            db_engine, last_month_first, current_month_first, 1
+# 多月趋势：每个月份、每个分段的合计行
+def build_trend(df_facts: pd.DataFrame, months: List[str]) -> pd.DataFrame:
+    rows = []
+    for month in months:
+        rollup = rollup_segments(
+            facts_to_segments(df_facts[df_facts["month"] == month]),
+            amount_in_cents=True,
         )
+        for segment, sheet_name in SEGMENT_SHEETS.items():
+            total_row = rollup[segment].iloc[[-1]].drop(columns="分类")
+            rows.append(total_row.assign(月份=month, 分段=sheet_name))
+    trend_df = pd.concat(rows, ignore_index=True)
+    return trend_df[["月份", "分段", *MEASURES, "毛利"]]
+
+
+def build_report_spec(date: datetime = None) -> ReportSpec:
+    last_month_first, current_month_first = get_last_and_current_month_first_day(date)
+    is_single_pass = os.getenv(f"{current_file_name}_SINGLE_PASS", "1") == "1"
+    # 配置了按月汇总存储时从汇总表读取，不再查询业务库；TREND_MONTHS 大于 0 时附加趋势工作表
+    fact_store = MonthlyFactStore.from_env()
+    trend_months = int(os.getenv(f"{current_file_name}_TREND_MONTHS", "0"))
+
+    if fact_store:
+        queries = {}
+    elif is_single_pass:
+        # 单次扫描查询所有分段，再在内存中拆分
+        queries = build_category_fact_queries(last_month_first, current_month_first)
+    else:
+        params = period_params(last_month_first, current_month_first)
+        queries = {
+            f"{type}_{i}": QuerySpec("bwcmall", query, PROFIT_DTYPES, params)
+            for type in QUERY_CONDITIONS
+            for i, query in enumerate(build_segment_queries(type))
+        }
+        queries["categories"] = QuerySpec("bwcmall", CATEGORY_QUERY)
+
+    def process(
+        results: Dict[str, pd.DataFrame], runner: ReportRunner
+    ) -> Dict[str, pd.DataFrame]:
+        if fact_store:
+            months = previous_months(max(trend_months, 1), date)
+            df_facts = load_months(runner, fact_store, CATEGORY_FACTS, months)
+            segments = facts_to_segments(df_facts[df_facts["month"] == months[-1]])
+        elif is_single_pass:
+            segments = split_segments(collect_fact_results(results, "fact"))
+        else:
+            segments = {
+                type: collect_fact_results(results, type) for type in QUERY_CONDITIONS
+            }
+        # 两个分段一次汇总
+        rollup = rollup_segments(segments, amount_in_cents=True)
+        sheets = {
+            sheet_name: rollup[segment]
+            for segment, sheet_name in SEGMENT_SHEETS.items()
+        }
+        if fact_store and trend_months > 0:
+            sheets["月度趋势"] = build_trend(df_facts, months)
+        return sheets
+
+    return ReportSpec(
+        name=current_file_name,
+        subject="月度业务品类拆分",
+        body="请查看附件中的月度业务品类拆分。",
+        output_file="profit_analysis_report.xlsx",
+        period=last_month_first[:7],
+        queries=queries,
+        process=process,
+    )
 
-        # 处理查询结果
-        trafficker_df = process_query_results(trafficker_list)
-        terminal_df = process_query_results(terminal_list)
-
-        excel_file = "profit_analysis_report.xlsx"
-        generate_excel(
-            [trafficker_df, terminal_df], ["贸易商数据", "终端数据"], excel_file
-        )
 
-        # 发送邮件
-        email_sender = EmailSender(sender_email, password)
-        subject = "月度业务品类拆分"
-        body = "请查看附件中的月度业务品类拆分。"
-        email_sender.send_email(excel_file, receiver_email, cc_email, subject, body)
-        # 删除文件
-        os.remove(excel_file)
-    except Exception as e:
-        logger.error(f"发生错误: {e}")
-    finally:
-        db_engine.dispose()
+if __name__ == "__main__":
+    pd.set_option("display.float_format", lambda x: "%.2f" % x)
+    run_reports([build_report_spec()])
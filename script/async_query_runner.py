@@ -0,0 +1,161 @@
+import os
+import time
+import asyncio
+import logging
+import pandas as pd
+import threading
+from contextlib import asynccontextmanager
+from sqlalchemy import text
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from typing import AsyncIterator, Callable, Dict
+import query_metrics
+from query_cache import QueryCache
+from query_runner import (
+    apply_dtypes,
+    get_db_budget,
+    get_db_key,
+    get_db_semaphore,
+    rewrite_period_filters,
+)
+
+logger = logging.getLogger(__name__)
+
+# 流式读取时每批拉取的行数，每批转换为一个 DataFrame
+STREAM_BATCH_SIZE = int(os.getenv("ASYNC_QUERY_RUNNER_BATCH_SIZE", "10000"))
+
+# 同步驱动对应的异步驱动（需要安装 aiomysql / aiosqlite）
+ASYNC_DRIVERS = {"mysql": "mysql+aiomysql", "sqlite": "sqlite+aiosqlite"}
+# 等待数据库并发名额时的轮询间隔（秒）
+SLOT_POLL_INTERVAL = 0.05
+
+
+# 将同步引擎的连接 URL 转换为异步驱动的 URL，用户名、密码、主机保持不变
+def to_async_url(url) -> URL:
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def create_async_report_engine(url, **kwargs) -> AsyncEngine:
+    return create_async_engine(to_async_url(url), pool_pre_ping=True, **kwargs)
+
+
+async def _acquire(semaphore: threading.BoundedSemaphore) -> None:
+    while not semaphore.acquire(blocking=False):
+        await asyncio.sleep(SLOT_POLL_INTERVAL)
+
+
+# 与 query_runner.db_slot 相同：先取该数据库的并发名额，再取调度器设置的全局预算，
+# 异步查询与同步查询共用同一组上限；信号量是线程信号量，以非阻塞方式轮询获取，
+# 等待期间既不阻塞事件循环也不占用线程
+@asynccontextmanager
+async def db_slot(
+    db_engine: AsyncEngine, max_concurrency: int = None
+) -> AsyncIterator[None]:
+    semaphores = [get_db_semaphore(db_engine, max_concurrency)]
+    budget = get_db_budget()
+    if budget is not None:
+        semaphores.append(budget)
+    acquired = []
+    try:
+        for semaphore in semaphores:
+            await _acquire(semaphore)
+            acquired.append(semaphore)
+        yield
+    finally:
+        for semaphore in reversed(acquired):
+            semaphore.release()
+
+
+# 通过 conn.stream() 分批读取查询结果，每批行数为 batch_size；
+# on_batch 会收到每一批原始结果，可以在后续批次还在读取时开始处理（如并发查询 MongoDB）
+async def stream_query(
+    db_engine: AsyncEngine,
+    query: str,
+    params: dict = None,
+    dtypes: Dict[str, str] = None,
+    batch_size: int = None,
+    name: str = None,
+    on_batch: Callable[[pd.DataFrame], None] = None,
+    rewrite_periods: bool = False,
+) -> pd.DataFrame:
+    if rewrite_periods:
+        query, params = rewrite_period_filters(query, params)
+    statement = text(query)
+    start = time.perf_counter()
+    frames = []
+    async with db_engine.connect() as conn:
+        result = await conn.stream(statement, params)
+        # stream 返回前的耗时近似为服务端耗时
+        server_time = time.perf_counter() - start
+        columns = list(result.keys())
+        async for rows in result.partitions(batch_size or STREAM_BATCH_SIZE):
+            batch = pd.DataFrame(rows, columns=columns)
+            if on_batch:
+                on_batch(batch)
+            frames.append(batch)
+    if frames:
+        df = pd.concat(frames, ignore_index=True)
+    else:
+        df = pd.DataFrame(columns=columns)
+    # 分类等列类型在合并后统一转换，避免各批次的类别不一致
+    df = apply_dtypes(df, dtypes)
+    query_metrics.add_record(
+        name,
+        db_engine,
+        statement,
+        df,
+        time.perf_counter() - start,
+        server_time,
+        params=params,
+    )
+    return df
+
+
+# 异步版本的 run_query：先查文件缓存，未命中时流式读取并写入缓存，
+# 查询期间占用 db_slot，与同步查询共用每个数据库的并发上限和全局预算；
+# on_miss 为缓存未命中时在信号量内、查询前执行的阻塞调用（如 EXPLAIN），在线程中运行，
+# 参数为实际执行的 SQL 和绑定参数；rewrite_periods 与同步版本相同
+async def run_query(
+    db_engine: AsyncEngine,
+    query: str,
+    max_concurrency: int = None,
+    cache: QueryCache = None,
+    dtypes: Dict[str, str] = None,
+    params: dict = None,
+    name: str = None,
+    on_miss: Callable[[str, dict], None] = None,
+    rewrite_periods: bool = False,
+) -> pd.DataFrame:
+    cache_key = None
+    start = time.perf_counter()
+    if rewrite_periods:
+        query, params = rewrite_period_filters(query, params)
+    if cache is not None:
+        cache_key = cache.make_key(
+            get_db_key(db_engine),
+            query,
+            {"dtypes": dtypes, "params": params},
+        )
+        # 缓存读写是文件 IO，放到线程中执行以免阻塞事件循环
+        df = await asyncio.to_thread(cache.get, cache_key)
+        if df is not None:
+            logger.info(f"查询缓存命中: {cache_key[:12]}")
+            query_metrics.add_record(
+                name,
+                db_engine,
+                text(query),
+                df,
+                time.perf_counter() - start,
+                0.0,
+                executions=0,
+            )
+            return df
+
+    async with db_slot(db_engine, max_concurrency):
+        if on_miss:
+            await asyncio.to_thread(on_miss, query, params)
+        df = await stream_query(db_engine, query, params, dtypes, name=name)
+    if cache_key is not None:
+        await asyncio.to_thread(cache.put, cache_key, df)
+    return df
@@ -1,12 +1,20 @@
 import asyncio
 import logging
 import os
+from datetime import datetime
+from typing import Dict, Optional, Tuple
 from dotenv import load_dotenv
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
-from sqlalchemy import text
-import pandas as pd
+from sqlalchemy.ext.asyncio import create_async_engine
 from urllib.parse import quote_plus
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+from motor.motor_asyncio import (
+    AsyncIOMotorClient,
+    AsyncIOMotorCollection,
+    AsyncIOMotorDatabase,
+)
+import query_metrics
+from async_query_runner import stream_query
+from operator_cache import OperatorCache
 
 # 配置日志
 logging.basicConfig(
@@ -16,41 +24,114 @@ logger = logging.getLogger(__name__)
 # 加载环境变量
 load_dotenv()
 
+# 低基数的名称、状态列使用分类类型，减少导出数据的内存占用
+CUSTOMER_DTYPES = {
+    "类型": "category",
+    "销售进程": "category",
+    "客户等级": "category",
+    "设备数量": "category",
+    "最后跟进人": "category",
+}
+
 
-async def fetch_data(db_engine: AsyncEngine, query: str) -> pd.DataFrame:
-    async with db_engine.connect() as conn:
-        result = await conn.execute(text(query))
-        df = pd.DataFrame(result.fetchall())
-        return df
+# 每次聚合查询的客户数，以及同时进行的聚合查询数
+MONGO_BATCH_SIZE = int(os.getenv("CRM_CUSTOMER_STATISTICS_MONGO_BATCH_SIZE", "1000"))
+MONGO_CONCURRENCY = int(os.getenv("CRM_CUSTOMER_STATISTICS_MONGO_CONCURRENCY", "4"))
+# 最后操作人查询依赖的复合索引：按客户分组、组内按操作时间倒序
+OPERATOR_INDEX = [("customerId", 1), ("operationTime", -1)]
 
 
-async def fetch_last_operators(db: AsyncIOMotorClient, customer_ids: list) -> dict:
+# 检查操作日志集合上是否有 OPERATOR_INDEX，create 为 True 时缺失则创建；
+# 检查只是提示性的，没有 listIndexes / createIndex 权限等失败时记录警告后继续统计
+async def ensure_operator_index(
+    collection: AsyncIOMotorCollection, create: bool = False
+) -> bool:
+    try:
+        indexes = await collection.index_information()
+    except PyMongoError as e:
+        logger.warning(f"无法读取 {collection.name} 的索引信息，跳过索引检查: {e}")
+        return False
+    if any(list(index["key"]) == OPERATOR_INDEX for index in indexes.values()):
+        return True
+    if not create:
+        logger.warning(
+            f"{collection.name} 缺少索引 {OPERATOR_INDEX}，最后操作人查询需要在内存中排序"
+        )
+        return False
     try:
-        # 将所有customer_id转为整数
-        customer_ids = [int(cid) for cid in customer_ids]
-
-        # 使用聚合管道，一次性获取所有客户的最后操作记录
-        pipeline = [
-            {"$match": {"customerId": {"$in": customer_ids}}},
-            {"$sort": {"operationTime": -1}},
-            {
-                "$group": {
-                    "_id": "$customerId",
-                    "operatorName": {"$first": "$operatorName"},
-                }
-            },
-        ]
-
-        results = {}
-        async for doc in db.crm_customer_log.aggregate(pipeline):
-            results[str(doc["_id"])] = doc["operatorName"]
-
-        # 对于没有找到记录的客户，填充默认值
-        return {str(cid): results.get(str(cid), "-") for cid in customer_ids}
+        await collection.create_index(OPERATOR_INDEX)
+    except PyMongoError as e:
+        logger.warning(f"在 {collection.name} 上创建索引 {OPERATOR_INDEX} 失败: {e}")
+        return False
+    logger.info(f"已在 {collection.name} 上创建索引 {OPERATOR_INDEX}")
+    return True
+
+
+# 查询一批客户的最后一条操作日志，返回 客户id -> (操作人, 操作时间)；
+# since 不为空时只查询该时间之后的日志
+async def fetch_last_operations(
+    collection: AsyncIOMotorCollection,
+    customer_ids: list,
+    since: datetime = None,
+    semaphore: asyncio.Semaphore = None,
+) -> Dict[str, Tuple[str, datetime]]:
+    match = {"customerId": {"$in": [int(cid) for cid in customer_ids]}}
+    if since:
+        match["operationTime"] = {"$gte": since}
+    pipeline = [
+        {"$match": match},
+        # 与复合索引同序排序，由索引直接提供顺序，不需要在内存中对全部日志排序
+        {"$sort": {"customerId": 1, "operationTime": -1}},
+        {
+            "$group": {
+                "_id": "$customerId",
+                "operatorName": {"$first": "$operatorName"},
+                "operationTime": {"$first": "$operationTime"},
+            }
+        },
+    ]
+    results = {}
+    async with semaphore or asyncio.Semaphore(1):
+        async for doc in collection.aggregate(pipeline, allowDiskUse=True):
+            results[str(doc["_id"])] = (doc["operatorName"], doc["operationTime"])
+    return results
+
+
+# 分批并发查询客户的最后操作人，返回 客户id -> (操作人, 操作时间)，没有日志的客户为 (None, None)；
+# cached 为本地缓存的记录，缓存过的客户只查询其同步位置之后的新日志
+async def fetch_last_operators(
+    db: AsyncIOMotorDatabase,
+    customer_ids: list,
+    cached: dict = None,
+    semaphore: asyncio.Semaphore = None,
+) -> Dict[str, Tuple[Optional[str], Optional[datetime]]]:
+    cached = cached or {}
+    semaphore = semaphore or asyncio.Semaphore(MONGO_CONCURRENCY)
+    customer_ids = [str(cid) for cid in customer_ids]
+
+    # 按同步位置分组，未缓存的客户 since 为 None，即全量查询
+    groups = {}
+    for cid in customer_ids:
+        since = cached[cid][2] if cid in cached else None
+        groups.setdefault(since, []).append(cid)
+    batches = await asyncio.gather(
+        *(
+            fetch_last_operations(
+                db.crm_customer_log, ids[i : i + MONGO_BATCH_SIZE], since, semaphore
+            )
+            for since, ids in groups.items()
+            for i in range(0, len(ids), MONGO_BATCH_SIZE)
+        )
+    )
+    operations = {}
+    for batch in batches:
+        operations.update(batch)
 
-    except Exception as e:
-        logger.error(f"Error fetching last operators: {e}")
-        return {str(cid): "-" for cid in customer_ids}
+    # 没有新日志的客户沿用缓存中的记录
+    return {
+        cid: operations.get(cid) or (cached[cid][:2] if cid in cached else (None, None))
+        for cid in customer_ids
+    }
 
 
 async def main():
@@ -72,50 +153,93 @@ async def main():
             serverSelectionTimeoutMS=5000,  # 设置超时时间
         )
         db = mongo_client.bwcmall
+        await ensure_operator_index(
+            db.crm_customer_log,
+            create=os.getenv("CRM_CUSTOMER_STATISTICS_CREATE_INDEX", "0") == "1",
+        )
+        operator_cache = OperatorCache.from_env()
+        cached = operator_cache.load() if operator_cache else {}
+        # 所有批次共用一个信号量，限制同时在 MongoDB 上执行的聚合查询数
+        semaphore = asyncio.Semaphore(MONGO_CONCURRENCY)
         # 客户id转成字符串
+        # 标签和最近一次退回公海记录各自在派生表中一次性算出再关联，不再对每个客户执行相关子查询；
+        # 最近一次退回记录用窗口函数取出（需要 MySQL 8.0），同时算出客户最后的退回创建时间用于过滤
         query = """
             select CAST(c.id AS CHAR) as '客户id', c.name as '公司名称',c.contacts as '联系人',c.phone as '手机号码', 
             case c.is_resource WHEN 1 THEN '资源' ELSE '客户' end as '类型',
             ss.value as '销售进程',cl.`value` as '客户等级',
-            ifnull((
-                    SELECT GROUP_CONCAT(cTT.value SEPARATOR ',')
-                    FROM crm_customer_tag c_tag 
-                LEFT JOIN  crm_customer_dict cTT on (cTT.`code` = 'customer_tag' and c_tag.tag_id = cTT.id) 
-                    WHERE c_tag.customer_id = c.id and c_tag.record_status = 1
-                ) ,'-')AS '客户标签',
+            ifnull(tags.tag_names,'-') AS '客户标签',
             ifnull(ce.business_scope,'-') as '生产产品' ,
             ifnull(cco.`value`,'-') as '设备数量',
             ifnull(DATE_FORMAT(c.follow_up_time,'%Y-%m-%d'),'-') as '最后跟进时间',
-            ifnull(DATE_FORMAT((
-                select crt.modify_time from crm_customer_return crt where crt.customer_id = c.id
-                ORDER BY crt.modify_time desc limit 1
-            ),'%Y-%m-%d'),'-') as '退回公海时间',
-            ifnull((
-                select crtn.remark from crm_customer_return crtn where crtn.customer_id = c.id
-                ORDER BY crtn.modify_time desc limit 1
-            ),'-') as '退回原因',
+            ifnull(DATE_FORMAT(rt.modify_time,'%Y-%m-%d'),'-') as '退回公海时间',
+            ifnull(rt.remark,'-') as '退回原因',
             ifnull(u.username,'-') as '最后跟进人'
             from crm_customer c 
+            join (
+                select r.customer_id, r.modify_time, r.remark
+                from (
+                    select cr.customer_id, cr.modify_time, cr.remark, cr.create_time,
+                    ROW_NUMBER() OVER (PARTITION BY cr.customer_id ORDER BY cr.modify_time desc) as rn,
+                    MAX(cr.create_time) OVER (PARTITION BY cr.customer_id) as last_create_time
+                    from crm_customer_return cr
+                ) r
+                where r.rn = 1 and r.last_create_time > '2023-05-01'
+            ) rt on rt.customer_id = c.id
+            left join (
+                select c_tag.customer_id, GROUP_CONCAT(cTT.value SEPARATOR ',') as tag_names
+                from crm_customer_tag c_tag 
+                LEFT JOIN  crm_customer_dict cTT on (cTT.`code` = 'customer_tag' and c_tag.tag_id = cTT.id) 
+                where c_tag.record_status = 1
+                group by c_tag.customer_id
+            ) tags on tags.customer_id = c.id
             left join crm_customer_dict ss on (ss.`code` = 'customer_process' and c.process = ss.id) 
             left join crm_customer_dict cl on (cl.`code` = 'customer_level' and c.`level` = cl.id) 
             left join crm_customer_extend ce on c.id = ce.customer_id
             left join crm_customer_dict cco on (cco.`code` = 'purchase_quantity' and ce.purchase_quantity = cco.id)
             left join crm_user u on c.follow_up_user = u.id
             where c.`owner` is NULL and c.record_status = 1 and c.source = 10000001 
-            and EXISTS(
-            select 1 from crm_customer_return cr where cr.create_time > '2023-05-01' and cr.customer_id = c.id)
         """
-        df = await fetch_data(engine, query)
-
-        # 批量获取所有客户的最后操作人信息
-        customer_ids = df["客户id"].tolist()
-        operators_dict = await fetch_last_operators(db, customer_ids)
+        # 每读到一批客户就开始查询这批客户的最后操作人，MongoDB 查询与后续批次的 MySQL 读取并发进行
+        operator_tasks = []
+        df = await stream_query(
+            engine,
+            query,
+            dtypes=CUSTOMER_DTYPES,
+            name="customers",
+            on_batch=lambda batch: operator_tasks.append(
+                asyncio.create_task(
+                    fetch_last_operators(
+                        db, batch["客户id"].tolist(), cached, semaphore
+                    )
+                )
+            ),
+        )
+        operations = {}
+        for result in await asyncio.gather(*operator_tasks, return_exceptions=True):
+            # 查询失败的批次最后操作人填充默认值，也不写入缓存
+            if isinstance(result, Exception):
+                logger.error(f"Error fetching last operators: {result}")
+            else:
+                operations.update(result)
 
         # 使用映射更新DataFrame
-        df["最后操作人"] = df["客户id"].map(operators_dict)
+        df["最后操作人"] = df["客户id"].map(
+            lambda cid: (operations.get(cid) or (None,))[0] or "-"
+        )
+
+        if operator_cache and operations:
+            # 下次从本次看到的最新日志时间开始查询
+            synced_until = max(
+                [time for _, time in operations.values() if time]
+                + [entry[2] for entry in cached.values()],
+                default=datetime.min,
+            )
+            operator_cache.save(operations, synced_until)
 
         file_name = "customer_statistics.xlsx"
         df.to_excel(file_name, index=False)
+        logger.info(query_metrics.format_metrics_summary())
     except Exception as e:
         logger.error(f"Error fetching data: {e}")
     finally:
@@ -0,0 +1,69 @@
+import sys
+import argparse
+import logging
+from datetime import datetime
+import ConsultantTradeReport
+import ProfitAnalysisReport
+from monthly_fact_store import (
+    DEFAULT_REFRESH_MONTHS,
+    MonthlyFactStore,
+    materialize_months,
+    previous_months,
+)
+from report_runner import ReportRunner
+
+logger = logging.getLogger(__name__)
+
+# 需要按月物化的汇总数据
+FACT_SOURCES = {
+    "profit": ProfitAnalysisReport.CATEGORY_FACTS,
+    "consultant": ConsultantTradeReport.CUSTOMER_FACTS,
+}
+
+
+# 物化最近 months 个月中缺失的月份，并重新计算最近 refresh_months 个月
+def materialize(
+    runner: ReportRunner,
+    store: MonthlyFactStore,
+    source_names: list,
+    months: int,
+    refresh_months: int = None,
+    date: datetime = None,
+) -> None:
+    target_months = previous_months(months, date)
+    refresh_months = DEFAULT_REFRESH_MONTHS if refresh_months is None else refresh_months
+    refresh = target_months[-refresh_months:] if refresh_months else []
+    for name in source_names:
+        materialize_months(runner, store, FACT_SOURCES[name], target_months, refresh)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="增量物化月度汇总表")
+    parser.add_argument(
+        "sources",
+        nargs="*",
+        help=f"要物化的汇总数据（{', '.join(FACT_SOURCES)}），默认全部",
+    )
+    parser.add_argument(
+        "--months", type=int, default=13, help="覆盖截至上个月的最近月份数"
+    )
+    parser.add_argument(
+        "--refresh-months",
+        type=int,
+        default=None,
+        help="重新计算最近几个月，默认读取 MONTHLY_FACT_STORE_REFRESH_MONTHS",
+    )
+    args = parser.parse_args()
+    source_names = args.sources or list(FACT_SOURCES)
+    unknown_sources = [name for name in source_names if name not in FACT_SOURCES]
+    if unknown_sources:
+        parser.error(f"未知的汇总数据: {unknown_sources}")
+
+    fact_store = MonthlyFactStore.from_env()
+    if fact_store is None:
+        logger.error("缺少必要的环境变量: MONTHLY_FACT_STORE_PATH")
+        sys.exit(1)
+    with ReportRunner() as runner:
+        materialize(
+            runner, fact_store, source_names, args.months, args.refresh_months
+        )
@@ -0,0 +1,41 @@
+import argparse
+from datetime import datetime
+import ConsultantTradeReport
+import ExportOrder
+import FirstOrderStatistics
+import ProfitAnalysisReport
+from report_scheduler import run_scheduled_reports
+
+# 可在同一进程中执行的报表，共享数据库引擎、连接池和邮件发送器，相同的查询只执行一次
+REPORTS = {
+    "profit": ProfitAnalysisReport.build_report_spec,
+    "consultant": ConsultantTradeReport.build_report_spec,
+    "first_order": FirstOrderStatistics.build_report_spec,
+    "export_order": ExportOrder.build_report_spec,
+}
+MONTH_END_REPORTS = ["profit", "consultant", "first_order"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="在同一进程中执行月末报表")
+    parser.add_argument(
+        "reports",
+        nargs="*",
+        help=f"要执行的报表（{', '.join(REPORTS)}），默认执行全部月末报表",
+    )
+    parser.add_argument(
+        "--db-budget",
+        type=int,
+        default=None,
+        help="所有数据库合计允许的并发查询数，默认读取 REPORT_SCHEDULER_DB_BUDGET",
+    )
+    args = parser.parse_args()
+    report_names = args.reports or MONTH_END_REPORTS
+    unknown_reports = [name for name in report_names if name not in REPORTS]
+    if unknown_reports:
+        parser.error(f"未知的报表: {unknown_reports}")
+    # 所有报表使用同一个基准日期计算统计区间
+    today = datetime.now()
+    run_scheduled_reports(
+        [REPORTS[name](today) for name in report_names], args.db_budget
+    )
@@ -0,0 +1,183 @@
+import os
+import json
+import logging
+import sqlite3
+import pandas as pd
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+from report_runner import QuerySpec, ReportRunner
+
+logger = logging.getLogger(__name__)
+
+# 每次物化时重新计算的最近已结束月份数，用于覆盖月末之后才修改的售后等数据
+DEFAULT_REFRESH_MONTHS = int(os.getenv("MONTHLY_FACT_STORE_REFRESH_MONTHS", "1"))
+# 月末之后的售后、补单等数据在多少天内到齐；在此之前物化的月份读取时重新计算
+SETTLE_DAYS = int(os.getenv("MONTHLY_FACT_STORE_SETTLE_DAYS", "15"))
+
+
+@dataclass
+class FactSource:
+    """
+    按月物化的汇总数据来源
+    :param name: 汇总表名称
+    :param build_queries: 接收 (月初, 下月初)，返回 查询名称 -> QuerySpec
+    :param transform: 将查询结果转换为一个月的汇总行
+    """
+
+    name: str
+    build_queries: Callable[[str, str], Dict[str, QuerySpec]]
+    transform: Callable[[Dict[str, pd.DataFrame]], pd.DataFrame]
+
+
+# 'YYYY-MM' -> ('YYYY-MM-01', 下个月 'YYYY-MM-01')，用于半开区间的日期条件
+def month_bounds(month: str) -> tuple:
+    first_day = datetime.strptime(month, "%Y-%m")
+    if first_day.month == 12:
+        next_first_day = first_day.replace(year=first_day.year + 1, month=1)
+    else:
+        next_first_day = first_day.replace(month=first_day.month + 1)
+    return first_day.strftime("%Y-%m-%d"), next_first_day.strftime("%Y-%m-%d")
+
+
+# 截至上个月（含）的最近 count 个月份，按时间升序
+def previous_months(count: int, date: datetime = None) -> List[str]:
+    date = date or datetime.now()
+    year, month = date.year, date.month
+    months = []
+    for _ in range(count):
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+        months.append(f"{year:04d}-{month:02d}")
+    return months[::-1]
+
+
+# 月份是否在数据到齐（月末 + SETTLE_DAYS 天）之后物化
+def is_settled(month: str, refreshed_at: str) -> bool:
+    settled_at = datetime.strptime(month_bounds(month)[1], "%Y-%m-%d") + timedelta(
+        days=SETTLE_DAYS
+    )
+    return datetime.fromisoformat(refreshed_at) >= settled_at
+
+
+class MonthlyFactStore:
+    def __init__(self, db_path: str):
+        """
+        初始化按月汇总存储（SQLite），每个汇总表按月份整体替换
+        :param db_path: SQLite 文件路径
+        """
+        self.db_path = db_path
+        self.engine = create_engine(f"sqlite:///{db_path}", poolclass=NullPool)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS materialized_month (
+                    name TEXT NOT NULL,
+                    month TEXT NOT NULL,
+                    refreshed_at TEXT NOT NULL,
+                    PRIMARY KEY (name, month)
+                )
+                """
+            )
+
+    # 设置了 MONTHLY_FACT_STORE_PATH 时启用，否则报表直接查询业务库
+    @classmethod
+    def from_env(cls) -> Optional["MonthlyFactStore"]:
+        db_path = os.getenv("MONTHLY_FACT_STORE_PATH")
+        return cls(db_path) if db_path else None
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def materialized_months(self, name: str) -> List[str]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT month FROM materialized_month WHERE name = ? ORDER BY month",
+                (name,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    # 已物化的月份 -> 物化时间
+    def refreshed_at(self, name: str) -> Dict[str, str]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT month, refreshed_at FROM materialized_month WHERE name = ?",
+                (name,),
+            ).fetchall()
+        return dict(rows)
+
+    # 用新的汇总行替换某个月份的数据；删除、写入和物化标记在同一个事务中提交，
+    # 中途失败时保留原来的数据
+    def replace_month(self, name: str, month: str, df: pd.DataFrame) -> None:
+        df = df.assign(month=month)
+        with self.engine.begin() as conn:
+            # 首次写入时按 DataFrame 的列建表
+            df.head(0).to_sql(name, conn, if_exists="append", index=False)
+            conn.exec_driver_sql(
+                f"CREATE INDEX IF NOT EXISTS idx_{name}_month ON {name} (month)"
+            )
+            conn.exec_driver_sql(f"DELETE FROM {name} WHERE month = ?", (month,))
+            df.to_sql(name, conn, if_exists="append", index=False)
+            conn.exec_driver_sql(
+                "INSERT OR REPLACE INTO materialized_month VALUES (?, ?, ?)",
+                (name, month, datetime.now().isoformat(timespec="seconds")),
+            )
+
+    def load(self, name: str, months: List[str]) -> pd.DataFrame:
+        with closing(self._connect()) as conn:
+            return pd.read_sql(
+                f"SELECT * FROM {name} WHERE month IN (SELECT value FROM json_each(?))",
+                conn,
+                params=(json.dumps(list(months)),),
+            )
+
+
+# 并发执行一个月份的全部查询；每个查询都经过 runner.run_query，
+# 受每个数据库的并发上限和调度器全局预算的约束（不走异步执行路径）
+def query_month(
+    runner: ReportRunner, source: FactSource, month: str
+) -> Dict[str, pd.DataFrame]:
+    queries = source.build_queries(*month_bounds(month))
+    if not queries:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        futures = {
+            name: executor.submit(runner.run_query, query, f"{source.name}/{name}")
+            for name, query in queries.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
+# 物化缺失的月份、数据到齐之前物化的月份，以及 refresh 中指定需要重新计算的月份
+def materialize_months(
+    runner: ReportRunner,
+    store: MonthlyFactStore,
+    source: FactSource,
+    months: List[str],
+    refresh: List[str] = None,
+) -> None:
+    refreshed_at = store.refreshed_at(source.name)
+    for month in months:
+        if (
+            month in refreshed_at
+            and month not in (refresh or [])
+            and is_settled(month, refreshed_at[month])
+        ):
+            continue
+        logger.info(f"物化 {source.name} {month}")
+        results = query_month(runner, source, month)
+        store.replace_month(source.name, month, source.transform(results))
+
+
+# 读取指定月份的汇总数据，缺失或尚未定稿的月份先从业务库物化
+def load_months(
+    runner: ReportRunner,
+    store: MonthlyFactStore,
+    source: FactSource,
+    months: List[str],
+) -> pd.DataFrame:
+    materialize_months(runner, store, source, months)
+    return store.load(source.name, months)
@@ -0,0 +1,74 @@
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+
+def _to_datetime(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+class OperatorCache:
+    def __init__(self, db_path: str):
+        """
+        客户最后操作人的本地缓存（SQLite）
+        每个客户记录最后一条操作日志的操作人、操作时间，以及同步到的日志时间位置，
+        再次运行时只需查询该位置之后的新日志
+        :param db_path: SQLite 文件路径
+        """
+        self.db_path = db_path
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS customer_operator (
+                    customer_id TEXT PRIMARY KEY,
+                    operator_name TEXT,
+                    operation_time TEXT,
+                    synced_until TEXT NOT NULL
+                )
+                """
+            )
+
+    # 设置了 CRM_CUSTOMER_STATISTICS_OPERATOR_CACHE 时启用，否则每次全量查询
+    @classmethod
+    def from_env(cls) -> Optional["OperatorCache"]:
+        db_path = os.getenv("CRM_CUSTOMER_STATISTICS_OPERATOR_CACHE")
+        return cls(db_path) if db_path else None
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    # 客户id -> (操作人, 操作时间, 同步位置)，没有操作日志的客户操作人和时间为 None
+    def load(self) -> Dict[str, Tuple[Optional[str], Optional[datetime], datetime]]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT * FROM customer_operator").fetchall()
+        return {
+            customer_id: (
+                operator_name,
+                _to_datetime(operation_time),
+                _to_datetime(synced_until),
+            )
+            for customer_id, operator_name, operation_time, synced_until in rows
+        }
+
+    # 保存本次查询过的客户，operations 为 客户id -> (操作人, 操作时间)
+    def save(
+        self,
+        operations: Dict[str, Tuple[Optional[str], Optional[datetime]]],
+        synced_until: datetime,
+    ) -> None:
+        rows = [
+            (
+                customer_id,
+                operator_name,
+                operation_time.isoformat() if operation_time else None,
+                synced_until.isoformat(),
+            )
+            for customer_id, (operator_name, operation_time) in operations.items()
+        ]
+        with closing(self._connect()) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO customer_operator VALUES (?, ?, ?, ?)", rows
+            )
+            conn.commit()
@@ -0,0 +1,88 @@
+import json
+import sqlite3
+import pandas as pd
+from contextlib import closing
+from typing import List, Optional
+
+# 本地订单毛利结果存储（SQLite），保存每个 bwc_order_id 的金额、成本、毛利以及增量水位
+PROFIT_COLUMNS = ["bwc_order_id", "order_amount", "cost", "profit"]
+
+
+class OrderProfitStore:
+    def __init__(self, db_path: str):
+        """
+        初始化本地结果存储
+        :param db_path: SQLite 文件路径
+        """
+        self.db_path = db_path
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS order_profit (
+                    bwc_order_id INTEGER PRIMARY KEY,
+                    order_amount REAL NOT NULL,
+                    cost REAL NOT NULL,
+                    profit REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS watermark (
+                    name TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def get_watermark(self, name: str = "modify_time") -> Optional[str]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT value FROM watermark WHERE name = ?", (name,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, value: str, name: str = "modify_time") -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO watermark (name, value) VALUES (?, ?)",
+                (name, value),
+            )
+
+    def load(self, order_ids: List[int] = None) -> pd.DataFrame:
+        with closing(self._connect()) as conn:
+            if order_ids is None:
+                return pd.read_sql("SELECT * FROM order_profit", conn)
+            # 通过 json_each 传入 id 列表，避免 SQLite 绑定参数个数限制
+            return pd.read_sql(
+                """
+                SELECT * FROM order_profit
+                WHERE bwc_order_id IN (SELECT value FROM json_each(?))
+                """,
+                conn,
+                params=(json.dumps([int(order_id) for order_id in order_ids]),),
+            )
+
+    # 写入（覆盖）重新计算过的订单
+    def upsert(self, df: pd.DataFrame) -> None:
+        if df.empty:
+            return
+        rows = (
+            df[PROFIT_COLUMNS]
+            .astype({"bwc_order_id": "int64"})
+            .itertuples(index=False, name=None)
+        )
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO order_profit VALUES (?, ?, ?, ?)",
+                ((int(r[0]), float(r[1]), float(r[2]), float(r[3])) for r in rows),
+            )
+
+    # 全量重建时清空结果和水位
+    def clear(self) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM order_profit")
+            conn.execute("DELETE FROM watermark")
@@ -0,0 +1,150 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import pandas as pd
+from pathlib import Path
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow  # noqa: F401
+
+    CACHE_FORMAT = "parquet"
+except ImportError:
+    # 没有安装 pyarrow 时退化为 pickle 格式
+    CACHE_FORMAT = "pkl"
+
+
+class QueryCache:
+    def __init__(
+        self,
+        cache_dir: str,
+        ttl: int = 7 * 24 * 3600,
+        max_bytes: int = 1024 * 1024 * 1024,
+    ):
+        """
+        初始化查询结果缓存
+        :param cache_dir: 缓存目录
+        :param ttl: 默认过期时间（秒）
+        :param max_bytes: 缓存目录总大小上限，超过后按最近最少使用淘汰
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    # 设置了 QUERY_CACHE_DIR 时启用缓存，否则返回 None
+    @classmethod
+    def from_env(cls) -> Optional["QueryCache"]:
+        cache_dir = os.getenv("QUERY_CACHE_DIR")
+        if not cache_dir:
+            return None
+        return cls(
+            cache_dir,
+            ttl=int(os.getenv("QUERY_CACHE_TTL", str(7 * 24 * 3600))),
+            max_bytes=int(os.getenv("QUERY_CACHE_MAX_BYTES", str(1024**3))),
+        )
+
+    # 缓存键：规范化后的 SQL + 绑定参数 + 数据库
+    @staticmethod
+    def make_key(db_key: str, query: str, params: dict = None) -> str:
+        normalized_query = re.sub(r"\s+", " ", str(query)).strip()
+        payload = json.dumps(
+            {"db": db_key, "query": normalized_query, "params": params or {}},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.{CACHE_FORMAT}"
+
+    # 读取失败（文件损坏、被并发淘汰等）时记录警告并视为未命中
+    def get(self, key: str, ttl: int = None) -> Optional[pd.DataFrame]:
+        path = self._path(key)
+        try:
+            # mtime 为写入时间，用于判断是否过期
+            written_at = path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+        if ttl is None:
+            ttl = self.ttl
+        try:
+            if ttl and time.time() - written_at > ttl:
+                path.unlink(missing_ok=True)
+                return None
+            if CACHE_FORMAT == "parquet":
+                df = pd.read_parquet(path)
+            else:
+                df = pd.read_pickle(path)
+            # atime 记录最近访问时间，用于 LRU 淘汰，保持 mtime 不变
+            os.utime(path, (time.time(), written_at))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"读取查询缓存 {key[:12]} 失败，视为未命中: {e}")
+            path.unlink(missing_ok=True)
+            return None
+        return df
+
+    # 写入失败（如混合类型的列无法写成 parquet）时记录警告并跳过，不影响已查到的结果
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        path = self._path(key)
+        # 先写临时文件再替换，避免并发读到写了一半的文件
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            if CACHE_FORMAT == "parquet":
+                df.to_parquet(tmp_path, index=False)
+            else:
+                df.to_pickle(tmp_path)
+            os.replace(tmp_path, path)
+            self.evict()
+        except Exception as e:
+            logger.warning(f"写入查询缓存 {key[:12]} 失败，跳过缓存: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+    # 按最近访问时间淘汰，直到总大小不超过上限
+    def evict(self) -> None:
+        with self._lock:
+            files = []
+            for path in self.cache_dir.glob(f"*.{CACHE_FORMAT}"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_atime, stat.st_size, path))
+            total_bytes = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total_bytes <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total_bytes -= size
+
+    def clear(self) -> None:
+        for path in self.cache_dir.glob(f"*.{CACHE_FORMAT}"):
+            path.unlink(missing_ok=True)
+
+    # 命中缓存直接返回，否则执行 loader 并写入缓存
+    def get_or_load(
+        self,
+        db_key: str,
+        query: str,
+        loader: Callable[[], pd.DataFrame],
+        params: dict = None,
+        ttl: int = None,
+    ) -> pd.DataFrame:
+        key = self.make_key(db_key, query, params)
+        df = self.get(key, ttl)
+        if df is not None:
+            logger.info(f"查询缓存命中: {key[:12]}")
+            return df
+        df = loader()
+        self.put(key, df)
+        return df
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import pandas as pd
+from collections import deque
+from datetime import datetime
+from sqlalchemy import create_engine, event
+from typing import Callable, List
+from query_plan import explain_query
+
+logger = logging.getLogger(__name__)
+
+# 记录每个查询的耗时、行数和内存，QUERY_METRICS=0 时关闭
+METRICS_ENABLED = os.getenv("QUERY_METRICS", "1") == "1"
+# 同时记录执行计划（每次实际执行查询都会多一次 EXPLAIN）
+EXPLAIN_ENABLED = os.getenv("QUERY_METRICS_EXPLAIN", "0") == "1"
+# JSON-lines 运行日志路径，未设置时只在内存中汇总
+LOG_PATH = os.getenv("QUERY_METRICS_LOG")
+# 内存中最多保留的记录数，长时间运行的进程只保留最近的记录
+MAX_RECORDS = int(os.getenv("QUERY_METRICS_MAX_RECORDS", "10000"))
+# 估算传输字节数时抽样的行数
+BYTES_SAMPLE_ROWS = 1000
+
+_records = deque(maxlen=MAX_RECORDS)
+_records_lock = threading.Lock()
+_local = threading.local()
+_run_id = uuid.uuid4().hex[:12]
+
+
+# 开始新的一次运行，之后的指标记录都带上新的 run_id
+def start_run() -> str:
+    global _run_id
+    _run_id = uuid.uuid4().hex[:12]
+    return _run_id
+
+
+def get_records(run_id: str = None) -> List[dict]:
+    run_id = run_id or _run_id
+    with _records_lock:
+        return [record for record in _records if record["run_id"] == run_id]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    conn.info.setdefault("query_metrics_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    elapsed = time.perf_counter() - conn.info["query_metrics_start"].pop()
+    if getattr(_local, "server_time", None) is not None:
+        _local.server_time += elapsed
+        _local.executions += 1
+
+
+# execute 抛出异常时不会触发 after_cursor_execute，在这里丢弃开始时间
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    starts = conn.info.get("query_metrics_start") if conn is not None else None
+    if starts:
+        starts.pop()
+
+
+# 在引擎上注册游标事件，统计当前线程中 execute 的耗时（驱动返回结果前的时间，近似服务端耗时）
+def instrument_engine(db_engine: create_engine) -> None:
+    with _records_lock:
+        if event.contains(db_engine, "before_cursor_execute", _before_cursor_execute):
+            return
+        event.listen(db_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(db_engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(db_engine, "handle_error", _handle_error)
+
+
+# 按文本协议估算传输的字节数：每个值的文本长度加 1 字节长度前缀；
+# 只对前 BYTES_SAMPLE_ROWS 行计算再按行数放大，避免对整个结果做字符串转换
+def estimate_bytes(df: pd.DataFrame) -> int:
+    sample = df.head(BYTES_SAMPLE_ROWS)
+    if sample.empty:
+        return 0
+    total = 0
+    # 按位置取列，重复的列名也能处理
+    for i in range(sample.shape[1]):
+        values = sample.iloc[:, i].dropna()
+        total += int(values.astype(str).str.len().sum()) + len(sample)
+    return int(total * len(df) / len(sample))
+
+
+def _write_log(record: dict) -> None:
+    if not LOG_PATH:
+        return
+    with _records_lock:
+        with open(LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+# 执行 load 并记录指标：查询名称、总耗时、服务端耗时、行数、传输字节数、DataFrame 内存
+def record_query(
+    name: str,
+    db_engine: create_engine,
+    query,
+    load: Callable[[], pd.DataFrame],
+    params: dict = None,
+) -> pd.DataFrame:
+    if not METRICS_ENABLED:
+        return load()
+
+    instrument_engine(db_engine)
+    # 嵌套记录时先保存外层的累计值，结束后再把内层耗时累加回去
+    outer = (getattr(_local, "server_time", None), getattr(_local, "executions", 0))
+    _local.server_time, _local.executions = 0.0, 0
+    start = time.perf_counter()
+    try:
+        df = load()
+    finally:
+        wall_time = time.perf_counter() - start
+        server_time, executions = _local.server_time, _local.executions
+        if outer[0] is None:
+            _local.server_time = None
+        else:
+            _local.server_time = outer[0] + server_time
+            _local.executions = outer[1] + executions
+
+    add_record(
+        name, db_engine, query, df, wall_time, server_time, executions, params
+    )
+    return df
+
+
+# 记录一条查询指标；异步查询等无法通过 record_query 包装的调用可以直接使用
+def add_record(
+    name: str,
+    db_engine: create_engine,
+    query,
+    df: pd.DataFrame,
+    wall_time: float,
+    server_time: float,
+    executions: int = 1,
+    params: dict = None,
+) -> dict:
+    record = {
+        "run_id": _run_id,
+        "name": name or " ".join(str(query).split())[:60],
+        "database": db_engine.url.database,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "wall_time": round(wall_time, 4),
+        "server_time": round(server_time, 4),
+        # 没有实际执行 SQL 说明命中了查询缓存
+        "cached": executions == 0,
+        "rows": len(df),
+        "bytes": estimate_bytes(df),
+        "memory": int(df.memory_usage(deep=True).sum()),
+    }
+    # 只对 SQL 文本执行 EXPLAIN，分块 IN 查询等预编译语句跳过
+    if EXPLAIN_ENABLED and executions and isinstance(query, str):
+        try:
+            plan = explain_query(db_engine, query, params)
+            record["explain"] = plan.to_dict("records")
+        except Exception as e:
+            logger.warning(f"查询 {record['name']} 执行 EXPLAIN 失败: {e}")
+
+    with _records_lock:
+        _records.append(record)
+    _write_log(record)
+    return record
+
+
+# 按查询汇总本次运行的指标，耗时最长的排在前面
+def format_metrics_summary(run_id: str = None) -> str:
+    records = get_records(run_id)
+    if not records:
+        return "查询指标：本次运行没有记录"
+    df = pd.DataFrame(records)
+    summary = (
+        df.groupby(["database", "name"], sort=False)
+        .agg(
+            次数=("name", "size"),
+            缓存命中=("cached", "sum"),
+            总耗时=("wall_time", "sum"),
+            服务端耗时=("server_time", "sum"),
+            行数=("rows", "sum"),
+            传输字节=("bytes", "sum"),
+            最大内存=("memory", "max"),
+        )
+        .sort_values("总耗时", ascending=False)
+        .reset_index()
+        .rename(columns={"database": "数据库", "name": "查询"})
+    )
+    return "查询指标：\n" + summary.to_string(index=False, float_format="%.3f")
@@ -0,0 +1,58 @@
+import os
+import logging
+import pandas as pd
+from sqlalchemy import create_engine, text
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# 预估扫描行数低于该值的全表扫描不提示（如字典表）
+PLAN_MIN_ROWS = int(os.getenv("QUERY_PLAN_MIN_ROWS", "1000"))
+
+
+# 执行 EXPLAIN 返回执行计划，MySQL 使用 EXPLAIN，SQLite 使用 EXPLAIN QUERY PLAN
+def explain_query(
+    db_engine: create_engine, query: str, params: dict = None
+) -> pd.DataFrame:
+    prefix = "EXPLAIN QUERY PLAN" if db_engine.dialect.name == "sqlite" else "EXPLAIN"
+    with db_engine.connect() as conn:
+        result = conn.execute(text(f"{prefix} {query}"), params or {})
+        return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+
+# 从执行计划中找出全表扫描和缺少索引的表
+def find_plan_issues(plan: pd.DataFrame, min_rows: int = None) -> List[str]:
+    min_rows = PLAN_MIN_ROWS if min_rows is None else min_rows
+    issues = []
+    if "detail" in plan.columns:
+        # SQLite：SCAN 表示全表扫描，AUTOMATIC INDEX 表示需要临时建索引
+        for detail in plan["detail"]:
+            if "AUTOMATIC" in detail:
+                issues.append(f"缺少索引: {detail}")
+            elif detail.startswith("SCAN") and "USING" not in detail:
+                issues.append(f"全表扫描: {detail}")
+        return issues
+
+    for row in plan.to_dict("records"):
+        table = row.get("table") or ""
+        # 派生表、UNION 结果等临时表不检查
+        if table.startswith("<") or (row.get("rows") or 0) < min_rows:
+            continue
+        if row.get("type") == "ALL":
+            if row.get("possible_keys"):
+                issues.append(
+                    f"全表扫描（未使用可用索引 {row['possible_keys']}）: {table}"
+                )
+            else:
+                issues.append(f"全表扫描（缺少索引）: {table}")
+        elif row.get("type") == "index":
+            issues.append(f"全索引扫描: {table}")
+    return issues
+
+
+# 以表格形式输出所有查询的执行计划问题
+def format_plan_summary(plan_issues: List[dict]) -> str:
+    if not plan_issues:
+        return "执行计划检查：未发现全表扫描或缺少索引的查询"
+    df = pd.DataFrame(plan_issues, columns=["数据库", "查询", "问题"])
+    return "执行计划检查：\n" + df.to_string(index=False)
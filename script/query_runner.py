@@ -0,0 +1,350 @@
+import os
+import re
+import uuid
+import itertools
+import logging
+import threading
+import pandas as pd
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import bindparam, create_engine, text
+from typing import Callable, Dict, Iterable, Iterator, Optional
+from query_cache import QueryCache
+from query_metrics import record_query
+
+logger = logging.getLogger(__name__)
+
+# 每个数据库默认允许的并发查询数，可通过环境变量调整
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("QUERY_RUNNER_MAX_CONCURRENCY", "4"))
+# id 数量超过该阈值时改用临时表在服务端关联，而不是分块 IN 查询
+TEMP_TABLE_THRESHOLD = int(os.getenv("QUERY_RUNNER_TEMP_TABLE_THRESHOLD", "20000"))
+TEMP_TABLE_INSERT_BATCH = 10000
+
+# 按数据库共享的信号量，同一进程内所有报表对同一数据库的并发查询共用一个上限
+_db_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+_db_semaphore_limits: Dict[str, int] = {}
+_db_semaphore_warned = set()
+_db_semaphores_lock = threading.Lock()
+# 所有数据库合计的并发预算，由 ReportScheduler 在运行期间设置，未设置时不限制
+_db_budget: Optional[threading.BoundedSemaphore] = None
+
+
+# 只取数据库类型而不含驱动，同一数据库的同步引擎和异步引擎共用信号量和缓存
+def get_db_key(db_engine: create_engine) -> str:
+    url = db_engine.url
+    return f"{url.get_backend_name()}://{url.host}:{url.port}/{url.database}"
+
+
+# 信号量在第一次访问该数据库时创建，max_concurrency 只对第一次调用生效，
+# 之后的调用传入不同的值会被忽略并记录警告；需要调整上限时使用 QUERY_RUNNER_MAX_CONCURRENCY
+def get_db_semaphore(
+    db_engine: create_engine, max_concurrency: int = None
+) -> threading.BoundedSemaphore:
+    key = get_db_key(db_engine)
+    with _db_semaphores_lock:
+        if key not in _db_semaphores:
+            limit = max_concurrency or DEFAULT_MAX_CONCURRENCY
+            _db_semaphores[key] = threading.BoundedSemaphore(limit)
+            _db_semaphore_limits[key] = limit
+        elif (
+            max_concurrency
+            and max_concurrency != _db_semaphore_limits[key]
+            # 每个数据库和取值只警告一次，避免分块查询时重复输出
+            and (key, max_concurrency) not in _db_semaphore_warned
+        ):
+            _db_semaphore_warned.add((key, max_concurrency))
+            logger.warning(
+                f"{key} 的并发上限已设为 {_db_semaphore_limits[key]}，"
+                f"忽略本次传入的 max_concurrency={max_concurrency}"
+            )
+        return _db_semaphores[key]
+
+
+def set_db_budget(budget: Optional[threading.BoundedSemaphore]) -> None:
+    global _db_budget
+    _db_budget = budget
+
+
+def get_db_budget() -> Optional[threading.BoundedSemaphore]:
+    return _db_budget
+
+
+# 执行一次数据库访问期间占用该数据库的并发名额和全局预算；
+# 先取数据库的名额再取全局预算，等待繁忙的数据库时不占用预算
+@contextmanager
+def db_slot(db_engine: create_engine, max_concurrency: int = None) -> Iterator[None]:
+    with get_db_semaphore(db_engine, max_concurrency), _db_budget or nullcontext():
+        yield
+
+
+# 金额转换为以分为单位的整数，Decimal / float 均适用，保留空值
+def to_cents(series: pd.Series) -> pd.Series:
+    cents = (pd.to_numeric(series, errors="coerce") * 100).round()
+    return cents.astype("Int64" if cents.isna().any() else "int64")
+
+
+# 按列声明转换类型：category 为分类，cents 为分为单位的金额，其余值直接传给 astype
+# （如 "string[pyarrow]"、"float32"），不存在的列忽略
+def apply_dtypes(df: pd.DataFrame, dtypes: Dict[str, str] = None) -> pd.DataFrame:
+    for column, dtype in (dtypes or {}).items():
+        if column not in df.columns:
+            continue
+        if dtype == "cents":
+            df[column] = to_cents(df[column])
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+# 读取查询结果并按声明优化列类型；dtype_backend="pyarrow" 时走列式读取（需要安装 pyarrow）
+def read_sql_typed(
+    query,
+    con,
+    dtypes: Dict[str, str] = None,
+    dtype_backend: str = None,
+    params: dict = None,
+) -> pd.DataFrame:
+    dtype_backend = dtype_backend or os.getenv("QUERY_RUNNER_DTYPE_BACKEND")
+    kwargs = {"dtype_backend": dtype_backend} if dtype_backend else {}
+    df = pd.read_sql(query, con, params=params, **kwargs)
+    return apply_dtypes(df, dtypes)
+
+
+# 月份 / 日期过滤条件：left(col,7)='YYYY-MM'、left(col,10)='YYYY-MM-DD'、
+# date_format(col,'%Y-%m')='YYYY-MM'、date(col)='YYYY-MM-DD'，对列套函数会导致无法使用索引
+PERIOD_FILTER_PATTERN = re.compile(
+    r"(?:left\(\s*(?P<left_col>[\w.`]+)\s*,\s*(?P<length>7|10)\s*\)"
+    r"|date_format\(\s*(?P<format_col>[\w.`]+)\s*,\s*'%Y-%m'\s*\)"
+    r"|date\(\s*(?P<date_col>[\w.`]+)\s*\))"
+    r"\s*=\s*'(?P<period>\d{4}-\d{2}(?:-\d{2})?)'",
+    re.IGNORECASE,
+)
+
+
+# 区间 'YYYY-MM' 或 'YYYY-MM-DD' 对应的半开区间 [start, end)；
+# 边界只取日期部分，列为 DATETIME 或 'YYYY-MM-DD[ HH:MM:SS]' 格式的字符串时都适用
+def period_bounds(period: str) -> tuple:
+    if len(period) == 7:
+        start = datetime.strptime(period, "%Y-%m")
+        end = (start + timedelta(days=32)).replace(day=1)
+    else:
+        start = datetime.strptime(period, "%Y-%m-%d")
+        end = start + timedelta(days=1)
+    return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+
+
+# 将月份 / 日期过滤条件改写为 col >= :start AND col < :end 的半开区间，区间值通过绑定参数传入；
+# 只在调用方指定 rewrite_periods 时执行（见 run_query）
+def rewrite_period_filters(query: str, params: dict = None) -> tuple:
+    params = dict(params or {})
+    counter = itertools.count()
+    rewritten = []
+
+    def replace(match: re.Match) -> str:
+        column = match["left_col"] or match["format_col"] or match["date_col"]
+        period = match["period"]
+        if match["length"]:
+            expected_length = int(match["length"])
+        else:
+            expected_length = 7 if match["format_col"] else 10
+        if len(period) != expected_length:
+            return match[0]
+        name = f"period_{next(counter)}"
+        params[f"{name}_start"], params[f"{name}_end"] = period_bounds(period)
+        rewritten.append(match[0])
+        return f"({column} >= :{name}_start AND {column} < :{name}_end)"
+
+    query = PERIOD_FILTER_PATTERN.sub(replace, query)
+    if rewritten:
+        logger.info(f"过滤条件已改写为区间查询: {'; '.join(rewritten)}")
+    return query, params
+
+
+# 执行查询，启用缓存时先查缓存；on_miss 在缓存未命中时于信号量内、查询前调用（如 EXPLAIN），
+# 参数为实际执行的 SQL 和绑定参数；rewrite_periods 为 True 时先改写月份 / 日期过滤条件
+def run_query(
+    db_engine: create_engine,
+    query: str,
+    max_concurrency: int = None,
+    cache: QueryCache = None,
+    dtypes: Dict[str, str] = None,
+    params: dict = None,
+    name: str = None,
+    on_miss: Callable[[str, dict], None] = None,
+    rewrite_periods: bool = False,
+) -> pd.DataFrame:
+    if rewrite_periods:
+        query, params = rewrite_period_filters(query, params)
+    # 有绑定参数时使用 text()，参数统一写作 :name
+    statement = text(query) if params else query
+
+    def load() -> pd.DataFrame:
+        with db_slot(db_engine, max_concurrency):
+            if on_miss:
+                on_miss(query, params)
+            return read_sql_typed(statement, db_engine, dtypes, params=params or None)
+
+    def load_cached() -> pd.DataFrame:
+        if cache is None:
+            return load()
+        # 列类型声明或绑定参数不同的结果分开缓存
+        return cache.get_or_load(
+            get_db_key(db_engine),
+            query,
+            load,
+            params={"dtypes": dtypes, "params": params},
+        )
+
+    return record_query(name, db_engine, query, load_cached, params)
+
+
+# 并发执行一批相互独立的查询，返回以查询名称为键的 DataFrame
+def run_queries(
+    db_engine: create_engine,
+    queries: Dict[str, str],
+    max_concurrency: int = None,
+    cache: QueryCache = None,
+    dtypes: Dict[str, str] = None,
+    params: dict = None,
+) -> Dict[str, pd.DataFrame]:
+    if not queries:
+        return {}
+
+    # 线程数不超过查询数，真正打到数据库的并发由信号量控制
+    max_workers = min(len(queries), max_concurrency or DEFAULT_MAX_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            name: executor.submit(
+                run_query,
+                db_engine,
+                query,
+                max_concurrency,
+                cache,
+                dtypes,
+                params,
+                str(name),
+            )
+            for name, query in queries.items()
+        }
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logger.error(f"查询 {name} 执行失败: {e}")
+                raise
+        return results
+
+
+# 去除空值并去重，保持原有顺序；numpy 标量转换为 Python 原生类型以便驱动绑定
+def unique_ids(ids: Iterable) -> list:
+    return list(
+        dict.fromkeys(
+            i.item() if hasattr(i, "item") else i
+            for i in ids
+            if i is not None and not pd.isna(i)
+        )
+    )
+
+
+# 按 id 分块执行带 IN 条件的查询，id 通过绑定参数传入
+# query 中用 "IN :ids" 表示 id 列表（不加括号），其他参数通过 params 传入
+def fetch_in_chunks(
+    db_engine: create_engine,
+    query: str,
+    ids: Iterable,
+    param_name: str = "ids",
+    chunk_size: int = 1000,
+    params: dict = None,
+    max_concurrency: int = None,
+    name: str = None,
+) -> pd.DataFrame:
+    statement = text(query).bindparams(bindparam(param_name, expanding=True))
+    ids = unique_ids(ids)
+    # 空列表也执行一次查询（SQLAlchemy 会渲染为空集合条件），保证返回的列结构一致
+    chunks = [ids[i : i + chunk_size] for i in range(0, len(ids), chunk_size)] or [[]]
+
+    def load_chunk(chunk: list) -> pd.DataFrame:
+        with db_slot(db_engine, max_concurrency):
+            return read_sql_typed(
+                statement, db_engine, params={**(params or {}), param_name: chunk}
+            )
+
+    # 每个分块单独记录指标，汇总时按查询名称合并
+    def run_chunk(chunk: list) -> pd.DataFrame:
+        return record_query(name, db_engine, statement, lambda: load_chunk(chunk))
+
+    if len(chunks) == 1:
+        return run_chunk(chunks[0])
+
+    max_workers = min(len(chunks), max_concurrency or DEFAULT_MAX_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(run_chunk, chunks))
+    return pd.concat(results, ignore_index=True)
+
+
+# 将 id 批量写入会话级临时表，把 query 中的 "IN :ids" 改写为对临时表的子查询，在服务端完成关联
+def fetch_by_temp_table(
+    db_engine: create_engine,
+    query: str,
+    ids: Iterable,
+    param_name: str = "ids",
+    params: dict = None,
+    max_concurrency: int = None,
+    name: str = None,
+) -> pd.DataFrame:
+    ids = unique_ids(ids)
+    table_name = f"tmp_{param_name}_{uuid.uuid4().hex[:8]}"
+    drop_sql = (
+        f"DROP TEMPORARY TABLE IF EXISTS {table_name}"
+        if db_engine.dialect.name == "mysql"
+        else f"DROP TABLE IF EXISTS {table_name}"
+    )
+    statement = text(
+        re.sub(
+            rf"IN\s*:{param_name}\b",
+            f"IN (SELECT id FROM {table_name})",
+            query,
+            flags=re.IGNORECASE,
+        )
+    )
+
+    # 临时表只在当前连接中可见，整个过程必须使用同一个连接
+    def load() -> pd.DataFrame:
+        with db_slot(db_engine, max_concurrency), db_engine.connect() as conn:
+            conn.execute(
+                text(f"CREATE TEMPORARY TABLE {table_name} (id BIGINT PRIMARY KEY)")
+            )
+            try:
+                insert_sql = text(f"INSERT INTO {table_name} (id) VALUES (:id)")
+                for i in range(0, len(ids), TEMP_TABLE_INSERT_BATCH):
+                    batch = ids[i : i + TEMP_TABLE_INSERT_BATCH]
+                    conn.execute(insert_sql, [{"id": value} for value in batch])
+                return read_sql_typed(statement, conn, params=params or {})
+            finally:
+                conn.execute(text(drop_sql))
+                conn.commit()
+
+    # 指标包含建表和写入临时表的耗时
+    return record_query(name, db_engine, statement, load)
+
+
+# 根据 id 数量选择查询方式：数量较少时分块 IN 查询，超过阈值时使用临时表关联
+def fetch_by_ids(
+    db_engine: create_engine,
+    query: str,
+    ids: Iterable,
+    param_name: str = "ids",
+    params: dict = None,
+    temp_table_threshold: int = None,
+    name: str = None,
+) -> pd.DataFrame:
+    ids = unique_ids(ids)
+    threshold = temp_table_threshold or TEMP_TABLE_THRESHOLD
+    if len(ids) > threshold:
+        logger.info(f"id 数量 {len(ids)} 超过 {threshold}，使用临时表关联查询")
+        return fetch_by_temp_table(
+            db_engine, query, ids, param_name, params, name=name
+        )
+    return fetch_in_chunks(db_engine, query, ids, param_name, params=params, name=name)
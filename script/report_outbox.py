@@ -0,0 +1,327 @@
+import os
+import sys
+import shutil
+import asyncio
+import hashlib
+import argparse
+import logging
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timedelta
+from typing import List, Optional
+from dotenv import load_dotenv
+from EmailSender import Email, EmailSender
+
+logger = logging.getLogger(__name__)
+
+# 失败后的重试间隔从 RETRY_BASE 秒开始每次翻倍，最长 RETRY_MAX 秒
+RETRY_BASE = int(os.getenv("REPORT_OUTBOX_RETRY_BASE", "60"))
+RETRY_MAX = int(os.getenv("REPORT_OUTBOX_RETRY_MAX", str(6 * 3600)))
+# 超过最大尝试次数后不再重试，文件保留在发件箱目录中等待人工处理
+MAX_ATTEMPTS = int(os.getenv("REPORT_OUTBOX_MAX_ATTEMPTS", "8"))
+# 发送中的记录超过该时间（秒）未完成时，视为 worker 已退出并重新发送
+LEASE_SECONDS = 3600
+# 同时发送的邮件数
+DEFAULT_CONCURRENCY = int(os.getenv("REPORT_OUTBOX_CONCURRENCY", "3"))
+
+
+# 同一报表的同一次运行（run_key，如报表数据的期间或调度系统传入的运行 id）只发送一次，
+# 重复入队和重试都不会重复发送，与入队时是哪一天无关；
+# 已放弃重试（failed）的记录再次入队时会用新文件重新发送
+def make_idempotency_key(name: str, run_key: str) -> str:
+    payload = f"{name}\n{run_key}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def retry_delay(attempts: int) -> int:
+    return min(RETRY_BASE * 2 ** max(attempts - 1, 0), RETRY_MAX)
+
+
+class ReportOutbox:
+    def __init__(self, db_path: str, spool_dir: str = None):
+        """
+        报表发件箱：报表文件和待发送记录保存在本地，由 worker 异步发送并在失败时重试
+        :param db_path: SQLite 文件路径
+        :param spool_dir: 待发送文件目录，默认为 db_path 同目录下的 outbox
+        """
+        self.db_path = db_path
+        self.spool_dir = spool_dir or os.path.join(
+            os.path.dirname(os.path.abspath(db_path)), "outbox"
+        )
+        os.makedirs(self.spool_dir, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    idempotency_key TEXT NOT NULL UNIQUE,
+                    report TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    receiver_email TEXT,
+                    cc_email TEXT,
+                    subject TEXT,
+                    body TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at TEXT NOT NULL,
+                    last_error TEXT,
+                    sent_parts INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT NOT NULL,
+                    sent_at TEXT
+                )
+                """
+            )
+            # 兼容没有 sent_parts 列的旧发件箱
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(outbox)")]
+            if "sent_parts" not in columns:
+                conn.execute(
+                    "ALTER TABLE outbox "
+                    "ADD COLUMN sent_parts INTEGER NOT NULL DEFAULT 0"
+                )
+
+    # 设置了 REPORT_OUTBOX_PATH 时启用，否则报表生成后直接发送
+    @classmethod
+    def from_env(cls) -> Optional["ReportOutbox"]:
+        db_path = os.getenv("REPORT_OUTBOX_PATH")
+        if not db_path:
+            return None
+        return cls(db_path, os.getenv("REPORT_OUTBOX_DIR"))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # 报表文件移入发件箱目录并记录待发送邮件，返回是否入队；
+    # 同一幂等键的记录已是 failed 时用本次文件重新入队，待发送或已发送时丢弃本次文件
+    def enqueue(
+        self,
+        report: str,
+        file_path: str,
+        receiver_email: str,
+        cc_email: str,
+        subject: str,
+        body: str,
+        run_key: str,
+    ) -> bool:
+        key = make_idempotency_key(report, run_key)
+        spool_path = os.path.join(
+            self.spool_dir, f"{key[:12]}_{os.path.basename(file_path)}"
+        )
+        now = datetime.now().isoformat(timespec="seconds")
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                """
+                INSERT OR IGNORE INTO outbox (
+                    idempotency_key, report, file_path, receiver_email, cc_email,
+                    subject, body, next_attempt_at, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    key,
+                    report,
+                    spool_path,
+                    receiver_email,
+                    cc_email,
+                    subject,
+                    body,
+                    now,
+                    now,
+                ),
+            )
+            if cursor.rowcount:
+                shutil.move(file_path, spool_path)
+                return True
+            existing = conn.execute(
+                "SELECT status, file_path FROM outbox WHERE idempotency_key = ?",
+                (key,),
+            ).fetchone()
+            if existing["status"] == "failed":
+                conn.execute(
+                    """
+                    UPDATE outbox
+                    SET report = ?, file_path = ?, receiver_email = ?, cc_email = ?,
+                        subject = ?, body = ?, status = 'pending', attempts = 0,
+                        sent_parts = 0, next_attempt_at = ?, last_error = NULL,
+                        created_at = ?
+                    WHERE idempotency_key = ?
+                    """,
+                    (
+                        report,
+                        spool_path,
+                        receiver_email,
+                        cc_email,
+                        subject,
+                        body,
+                        now,
+                        now,
+                        key,
+                    ),
+                )
+                if existing["file_path"] != spool_path and os.path.exists(
+                    existing["file_path"]
+                ):
+                    os.remove(existing["file_path"])
+                shutil.move(file_path, spool_path)
+                logger.warning(f"报表 {report} 之前发送失败（{key[:12]}），使用本次文件重新入队")
+                return True
+        os.remove(file_path)
+        logger.warning(
+            f"报表 {report} 的本次运行（{run_key}）已在发件箱中（{key[:12]}，{existing['status']}），"
+            "丢弃本次生成的文件"
+        )
+        return False
+
+    # 取出到期的待发送记录并标记为 sending，多个 worker 同时运行时不会取到同一条；
+    # sending 的记录在 LEASE_SECONDS 后视为 worker 已异常退出，可以被重新取出
+    def claim_due(self, limit: int = 100) -> List[sqlite3.Row]:
+        now = datetime.now()
+        lease_until = (now + timedelta(seconds=LEASE_SECONDS)).isoformat(
+            timespec="seconds"
+        )
+        now = now.isoformat(timespec="seconds")
+        claimed = []
+        with closing(self._connect()) as conn, conn:
+            rows = conn.execute(
+                """
+                SELECT * FROM outbox
+                WHERE status IN ('pending', 'sending') AND next_attempt_at <= ?
+                ORDER BY next_attempt_at LIMIT ?
+                """,
+                (now, limit),
+            ).fetchall()
+            for row in rows:
+                cursor = conn.execute(
+                    """
+                    UPDATE outbox SET status = 'sending', next_attempt_at = ?
+                    WHERE id = ? AND status = ? AND next_attempt_at = ?
+                    """,
+                    (lease_until, row["id"], row["status"], row["next_attempt_at"]),
+                )
+                if cursor.rowcount:
+                    claimed.append(row)
+        return claimed
+
+    def mark_sent(self, entry: sqlite3.Row) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE outbox SET status = 'sent', sent_at = ?, last_error = NULL "
+                "WHERE id = ?",
+                (datetime.now().isoformat(timespec="seconds"), entry["id"]),
+            )
+        if os.path.exists(entry["file_path"]):
+            os.remove(entry["file_path"])
+
+    # 记录失败并按指数退避安排下次发送，超过最大次数后标记为 failed
+    def mark_failed(self, entry: sqlite3.Row, error: Exception) -> None:
+        attempts = entry["attempts"] + 1
+        status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+        next_attempt_at = datetime.now() + timedelta(seconds=retry_delay(attempts))
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                """
+                UPDATE outbox
+                SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?
+                WHERE id = ?
+                """,
+                (
+                    status,
+                    attempts,
+                    next_attempt_at.isoformat(timespec="seconds"),
+                    str(error),
+                    entry["id"],
+                ),
+            )
+
+    # 拆分发送的邮件每发送成功一封就记录，重试时从下一封继续
+    def mark_part_sent(self, entry: sqlite3.Row, part: int) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE outbox SET sent_parts = ? WHERE id = ?", (part, entry["id"])
+            )
+
+    def pending_count(self) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending')"
+            ).fetchone()[0]
+
+
+async def deliver_entry(
+    outbox: ReportOutbox,
+    sender: EmailSender,
+    entry: sqlite3.Row,
+    semaphore: asyncio.Semaphore,
+) -> bool:
+    # Message-ID 由幂等键生成，重试时即使重复投递，邮件客户端也能识别为同一封
+    email = Email(
+        entry["file_path"],
+        entry["receiver_email"],
+        entry["cc_email"],
+        entry["subject"],
+        entry["body"],
+        message_id=f"{entry['idempotency_key']}@report-outbox",
+    )
+    async with semaphore:
+        try:
+            # SMTP 和 SQLite 都是阻塞调用，放到线程中执行
+            await asyncio.to_thread(
+                sender.send,
+                email,
+                entry["sent_parts"],
+                lambda part: outbox.mark_part_sent(entry, part),
+            )
+        except Exception as e:
+            logger.error(
+                f"报表 {entry['report']} 第 {entry['attempts'] + 1} 次发送失败: {e}"
+            )
+            await asyncio.to_thread(outbox.mark_failed, entry, e)
+            return False
+    await asyncio.to_thread(outbox.mark_sent, entry)
+    logger.info(f"报表 {entry['report']} 已发送")
+    return True
+
+
+# 发送所有到期的邮件；once 为 True 时发送完当前到期的记录后返回，否则持续轮询
+async def run_worker(
+    outbox: ReportOutbox,
+    sender: EmailSender,
+    once: bool = False,
+    poll_interval: float = 30,
+    concurrency: int = None,
+) -> None:
+    semaphore = asyncio.Semaphore(concurrency or DEFAULT_CONCURRENCY)
+    while True:
+        entries = await asyncio.to_thread(outbox.claim_due)
+        if entries:
+            await asyncio.gather(
+                *(deliver_entry(outbox, sender, entry, semaphore) for entry in entries)
+            )
+        elif once:
+            return
+        else:
+            await asyncio.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="发送报表发件箱中的邮件")
+    parser.add_argument("--once", action="store_true", help="发送当前到期的邮件后退出")
+    parser.add_argument(
+        "--poll-interval", type=float, default=30, help="轮询间隔（秒）"
+    )
+    parser.add_argument("--concurrency", type=int, help="同时发送的邮件数")
+    args = parser.parse_args()
+
+    outbox = ReportOutbox.from_env()
+    if outbox is None:
+        logger.error("未设置 REPORT_OUTBOX_PATH")
+        sys.exit(1)
+    with EmailSender.from_env() as sender:
+        asyncio.run(
+            run_worker(outbox, sender, args.once, args.poll_interval, args.concurrency)
+        )
+    logger.info(f"发件箱中还有 {outbox.pending_count()} 封待发送")
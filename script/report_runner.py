@@ -0,0 +1,351 @@
+import os
+import sys
+import asyncio
+import logging
+import threading
+import pandas as pd
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from urllib.parse import quote_plus
+from typing import Callable, Dict, List, Optional
+from EmailSender import EmailSender
+from query_cache import QueryCache
+from report_outbox import ReportOutbox, run_worker
+import async_query_runner
+import query_metrics
+from query_plan import explain_query, find_plan_issues, format_plan_summary
+from query_runner import DEFAULT_MAX_CONCURRENCY, run_query
+from standin_db import create_standin_engine
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# 加载环境变量
+load_dotenv()
+
+COMMON_REQUIRED_VARS = [
+    "DB_USERNAME",
+    "DB_PASSWORD",
+    "DB_HOSTNAME",
+    "SENDER_EMAIL",
+    "EMAIL_PASSWORD",
+]
+
+
+@dataclass
+class QuerySpec:
+    database: str
+    sql: str
+    dtypes: Optional[Dict[str, str]] = None
+    # 绑定参数，SQL 中写作 :name
+    params: Optional[dict] = None
+    # 将 left(col,7)='YYYY-MM' 等对列套函数的月份 / 日期过滤条件改写为可走索引的区间查询
+    rewrite_periods: bool = False
+
+
+@dataclass
+class ReportSpec:
+    """
+    声明式报表定义
+    :param name: 报表名称，同时作为收件人环境变量前缀（{name}_RECEIVER_EMAIL / {name}_CC_EMAIL）
+    :param subject: 邮件主题
+    :param body: 邮件正文
+    :param output_file: 导出文件路径
+    :param period: 报表数据对应的期间（如 2024-05），与名称一起作为发件箱的幂等键，
+        同一期间的报表只发送一次；调度系统重试时可通过 REPORT_RUN_ID 指定运行 id 代替
+    :param queries: 查询名称 -> QuerySpec，相互独立的查询会并发执行
+    :param process: 后处理步骤，接收查询结果和 runner，返回 工作表名称 -> DataFrame
+    :param export: 自定义导出步骤（如流式导出），接收 runner，返回导出文件路径；设置后忽略 queries
+    """
+
+    name: str
+    subject: str
+    body: str
+    output_file: str
+    period: str
+    queries: Dict[str, QuerySpec] = field(default_factory=dict)
+    process: Optional[Callable] = None
+    export: Optional[Callable] = None
+
+
+# 检查必要的环境变量
+def check_required_env_vars(report_names: List[str]) -> bool:
+    required_vars = list(COMMON_REQUIRED_VARS)
+    for name in report_names:
+        required_vars += [f"{name}_RECEIVER_EMAIL", f"{name}_CC_EMAIL"]
+    for var in required_vars:
+        if not os.getenv(var):
+            logger.error(f"缺少必要的环境变量: {var}")
+            return False
+    return True
+
+
+def generate_excel(sheets: Dict[str, pd.DataFrame], output_file: str) -> str:
+    with pd.ExcelWriter(output_file) as writer:
+        for sheet_name, df in sheets.items():
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+    return output_file
+
+
+class ReportRunner:
+    def __init__(self, engine_factory: Callable[[str], create_engine] = None):
+        """
+        在一个进程内执行多个报表，数据库引擎、连接池和邮件发送器在报表之间共享
+        :param engine_factory: 按数据库名称创建引擎，默认连接 MySQL；
+            也可通过 REPORT_DB_URL_TEMPLATE（如 sqlite:///standin/{database}.db）指定本地替身库
+        """
+        self.engine_factory = engine_factory
+        self.db_url_template = os.getenv("REPORT_DB_URL_TEMPLATE")
+        self.db_username = os.getenv("DB_USERNAME")
+        self.db_password = os.getenv("DB_PASSWORD")
+        self.db_hostname = os.getenv("DB_HOSTNAME")
+        self.email_sender = EmailSender.from_env()
+        # 设置 REPORT_OUTBOX_PATH 后报表文件先进入发件箱，由 worker 发送和重试
+        self.outbox = ReportOutbox.from_env()
+        self.cache = QueryCache.from_env()
+        # 设置 REPORT_RUNNER_EXPLAIN=1 时对缓存未命中的报表查询执行 EXPLAIN，
+        # 汇总全表扫描和缺少索引的问题；每个查询多一次往返，默认关闭，排查慢查询时开启
+        self.explain = os.getenv("REPORT_RUNNER_EXPLAIN", "0") == "1"
+        # 报表查询改用异步驱动（aiomysql）流式读取，同一报表的查询在一个事件循环中并发执行
+        self.use_async = os.getenv("REPORT_RUNNER_ASYNC", "0") == "1"
+        self.plan_issues = []
+        self._engines = {}
+        self._engines_lock = threading.Lock()
+        # 异步引擎绑定在事件循环上，所有报表共用一个在后台线程中运行的事件循环
+        self._loop = None
+        self._async_engines = {}
+        self._plan_issues_lock = threading.Lock()
+        # 每个 runner 对应一次运行，查询指标按 run_id 汇总
+        self.run_id = query_metrics.start_run()
+
+    def __enter__(self) -> "ReportRunner":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.dispose()
+
+    # 按数据库名称获取共享的引擎
+    def get_engine(self, database: str) -> create_engine:
+        with self._engines_lock:
+            if database not in self._engines:
+                self._engines[database] = self._create_engine(database)
+            return self._engines[database]
+
+    def _create_engine(self, database: str) -> create_engine:
+        if self.engine_factory:
+            return self.engine_factory(database)
+        if self.db_url_template:
+            return create_standin_engine(self.db_url_template, database)
+        return create_engine(
+            f"mysql+mysqlconnector://{quote_plus(self.db_username)}:{quote_plus(self.db_password)}@{self.db_hostname}/{database}",
+            pool_size=DEFAULT_MAX_CONCURRENCY,
+            pool_pre_ping=True,
+        )
+
+    def dispose(self) -> None:
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(
+                self._dispose_async_engines(), self._loop
+            ).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+        with self._engines_lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
+        self.email_sender.close()
+
+    async def _dispose_async_engines(self) -> None:
+        for engine in self._async_engines.values():
+            await engine.dispose()
+        self._async_engines.clear()
+        await asyncio.get_running_loop().shutdown_default_executor()
+
+    # 在后台线程中运行的事件循环，第一次执行异步查询时启动，dispose 时停止
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._engines_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._run_loop, args=(self._loop,), daemon=True
+                ).start()
+            return self._loop
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop) -> None:
+        loop.run_forever()
+        loop.close()
+
+    # 按数据库名称获取共享的异步引擎（只在事件循环线程中调用）
+    def get_async_engine(self, database: str):
+        if database not in self._async_engines:
+            self._async_engines[database] = (
+                async_query_runner.create_async_report_engine(
+                    self.get_engine(database).url, pool_size=DEFAULT_MAX_CONCURRENCY
+                )
+            )
+        return self._async_engines[database]
+
+    # 执行单个查询；启用 EXPLAIN 时在缓存未命中后、查询前检查执行计划，
+    # 与查询共用同一个数据库并发上限
+    def run_query(self, query: QuerySpec, name: str = None) -> pd.DataFrame:
+        return run_query(
+            self.get_engine(query.database),
+            query.sql,
+            cache=self.cache,
+            dtypes=query.dtypes,
+            params=query.params,
+            name=name,
+            on_miss=self.plan_checker(query.database, name),
+            rewrite_periods=query.rewrite_periods,
+        )
+
+    # 返回传给 run_query 的 on_miss 回调，未启用 EXPLAIN 时为 None
+    def plan_checker(self, database: str, name: str) -> Optional[Callable]:
+        if not self.explain:
+            return None
+
+        def check(sql: str, params: dict) -> None:
+            self.check_plan(database, sql, params, name)
+
+        return check
+
+    # sql、params 为改写过月份过滤条件的查询；EXPLAIN 失败（如权限不足）只记录警告，不影响报表
+    def check_plan(self, database: str, sql: str, params: dict, name: str) -> None:
+        try:
+            issues = find_plan_issues(
+                explain_query(self.get_engine(database), sql, params)
+            )
+        except Exception as e:
+            logger.warning(f"查询 {name} 执行 EXPLAIN 失败: {e}")
+            return
+        with self._plan_issues_lock:
+            self.plan_issues += [
+                {"数据库": database, "查询": name, "问题": issue} for issue in issues
+            ]
+
+    # 运行结束时输出查询指标汇总和执行计划检查结果
+    def log_run_summary(self) -> None:
+        logger.info(query_metrics.format_metrics_summary(self.run_id))
+        if self.explain:
+            logger.info(format_plan_summary(self.plan_issues))
+
+    # 并发执行报表的全部查询，每个数据库的并发由 query_runner 的信号量控制
+    def execute_queries(
+        self, queries: Dict[str, QuerySpec]
+    ) -> Dict[str, pd.DataFrame]:
+        if not queries:
+            return {}
+        if self.use_async:
+            return asyncio.run_coroutine_threadsafe(
+                self.execute_queries_async(queries), self._get_loop()
+            ).result()
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            futures = {
+                name: executor.submit(self.run_query, query, name)
+                for name, query in queries.items()
+            }
+            return {name: future.result() for name, future in futures.items()}
+
+    # 在一个事件循环中用 asyncio.gather 并发执行全部查询；
+    # 异步引擎在多次调用之间复用，需要在 runner 的事件循环中执行（见 execute_queries）
+    async def execute_queries_async(
+        self, queries: Dict[str, QuerySpec]
+    ) -> Dict[str, pd.DataFrame]:
+        async def run(name: str, query: QuerySpec) -> pd.DataFrame:
+            engine = self.get_async_engine(query.database)
+            # 与同步查询共用每个数据库的并发上限和调度器的全局预算；
+            # EXPLAIN 只在缓存未命中时执行，同样占用并发名额
+            return await async_query_runner.run_query(
+                engine,
+                query.sql,
+                cache=self.cache,
+                dtypes=query.dtypes,
+                params=query.params,
+                name=name,
+                on_miss=self.plan_checker(query.database, name),
+                rewrite_periods=query.rewrite_periods,
+            )
+
+        frames = await asyncio.gather(
+            *(run(name, query) for name, query in queries.items())
+        )
+        return dict(zip(queries, frames))
+
+    def send(self, spec: ReportSpec, output_file: str) -> None:
+        self.email_sender.send_email(
+            output_file,
+            os.getenv(f"{spec.name}_RECEIVER_EMAIL"),
+            os.getenv(f"{spec.name}_CC_EMAIL"),
+            spec.subject,
+            spec.body,
+        )
+
+    # 根据查询结果生成导出文件，返回文件路径
+    def build_output(
+        self, spec: ReportSpec, results: Dict[str, pd.DataFrame] = None
+    ) -> str:
+        if spec.export:
+            return spec.export(self)
+        if results is None:
+            results = self.execute_queries(spec.queries)
+        sheets = spec.process(results, self) if spec.process else results
+        return generate_excel(sheets, spec.output_file)
+
+    # 发送邮件并删除文件；启用发件箱时文件和邮件信息写入发件箱，发送失败后重试不需要重新查询
+    def deliver(self, spec: ReportSpec, output_file: str) -> None:
+        if self.outbox:
+            if self.outbox.enqueue(
+                spec.name,
+                output_file,
+                os.getenv(f"{spec.name}_RECEIVER_EMAIL"),
+                os.getenv(f"{spec.name}_CC_EMAIL"),
+                spec.subject,
+                spec.body,
+                os.getenv("REPORT_RUN_ID") or spec.period,
+            ):
+                logger.info(f"报表 {spec.name} 已加入发件箱")
+            return
+        self.send(spec, output_file)
+        os.remove(output_file)
+        logger.info(f"报表 {spec.name} 已发送")
+
+    # 报表全部生成后立即发送一次发件箱中到期的邮件，失败的留给 report_outbox worker 重试
+    def flush_outbox(self) -> None:
+        if self.outbox and os.getenv("REPORT_OUTBOX_FLUSH", "1") == "1":
+            asyncio.run(run_worker(self.outbox, self.email_sender, once=True))
+
+    def run(self, spec: ReportSpec) -> bool:
+        try:
+            self.deliver(spec, self.build_output(spec))
+            return True
+        except Exception as e:
+            logger.error(f"报表 {spec.name} 发生错误: {e}")
+            return False
+
+    # 同时执行多个报表，返回 报表名称 -> 是否成功
+    def run_all(
+        self, specs: List[ReportSpec], max_workers: int = None
+    ) -> Dict[str, bool]:
+        if not specs:
+            return {}
+        with ThreadPoolExecutor(max_workers=max_workers or len(specs)) as executor:
+            futures = {spec.name: executor.submit(self.run, spec) for spec in specs}
+            return {name: future.result() for name, future in futures.items()}
+
+
+# 报表脚本的统一入口：检查环境变量、执行报表、释放资源，失败时以非零状态退出
+def run_reports(specs: List[ReportSpec]) -> None:
+    if not check_required_env_vars([spec.name for spec in specs]):
+        sys.exit(1)
+    with ReportRunner() as runner:
+        results = runner.run_all(specs)
+        runner.log_run_summary()
+        runner.flush_outbox()
+    if not all(results.values()):
+        sys.exit(1)
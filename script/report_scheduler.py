@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import logging
+import threading
+import pandas as pd
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Tuple
+from query_runner import DEFAULT_MAX_CONCURRENCY, set_db_budget
+from report_runner import (
+    QuerySpec,
+    ReportRunner,
+    ReportSpec,
+    check_required_env_vars,
+)
+
+logger = logging.getLogger(__name__)
+
+# 所有数据库合计允许的并发查询数（各数据库自身的上限仍由 query_runner 控制）
+DEFAULT_DB_BUDGET = int(
+    os.getenv("REPORT_SCHEDULER_DB_BUDGET", str(DEFAULT_MAX_CONCURRENCY))
+)
+
+
+# 相同数据库、SQL、列类型声明、绑定参数和改写选项的查询视为同一个上游节点
+def query_node_key(query: QuerySpec) -> Tuple:
+    options = json.dumps(
+        {
+            "dtypes": query.dtypes or {},
+            "params": query.params or {},
+            "rewrite_periods": query.rewrite_periods,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return ("query", query.database, " ".join(query.sql.split()), options)
+
+
+class ReportScheduler:
+    def __init__(
+        self,
+        runner: ReportRunner,
+        db_budget: int = None,
+        max_workers: int = None,
+    ):
+        """
+        以 DAG 方式执行多个报表：数据库、SQL、列类型和绑定参数完全相同的查询只执行一次，互不依赖的节点并行执行，
+        报表的输入就绪后立即开始生成 Excel 和发送邮件
+        :param runner: 提供数据库引擎、缓存和邮件发送的 ReportRunner
+        :param db_budget: 全局数据库并发预算，运行期间每次数据库访问（query_runner 的查询）
+            占用一个名额，查询节点和自定义导出节点中的查询共用
+        :param max_workers: 线程池大小，默认等于节点数
+        """
+        self.runner = runner
+        self.db_budget = threading.BoundedSemaphore(db_budget or DEFAULT_DB_BUDGET)
+        self.max_workers = max_workers
+
+    # 构建节点：节点键 -> (执行函数, 依赖的节点键)
+    def build_graph(
+        self, specs: List[ReportSpec]
+    ) -> Dict[Tuple, Tuple[Callable[[Dict], object], List[Tuple]]]:
+        graph = {}
+        for spec in specs:
+            report_key = ("report", spec.name)
+            if spec.export:
+                graph[report_key] = (self._export_task(spec), [])
+                continue
+            inputs = {}
+            for name, query in spec.queries.items():
+                key = query_node_key(query)
+                if key not in graph:
+                    task = self._query_task(query, f"{spec.name}/{name}")
+                    graph[key] = (task, [])
+                inputs[name] = key
+            graph[report_key] = (
+                self._report_task(spec, inputs),
+                list(inputs.values()),
+            )
+        return graph
+
+    def _query_task(
+        self, query: QuerySpec, name: str
+    ) -> Callable[[Dict], pd.DataFrame]:
+        def task(outputs: Dict) -> pd.DataFrame:
+            return self.runner.run_query(query, name)
+
+        return task
+
+    # 自定义导出中的查询各自占用预算，生成文件和发送邮件时不占用
+    def _export_task(self, spec: ReportSpec) -> Callable[[Dict], str]:
+        def task(outputs: Dict) -> str:
+            output_file = self.runner.build_output(spec)
+            self.runner.deliver(spec, output_file)
+            return output_file
+
+        return task
+
+    def _report_task(
+        self, spec: ReportSpec, inputs: Dict[str, Tuple]
+    ) -> Callable[[Dict], str]:
+        def task(outputs: Dict) -> str:
+            # 共享的查询结果可能同时被多个报表使用，后处理前各自复制一份
+            results = {name: outputs[key].copy() for name, key in inputs.items()}
+            output_file = self.runner.build_output(spec, results)
+            self.runner.deliver(spec, output_file)
+            return output_file
+
+        return task
+
+    # 执行全部报表，返回 报表名称 -> 是否成功；上游失败的报表直接跳过
+    def run(self, specs: List[ReportSpec]) -> Dict[str, bool]:
+        graph = self.build_graph(specs)
+        if not graph:
+            return {}
+        outputs, failed = {}, set()
+        pending = dict(graph)
+        running = {}
+        # 运行期间所有经过 query_runner 的数据库访问共用全局预算
+        set_db_budget(self.db_budget)
+        try:
+            with ThreadPoolExecutor(
+                max_workers=self.max_workers or len(graph)
+            ) as executor:
+                while pending or running:
+                    for key, (task, deps) in list(pending.items()):
+                        if any(dep in failed for dep in deps):
+                            logger.error(f"{key[0]} {key[1]} 的上游查询失败，已跳过")
+                            failed.add(key)
+                            del pending[key]
+                        elif all(dep in outputs for dep in deps):
+                            running[executor.submit(task, outputs)] = key
+                            del pending[key]
+                    if not running:
+                        break
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        key = running.pop(future)
+                        try:
+                            outputs[key] = future.result()
+                        except Exception as e:
+                            logger.error(f"{key[0]} {key[1]} 发生错误: {e}")
+                            failed.add(key)
+        finally:
+            set_db_budget(None)
+        return {spec.name: ("report", spec.name) not in failed for spec in specs}
+
+
+# 月末报表的统一入口：按 DAG 调度执行，失败时以非零状态退出
+def run_scheduled_reports(specs: List[ReportSpec], db_budget: int = None) -> None:
+    if not check_required_env_vars([spec.name for spec in specs]):
+        sys.exit(1)
+    with ReportRunner() as runner:
+        results = ReportScheduler(runner, db_budget).run(specs)
+        runner.log_run_summary()
+        runner.flush_outbox()
+    if not all(results.values()):
+        sys.exit(1)
@@ -0,0 +1,167 @@
+import os
+import time
+import argparse
+import logging
+import socketserver
+import tempfile
+import threading
+from EmailSender import Email, EmailSender
+
+logger = logging.getLogger(__name__)
+
+
+class SmtpStandinHandler(socketserver.StreamRequestHandler):
+    # 只实现发送邮件用到的命令，收到的邮件数据默认直接丢弃
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self) -> None:
+        server = self.server
+        # 模拟 TLS 握手和登录的耗时
+        time.sleep(server.connect_delay)
+        self.connection.settimeout(server.idle_timeout)
+        with server.lock:
+            server.connections += 1
+        self.reply("220 standin ESMTP")
+        try:
+            self.serve()
+        except (TimeoutError, ConnectionError):
+            # 空闲超时时直接断开，模拟服务端关闭空闲连接
+            pass
+
+    def serve(self) -> None:
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip().upper()
+            if command.startswith("EHLO"):
+                self.reply("250-standin")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif command.startswith("AUTH"):
+                self.reply("235 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while (line := self.rfile.readline()) != b".\r\n":
+                    # 客户端在邮件内容中途断开时不算收到邮件
+                    if not line:
+                        return
+                    if self.server.keep_messages:
+                        data.append(line[1:] if line.startswith(b"..") else line)
+                with self.server.lock:
+                    self.server.messages += 1
+                    if self.server.keep_messages:
+                        self.server.received.append(b"".join(data))
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SmtpStandin(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        connect_delay: float = 0.0,
+        idle_timeout: float = None,
+        keep_messages: bool = False,
+    ):
+        """
+        本地 SMTP 替身服务（不加密、不校验密码），用于测试和压测 EmailSender
+        :param port: 监听端口，0 表示随机端口
+        :param connect_delay: 每个新连接的额外耗时，模拟 TLS 握手和登录
+        :param idle_timeout: 连接空闲超过该秒数后断开
+        :param keep_messages: 保存收到的邮件原文到 received，用于检查邮件内容
+        """
+        super().__init__(("127.0.0.1", port), SmtpStandinHandler)
+        self.connect_delay = connect_delay
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+        self.keep_messages = keep_messages
+        self.received = []
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    # 在后台线程中启动服务
+    def start(self) -> "SmtpStandin":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+# 对比逐封新建连接发送和通过连接池批量发送的耗时
+def benchmark(count: int, connect_delay: float, pool_size: int) -> None:
+    server = SmtpStandin(connect_delay=connect_delay).start()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "report.xlsx")
+        with open(file_path, "wb") as f:
+            f.write(os.urandom(256 * 1024))
+        emails = [
+            Email(file_path, "to@example.com", "cc@example.com", f"报表 {i}", "")
+            for i in range(count)
+        ]
+
+        start = time.perf_counter()
+        for email in emails:
+            # 每封邮件使用新的 EmailSender，相当于原来每次发送都新建连接并登录
+            with EmailSender(
+                "bench@example.com", "", "127.0.0.1", server.port, False
+            ) as sender:
+                sender.send_email(
+                    email.file_path,
+                    email.receiver_email,
+                    email.cc_email,
+                    email.subject,
+                    email.body,
+                )
+        logger.info(f"逐封连接发送 {count} 封: {time.perf_counter() - start:.3f}s")
+
+        start = time.perf_counter()
+        with EmailSender(
+            "bench@example.com", "", "127.0.0.1", server.port, False, pool_size
+        ) as sender:
+            errors = sender.send_many(emails)
+        failed = sum(error is not None for error in errors)
+        logger.info(
+            f"send_many 发送 {count} 封（{pool_size} 个连接）: "
+            f"{time.perf_counter() - start:.3f}s，失败 {failed} 封"
+        )
+    logger.info(f"替身服务共收到 {server.connections} 个连接、{server.messages} 封邮件")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="本地 SMTP 替身服务")
+    parser.add_argument("--port", type=int, default=1025, help="监听端口")
+    parser.add_argument(
+        "--connect-delay", type=float, default=0.3, help="每个连接模拟的握手耗时（秒）"
+    )
+    parser.add_argument("--idle-timeout", type=float, help="空闲连接断开时间（秒）")
+    parser.add_argument(
+        "--benchmark", type=int, metavar="N", help="发送 N 封邮件对比逐封连接和 send_many"
+    )
+    parser.add_argument("--pool-size", type=int, default=3, help="压测时的连接数")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.connect_delay, args.pool_size)
+    else:
+        server = SmtpStandin(args.port, args.connect_delay, args.idle_timeout)
+        logger.info(
+            f"SMTP 替身服务监听 127.0.0.1:{server.port}，"
+            f"设置 EMAIL_SMTP_SERVER=127.0.0.1、EMAIL_SMTP_PORT={server.port}、"
+            "EMAIL_SMTP_SSL=0 即可使用"
+        )
+        server.serve_forever()
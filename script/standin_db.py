@@ -0,0 +1,40 @@
+import os
+from datetime import datetime
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+# 本地替身库中的数据库名称，同一目录下的其他库会以同名 schema 挂载（如 crm 查询 bwcmall.bo_order）
+STANDIN_DATABASES = ("bwcmall", "kestrel", "crm")
+
+
+# SQLite 中没有的 MySQL 函数
+def _register_mysql_functions(dbapi_conn) -> None:
+    dbapi_conn.create_function(
+        "IF", 3, lambda condition, a, b: a if condition else b, deterministic=True
+    )
+    dbapi_conn.create_function(
+        "NOW", 0, lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    )
+
+
+# 按 URL 模板（如 sqlite:///standin/{database}.db）创建替身库引擎；
+# SQLite 替身会注册 MySQL 兼容函数并挂载同目录下的其他库，MySQL 兼容的替身直接连接
+def create_standin_engine(url_template: str, database: str) -> create_engine:
+    url = url_template.format(database=database)
+    engine = create_engine(url)
+    if make_url(url).get_backend_name() != "sqlite":
+        return engine
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_conn, connection_record):
+        _register_mysql_functions(dbapi_conn)
+        for other in STANDIN_DATABASES:
+            other_path = make_url(url_template.format(database=other)).database
+            if other != database and os.path.exists(other_path):
+                dbapi_conn.execute(f"ATTACH DATABASE '{other_path}' AS {other}")
+
+    return engine
+
+
+def standin_url_template(directory: str) -> str:
+    return f"sqlite:///{os.path.join(directory, '{database}.db')}"
@@ -0,0 +1,197 @@
+import gzip
+import logging
+import pandas as pd
+from openpyxl import Workbook
+from sqlalchemy import create_engine, text
+from typing import Dict, Iterable, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_FORMATS = ("xlsx", "csv.gz", "parquet")
+
+
+# 分块读取查询结果，每次只在内存中保留 chunksize 行；
+# 通过服务端游标（stream_results）读取，驱动不会先把全部结果缓存到客户端。
+# 读取期间结果集一直占着连接，只适合逐块直接写出的场景：两次读取之间耗时较长时，
+# MySQL 会在 net_write_timeout（默认 60 秒）后中断发送，结果被截断，这种场景使用 read_keyset_chunks
+def read_sql_chunks(
+    db_engine: create_engine, query: str, chunksize: int = 5000
+) -> Iterator[pd.DataFrame]:
+    with db_engine.connect() as conn:
+        if db_engine.dialect.driver == "mysqlconnector":
+            yield from _read_unbuffered_chunks(conn, query, chunksize)
+            return
+        conn = conn.execution_options(stream_results=True)
+        yield from pd.read_sql(query, conn, chunksize=chunksize)
+
+
+# mysqlconnector 方言不支持 stream_results（连接默认 buffered=True），
+# 直接使用驱动的非缓冲游标逐批读取
+def _read_unbuffered_chunks(conn, query: str, chunksize: int) -> Iterator[pd.DataFrame]:
+    cursor = conn.connection.dbapi_connection.cursor(buffered=False)
+    try:
+        cursor.execute(query)
+        columns = [column[0] for column in cursor.description]
+        while rows := cursor.fetchmany(chunksize):
+            yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+        cursor.close()
+    except BaseException:
+        # 未读完的非缓冲结果会占住连接，中途退出时直接丢弃该连接
+        conn.invalidate()
+        raise
+
+
+# 键集翻页条件：(c0 > :keyset_0) OR (c0 = :keyset_0 AND c1 > :keyset_1) ...
+def _keyset_condition(key_columns: List[str], operator: str) -> str:
+    terms = []
+    for i, column in enumerate(key_columns):
+        equal = [f"{key_columns[j]} = :keyset_{j}" for j in range(i)]
+        terms.append(" AND ".join(equal + [f"{column} {operator} :keyset_{i}"]))
+    return "(" + " OR ".join(f"({term})" for term in terms) + ")"
+
+
+# numpy / pandas 标量转换为 Python 原生类型以便驱动绑定
+def _to_native(value):
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value.item() if hasattr(value, "item") else value
+
+
+# 按键集分页读取，每页是一次独立的短查询，读完即归还连接；调用方处理一页数据（如逐块补充毛利）
+# 期间不占着未读完的结果集，处理再慢也不会触发 net_write_timeout。
+# query 中 {keyset} 处追加翻页条件（第一页为空），以 ORDER BY key_columns LIMIT :page_size 结尾，
+# key_columns 的组合须唯一且有索引；descending 为 True 时按降序翻页
+def read_keyset_chunks(
+    db_engine: create_engine,
+    query: str,
+    key_columns: List[str],
+    chunksize: int = 5000,
+    params: dict = None,
+    descending: bool = False,
+) -> Iterator[pd.DataFrame]:
+    condition = _keyset_condition(key_columns, "<" if descending else ">")
+    last = None
+    while True:
+        page_params = {**(params or {}), "page_size": chunksize}
+        if last is None:
+            statement = text(query.format(keyset=""))
+        else:
+            statement = text(query.format(keyset=f"AND {condition}"))
+            page_params.update({f"keyset_{i}": value for i, value in enumerate(last)})
+        with db_engine.connect() as conn:
+            df = pd.read_sql(statement, conn, params=page_params)
+        if df.empty:
+            return
+        yield df
+        if len(df) < chunksize:
+            return
+        last = [_to_native(df[column].iloc[-1]) for column in key_columns]
+
+
+def get_output_format(output_file: str) -> str:
+    for output_format in SUPPORTED_FORMATS:
+        if output_file.endswith(f".{output_format}"):
+            return output_format
+    raise ValueError(f"不支持的导出格式: {output_file}，仅支持 {SUPPORTED_FORMATS}")
+
+
+def _write_xlsx(
+    chunks: Iterable[pd.DataFrame], output_file: str, sheet_name: str
+) -> int:
+    # write_only 模式下逐行写入，不在内存中保留单元格对象
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title=sheet_name)
+    row_count = 0
+    has_header = False
+    for chunk in chunks:
+        if not has_header:
+            worksheet.append(list(chunk.columns))
+            has_header = True
+        for row in chunk.itertuples(index=False, name=None):
+            worksheet.append([None if pd.isna(value) else value for value in row])
+        row_count += len(chunk)
+    workbook.save(output_file)
+    return row_count
+
+
+def _write_csv_gz(chunks: Iterable[pd.DataFrame], output_file: str) -> int:
+    row_count = 0
+    with gzip.open(output_file, "wt", encoding="utf-8-sig", newline="") as file:
+        for chunk in chunks:
+            chunk.to_csv(file, index=False, header=row_count == 0)
+            row_count += len(chunk)
+    return row_count
+
+
+# pandas 类型名转换为 pyarrow 类型，字符串类的列统一为 string
+def _arrow_type(pa, dtype: str):
+    if dtype in ("str", "string", "object"):
+        return pa.string()
+    if dtype == "category":
+        return pa.dictionary(pa.int32(), pa.string())
+    dtype = pd.api.types.pandas_dtype(dtype)
+    # 可空整数等扩展类型使用对应的 numpy 类型
+    return pa.from_numpy_dtype(getattr(dtype, "numpy_dtype", dtype))
+
+
+# 文件的 schema 在写入第一块前确定：dtypes 中声明的列使用声明的类型，
+# 其余列按第一块推断，第一块中全为空的列按字符串处理，避免后续块的类型与 schema 不一致
+def _parquet_schema(pa, chunk: pd.DataFrame, dtypes: Dict[str, str]):
+    inferred = pa.Schema.from_pandas(chunk, preserve_index=False)
+    fields = []
+    for inferred_field in inferred:
+        if inferred_field.name in dtypes:
+            arrow_type = _arrow_type(pa, dtypes[inferred_field.name])
+        elif pa.types.is_null(inferred_field.type):
+            logger.warning(
+                f"列 {inferred_field.name} 在第一块中全为空且未声明类型，按字符串写入"
+            )
+            arrow_type = pa.string()
+        else:
+            arrow_type = inferred_field.type
+        fields.append(pa.field(inferred_field.name, arrow_type))
+    return pa.schema(fields)
+
+
+def _write_parquet(
+    chunks: Iterable[pd.DataFrame], output_file: str, dtypes: Dict[str, str] = None
+) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("导出 parquet 需要安装 pyarrow: pip install pyarrow")
+
+    row_count = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            if writer is None:
+                schema = _parquet_schema(pa, chunk, dtypes or {})
+                writer = pq.ParquetWriter(output_file, schema)
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            writer.write_table(table.cast(writer.schema))
+            row_count += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return row_count
+
+
+# 按文件后缀（.xlsx / .csv.gz / .parquet）将数据块流式写入文件，内存占用与总行数无关；
+# dtypes 声明 parquet 文件中各列的类型（列名 -> pandas 类型名）
+def write_chunks(
+    chunks: Iterable[pd.DataFrame],
+    output_file: str,
+    sheet_name: str = "Sheet1",
+    dtypes: Dict[str, str] = None,
+) -> str:
+    output_format = get_output_format(output_file)
+    if output_format == "xlsx":
+        row_count = _write_xlsx(chunks, output_file, sheet_name)
+    elif output_format == "csv.gz":
+        row_count = _write_csv_gz(chunks, output_file)
+    else:
+        row_count = _write_parquet(chunks, output_file, dtypes)
+    logger.info(f"已流式写入 {row_count} 行数据到 {output_file}")
+    return output_file
@@ -0,0 +1,401 @@
+import os
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from sqlalchemy import String
+from typing import Dict, Iterator, Tuple
+from standin_db import create_standin_engine, standin_url_template
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# 一级品类名称，每个一级品类下生成若干二级品类
+TOP_CATEGORIES = ["刀具", "量具", "电气控制", "五金工具", "劳保用品", "机床附件"]
+SUB_CATEGORIES_PER_TOP = 4
+# 每个订单最多的明细行数，明细 id = 订单 id * MAX_ITEMS + 序号
+MAX_ITEMS = 4
+
+# 加载完成后创建的索引，与生产库中报表查询用到的关联字段一致
+INDEXES = {
+    "bwcmall": {
+        "bo_order": ["id", "p_order_id", "sn", "customer_id", "deliver_time"],
+        "bo_order_item": ["order_id", "goods_id"],
+        "bo_order_after_sale": ["id", "order_id", "customer_id", "modify_time"],
+        "bo_order_after_sale_item": ["order_after_sale_id"],
+        "bo_purchase": ["id", "order_sn"],
+        "bo_order_purchase_rela": ["order_id", "purchase_id", "modify_time"],
+        "bo_purchase_item": ["purchase_id", "sku_id"],
+        "bo_purchase_after_sale": ["id", "purchase_id", "create_time"],
+        "bo_purchase_after_sale_item": ["purchase_after_sale_id", "purchase_id"],
+        "bl_shipping": ["id"],
+        "bl_shipping_purchase_rela": ["purchase_id"],
+        "bc_shop_goods_sku_rela": ["goods_id"],
+        "bp_sku": ["id"],
+        "bp_spu": ["id"],
+        "bp_spu_category_rela": ["spu_id"],
+        "bp_spu_category": ["id"],
+    },
+    "kestrel": {
+        "ko_order": ["bwc_order_id", "create_time", "user_terminal_info_id"],
+        "kc_user_terminal_info": ["id"],
+    },
+    "crm": {
+        "crm_customer": ["id", "platform_account", "owner"],
+        "crm_user": ["id"],
+    },
+}
+
+
+# 维表规模随订单量增长
+def dimension_sizes(orders: int) -> Dict[str, int]:
+    spus = max(200, orders // 50)
+    customers = max(500, orders // 20)
+    return {"spus": spus, "skus": spus * 3, "customers": customers, "users": 50}
+
+
+def _random_times(
+    rng: np.random.Generator, count: int, start: datetime, end: datetime
+) -> pd.Series:
+    seconds = rng.integers(0, int((end - start).total_seconds()), count)
+    return pd.Series(pd.Timestamp(start) + pd.to_timedelta(seconds, unit="s"))
+
+
+def _sn(prefix: np.ndarray, ids: np.ndarray) -> pd.Series:
+    return pd.Series(prefix) + pd.Series(ids).astype(str).str.zfill(10)
+
+
+# 生成品类、商品、客户、顾问、终端等维表
+def generate_dimensions(
+    orders: int, rng: np.random.Generator
+) -> Iterator[Tuple[str, str, pd.DataFrame]]:
+    sizes = dimension_sizes(orders)
+
+    categories = []
+    for i, name in enumerate(TOP_CATEGORIES, start=1):
+        categories.append((i, 0, str(i), name))
+        for j in range(1, SUB_CATEGORIES_PER_TOP + 1):
+            sub_id = i * 100 + j
+            categories.append((sub_id, i, f"{i},{sub_id}", f"{name}-{j}"))
+    df_categories = pd.DataFrame(
+        categories, columns=["id", "parent_id", "path", "name"]
+    )
+    yield "bwcmall", "bp_spu_category", df_categories
+
+    spu_ids = np.arange(1, sizes["spus"] + 1)
+    yield "bwcmall", "bp_spu", pd.DataFrame({"id": spu_ids})
+    yield "bwcmall", "bp_spu_category_rela", pd.DataFrame(
+        {
+            "spu_id": spu_ids,
+            "spu_category_id": rng.choice(df_categories["id"], len(spu_ids)),
+            "record_status": 1,
+        }
+    )
+    sku_ids = np.arange(1, sizes["skus"] + 1)
+    yield "bwcmall", "bp_sku", pd.DataFrame(
+        {"id": sku_ids, "spu_id": rng.choice(spu_ids, len(sku_ids))}
+    )
+    # 商品与 SKU 一一对应，goods_id 与 sku_id 相同
+    yield "bwcmall", "bc_shop_goods_sku_rela", pd.DataFrame(
+        {"goods_id": sku_ids, "sku_id": sku_ids, "record_status": 1}
+    )
+
+    user_ids = np.arange(1, sizes["users"] + 1)
+    yield "crm", "crm_user", pd.DataFrame(
+        {"id": user_ids, "username": [f"顾问{i}" for i in user_ids]}
+    )
+    customer_ids = np.arange(1, sizes["customers"] + 1)
+    owners = pd.Series(rng.choice(user_ids, len(customer_ids)), dtype="Int64")
+    # 约一成客户在公海，没有负责人
+    owners[rng.random(len(customer_ids)) < 0.1] = pd.NA
+    yield "crm", "crm_customer", pd.DataFrame(
+        {
+            "id": customer_ids,
+            "owner": owners,
+            "platform_account": customer_ids + 100000,
+            "name": [f"客户{i}" for i in customer_ids],
+            "record_status": 1,
+        }
+    )
+    yield "kestrel", "kc_user_terminal_info", pd.DataFrame(
+        {
+            "id": customer_ids,
+            "crop_name": [f"终端公司{i}" for i in customer_ids],
+            "customer_type": rng.choice(["1", "2"], len(customer_ids)),
+        }
+    )
+
+
+# 生成 id 从 first_id 开始的 count 个订单及其明细、售后、采购、物流和销售端订单
+def generate_orders(
+    first_id: int,
+    count: int,
+    orders: int,
+    start: datetime,
+    end: datetime,
+    rng: np.random.Generator,
+) -> Iterator[Tuple[str, str, pd.DataFrame]]:
+    sizes = dimension_sizes(orders)
+    order_ids = np.arange(first_id, first_id + count)
+    # 渠道商订单 D / 采购单 C，终端订单 G / 采购单 Z
+    is_trader = rng.random(count) < 0.5
+    order_sn = _sn(np.where(is_trader, "D", "G"), order_ids)
+    purchase_sn = _sn(np.where(is_trader, "C", "Z"), order_ids)
+    customer_index = rng.integers(1, sizes["customers"] + 1, count)
+    create_time = _random_times(rng, count, start, end)
+    payment_date = create_time + pd.to_timedelta(rng.integers(0, 86400, count), "s")
+    deliver_time = payment_date + pd.to_timedelta(rng.integers(0, 5, count), "D")
+    modify_time = deliver_time + pd.to_timedelta(rng.integers(0, 10, count), "D")
+
+    # 订单明细
+    item_counts = rng.integers(1, MAX_ITEMS + 1, count)
+    item_order_index = np.repeat(np.arange(count), item_counts)
+    item_position = np.arange(len(item_order_index)) - np.repeat(
+        np.cumsum(item_counts) - item_counts, item_counts
+    )
+    item_ids = order_ids[item_order_index] * MAX_ITEMS + item_position
+    price = rng.uniform(10, 2000, len(item_ids)).round(2)
+    quantity = rng.integers(1, 11, len(item_ids))
+    goods_ids = rng.integers(1, sizes["skus"] + 1, len(item_ids))
+    receivable = np.bincount(item_order_index, price * quantity, count).round(2)
+    yield "bwcmall", "bo_order_item", pd.DataFrame(
+        {
+            "id": item_ids,
+            "order_id": order_ids[item_order_index],
+            "goods_id": goods_ids,
+            "price": price,
+            "quantity": quantity,
+            "p_order_item_id": item_ids,
+            "record_status": 1,
+        }
+    )
+
+    order_status = rng.choice(
+        [1, 2, 3, 4, 5, 6], count, p=[0.05, 0.3, 0.3, 0.05, 0.25, 0.05]
+    )
+    yield "bwcmall", "bo_order", pd.DataFrame(
+        {
+            "id": order_ids,
+            "p_order_id": order_ids,
+            "sn": order_sn,
+            "customer_id": customer_index + 100000,
+            "receivable": receivable,
+            "record_status": np.where(rng.random(count) < 0.02, 0, 1),
+            "order_status": order_status,
+            "create_time": create_time,
+            "payment_date": payment_date,
+            "deliver_time": deliver_time,
+            "modify_time": modify_time,
+        }
+    )
+    yield "kestrel", "ko_order", pd.DataFrame(
+        {
+            "id": order_ids,
+            "sn": order_sn,
+            "bwc_order_id": order_ids,
+            "terminal_name": [f"终端公司{i}" for i in customer_index],
+            "user_terminal_info_id": customer_index,
+            "receivable": receivable,
+            "order_type": 2,
+            "order_status": rng.choice([0, 1, 2, 3, 4, 5], count),
+            "record_status": 1,
+            "create_time": create_time,
+        }
+    )
+
+    # 约 5% 的订单有售后
+    has_after_sale = rng.random(count) < 0.05
+    after_sale_ids = order_ids[has_after_sale]
+    after_sale_amount = (
+        receivable[has_after_sale] * rng.uniform(0.05, 0.5, len(after_sale_ids))
+    ).round(2)
+    yield "bwcmall", "bo_order_after_sale", pd.DataFrame(
+        {
+            "id": after_sale_ids,
+            "order_id": after_sale_ids,
+            "customer_id": customer_index[has_after_sale] + 100000,
+            "amount": after_sale_amount,
+            "after_sale_status": rng.choice([3, 8], len(after_sale_ids), p=[0.2, 0.8]),
+            "record_status": 1,
+            "modify_time": deliver_time[has_after_sale]
+            + pd.to_timedelta(rng.integers(3, 40, len(after_sale_ids)), "D"),
+        }
+    )
+    yield "bwcmall", "bo_order_after_sale_item", pd.DataFrame(
+        {
+            "id": after_sale_ids,
+            "order_after_sale_id": after_sale_ids,
+            "goods_id": rng.integers(1, sizes["skus"] + 1, len(after_sale_ids)),
+            "total_price": after_sale_amount,
+            "record_status": 1,
+        }
+    )
+
+    # 每个订单一张采购单，采购明细与订单明细一一对应
+    yield "bwcmall", "bo_purchase", pd.DataFrame(
+        {
+            "id": order_ids,
+            "sn": purchase_sn,
+            "order_sn": order_sn,
+            "payable": (receivable * rng.uniform(0.6, 0.95, count)).round(2),
+            "purchase_status": rng.choice([1, 2, 3], count, p=[0.45, 0.05, 0.5]),
+            "record_status": 1,
+        }
+    )
+    yield "bwcmall", "bo_order_purchase_rela", pd.DataFrame(
+        {
+            "id": order_ids,
+            "order_id": order_ids,
+            "purchase_id": order_ids,
+            "record_status": 1,
+            "modify_time": modify_time,
+        }
+    )
+    yield "bwcmall", "bo_purchase_item", pd.DataFrame(
+        {
+            "id": item_ids,
+            "purchase_id": order_ids[item_order_index],
+            "sku_id": goods_ids,
+            "total_purchase_price": (
+                price * quantity * rng.uniform(0.6, 0.95, len(item_ids))
+            ).round(2),
+            "record_status": 1,
+        }
+    )
+
+    # 约九成采购单已发货
+    is_shipped = rng.random(count) < 0.9
+    yield "bwcmall", "bl_shipping", pd.DataFrame(
+        {
+            "id": order_ids[is_shipped],
+            "start_time": deliver_time[is_shipped] - pd.Timedelta(days=1),
+        }
+    )
+    yield "bwcmall", "bl_shipping_purchase_rela", pd.DataFrame(
+        {
+            "id": order_ids[is_shipped],
+            "shipping_id": order_ids[is_shipped],
+            "purchase_id": order_ids[is_shipped],
+            "record_status": 1,
+        }
+    )
+
+    # 约 3% 的采购单有采购售后
+    has_purchase_after_sale = rng.random(count) < 0.03
+    purchase_after_sale_ids = order_ids[has_purchase_after_sale]
+    purchase_after_sale_amount = (
+        receivable[has_purchase_after_sale]
+        * rng.uniform(0.05, 0.3, len(purchase_after_sale_ids))
+    ).round(2)
+    purchase_after_sale_time = deliver_time[has_purchase_after_sale] + pd.to_timedelta(
+        rng.integers(1, 30, len(purchase_after_sale_ids)), "D"
+    )
+    yield "bwcmall", "bo_purchase_after_sale", pd.DataFrame(
+        {
+            "id": purchase_after_sale_ids,
+            "purchase_id": purchase_after_sale_ids,
+            "amount": purchase_after_sale_amount,
+            "after_sale_status": rng.choice([1, 3, 8], len(purchase_after_sale_ids)),
+            "record_status": 1,
+            "create_time": purchase_after_sale_time,
+            "modify_time": purchase_after_sale_time,
+        }
+    )
+    yield "bwcmall", "bo_purchase_after_sale_item", pd.DataFrame(
+        {
+            "id": purchase_after_sale_ids,
+            "purchase_after_sale_id": purchase_after_sale_ids,
+            "purchase_id": purchase_after_sale_ids,
+            "sku_id": rng.integers(1, sizes["skus"] + 1, len(purchase_after_sale_ids)),
+            "total_price": purchase_after_sale_amount,
+            "record_status": 1,
+        }
+    )
+
+
+# 生成并加载替身库：url_template 默认为 directory 下的 SQLite 文件，也可以指向 MySQL 兼容的数据库
+def load_standin(
+    orders: int,
+    directory: str = None,
+    url_template: str = None,
+    start: datetime = None,
+    end: datetime = None,
+    chunk_size: int = 100000,
+    seed: int = 0,
+) -> str:
+    if url_template is None:
+        os.makedirs(directory, exist_ok=True)
+        url_template = standin_url_template(directory)
+    end = end or datetime.now().replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+    start = start or end.replace(year=end.year - 1)
+    rng = np.random.default_rng(seed)
+    engines = {
+        database: create_standin_engine(url_template, database) for database in INDEXES
+    }
+    created = set()
+
+    def write(database: str, table: str, df: pd.DataFrame) -> None:
+        # 每张表第一次写入时替换旧数据，之后追加
+        if_exists = "append" if (database, table) in created else "replace"
+        # 字符串列使用定长类型，MySQL 中 TEXT 列不能直接建索引
+        dtype = {
+            column: String(64) for column in df.columns if df[column].dtype == object
+        }
+        df.to_sql(
+            table,
+            engines[database],
+            if_exists=if_exists,
+            index=False,
+            chunksize=50000,
+            dtype=dtype,
+        )
+        created.add((database, table))
+
+    try:
+        for database, table, df in generate_dimensions(orders, rng):
+            write(database, table, df)
+        for first_id in range(1, orders + 1, chunk_size):
+            count = min(chunk_size, orders + 1 - first_id)
+            for database, table, df in generate_orders(
+                first_id, count, orders, start, end, rng
+            ):
+                write(database, table, df)
+            logger.info(f"已生成 {first_id + count - 1}/{orders} 个订单")
+
+        for database, tables in INDEXES.items():
+            with engines[database].begin() as conn:
+                for table, columns in tables.items():
+                    for column in columns:
+                        conn.exec_driver_sql(
+                            f"CREATE INDEX idx_{table}_{column} ON {table} ({column})"
+                        )
+                # SQLite 没有统计信息时会为派生表选择很差的关联顺序
+                if conn.dialect.name == "sqlite":
+                    conn.exec_driver_sql("ANALYZE")
+    finally:
+        for engine in engines.values():
+            engine.dispose()
+    return url_template
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成报表基准测试用的合成数据")
+    parser.add_argument("--orders", type=int, default=10000, help="订单数量")
+    parser.add_argument("--dir", default="standin", help="SQLite 替身库目录")
+    parser.add_argument(
+        "--url-template",
+        default=None,
+        help="MySQL 兼容替身库的 URL 模板，"
+        "如 mysql+mysqlconnector://u:p@localhost/{database}",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    args = parser.parse_args()
+    url_template = load_standin(
+        args.orders, args.dir, args.url_template, seed=args.seed
+    )
+    logger.info(f"替身库已生成，可设置 REPORT_DB_URL_TEMPLATE={url_template}")
@@ -0,0 +1,34 @@
+import os
+import sys
+import pytest
+
+# 脚本之间以同目录模块的方式互相导入
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "script"))
+
+from standin_db import create_standin_engine, standin_url_template  # noqa: E402
+from synthetic_data import load_standin  # noqa: E402
+from smtp_standin import SmtpStandin  # noqa: E402
+
+
+# 整个测试会话共用一份小规模的合成数据替身库
+@pytest.fixture(scope="session")
+def standin_dir(tmp_path_factory) -> str:
+    directory = str(tmp_path_factory.mktemp("standin"))
+    load_standin(1000, directory)
+    return directory
+
+
+@pytest.fixture
+def standin_engine(standin_dir):
+    def create(database: str):
+        return create_standin_engine(standin_url_template(standin_dir), database)
+
+    return create
+
+
+@pytest.fixture
+def smtp_server():
+    server = SmtpStandin(keep_messages=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
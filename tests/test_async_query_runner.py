@@ -0,0 +1,51 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+import pytest
+from sqlalchemy.engine import make_url
+from async_query_runner import db_slot, to_async_url
+from query_runner import get_db_key, get_db_semaphore, set_db_budget
+
+
+@pytest.fixture(autouse=True)
+def reset_budget():
+    yield
+    set_db_budget(None)
+
+
+def _engine(url: str) -> SimpleNamespace:
+    return SimpleNamespace(url=make_url(url))
+
+
+# 同一数据库的同步引擎和异步引擎共用一个并发信号量
+def test_async_engine_shares_semaphore_with_sync_engine(tmp_path):
+    url = f"sqlite:///{tmp_path / 'x.db'}"
+    sync_engine, async_engine = _engine(url), _engine(str(to_async_url(url)))
+    assert get_db_key(sync_engine) == get_db_key(async_engine)
+    assert get_db_semaphore(sync_engine) is get_db_semaphore(async_engine)
+
+
+# 异步查询等待调度器的全局预算，等待期间事件循环仍可运行其他任务
+def test_async_db_slot_waits_for_budget(tmp_path):
+    engine = _engine(f"sqlite+aiosqlite:///{tmp_path / 'x.db'}")
+    budget = threading.BoundedSemaphore(1)
+    set_db_budget(budget)
+
+    async def main() -> list:
+        events = []
+
+        async def query() -> None:
+            async with db_slot(engine):
+                events.append("query")
+                assert not budget.acquire(blocking=False)
+
+        budget.acquire()
+        task = asyncio.create_task(query())
+        await asyncio.sleep(0.2)
+        events.append("released")
+        budget.release()
+        await task
+        return events
+
+    assert asyncio.run(main()) == ["released", "query"]
+    assert budget.acquire(blocking=False)
@@ -0,0 +1,154 @@
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import create_engine, text
+
+pika = pytest.importorskip("pika")
+import BatchSendMQ  # noqa: E402
+from BatchSendMQ import (  # noqa: E402
+    build_bodies,
+    iter_id_pages,
+    load_checkpoint,
+    save_checkpoint,
+)
+
+
+def test_checkpoint_resumes_unfinished_run(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    assert load_checkpoint(path, "2024-07-23") == 0
+    save_checkpoint(path, "2024-07-23", 500)
+    assert load_checkpoint(path, "2024-07-23") == 500
+    # modify_time 条件不同时从头发送
+    assert load_checkpoint(path, "2024-08-01") == 0
+
+
+# 上次已全部发送完成时，以同样条件再次运行应从头发送而不是跳过全部 id
+def test_completed_checkpoint_starts_over(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    save_checkpoint(path, "2024-07-23", 500, completed=True)
+    assert load_checkpoint(path, "2024-07-23") == 0
+
+
+def test_iter_id_pages_is_keyset_paginated(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'catalog.db'}")
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "create table ebp_service_buyer_product "
+                "(id integer primary key, modify_time text)"
+            )
+        )
+        conn.execute(
+            text("insert into ebp_service_buyer_product values (:id, :modify_time)"),
+            [
+                {"id": i, "modify_time": "2024-08-01" if i % 3 else "2024-01-01"}
+                for i in range(1, 31)
+            ],
+        )
+    pages = list(iter_id_pages(engine, "2024-07-23", after_id=5, page_size=4))
+    ids = [i for page in pages for i in page]
+    assert ids == [i for i in range(6, 31) if i % 3]
+    assert all(len(page) <= 4 for page in pages)
+
+
+def test_build_bodies():
+    assert build_bodies([1, 2, 3, 4, 5], 2) == ["1,2", "3,4", "5"]
+    assert build_bodies([7, 8]) == ["7", "8"]
+
+
+class FakeIOLoop:
+    def add_callback_threadsafe(self, callback) -> None:
+        callback()
+
+
+class FakeChannel:
+    def __init__(self):
+        self.bodies = []
+
+    def basic_publish(self, exchange, routing_key, body, properties, mandatory):
+        self.bodies.append(body)
+
+
+def _confirm(publisher, tag: int, ack: bool = True, multiple: bool = False) -> None:
+    method = (pika.spec.Basic.Ack if ack else pika.spec.Basic.Nack)(tag, multiple)
+    publisher.on_delivery_confirmation(SimpleNamespace(method=method))
+
+
+# 未确认消息数不超过窗口，全部确认后才置位 idle，被拒绝的消息计为失败
+def test_confirm_publisher_waits_for_confirms():
+    stats = BatchSendMQ.PublishStats()
+    publisher = BatchSendMQ.ConfirmPublisher(None, "q", "ex", "key", 2, stats)
+    publisher.connection = SimpleNamespace(ioloop=FakeIOLoop())
+    publisher.channel = FakeChannel()
+    publisher.ready = True
+
+    publisher.submit(["a", "b", "c"])
+    assert publisher.channel.bodies == ["a", "b"]
+    assert not publisher.idle.is_set()
+    _confirm(publisher, 1)
+    assert publisher.channel.bodies == ["a", "b", "c"]
+    _confirm(publisher, 2, ack=False)
+    assert not publisher.idle.is_set()
+    _confirm(publisher, 3, multiple=True)
+    assert publisher.idle.is_set()
+    assert publisher.take_failed() == ["b"]
+    assert (stats.published, stats.confirmed, stats.nacked) == (3, 2, 1)
+
+
+class FakePool:
+    def __init__(self, failing_page: int = None):
+        self.failing_page = failing_page
+        self.sent = []
+
+    def __enter__(self) -> "FakePool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    # failing_page 页有消息未得到确认；记录发送每页时检查点的位置
+    def send(self, bodies: list) -> list:
+        self.sent.append(
+            (bodies, load_checkpoint(BatchSendMQ.CHECKPOINT_PATH, "2024-07-23"))
+        )
+        return bodies[:1] if len(self.sent) == self.failing_page else []
+
+
+# 检查点只在一页全部确认后推进，未确认的页下次重新发送
+def test_checkpoint_advances_only_after_confirms(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'catalog.db'}")
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "create table ebp_service_buyer_product "
+                "(id integer primary key, modify_time text)"
+            )
+        )
+        conn.execute(
+            text("insert into ebp_service_buyer_product values (:id, '2024-08-01')"),
+            [{"id": i} for i in range(1, 11)],
+        )
+    for name in ["DB", "RABBITMQ"]:
+        monkeypatch.setenv(f"{name}_USERNAME", "user")
+        monkeypatch.setenv(f"{name}_PASSWORD", "password")
+    monkeypatch.setattr(BatchSendMQ, "create_engine", lambda url: engine)
+    monkeypatch.setattr(BatchSendMQ, "DEFAULT_PAGE_SIZE", 4)
+    monkeypatch.setattr(BatchSendMQ, "CHECKPOINT_PATH", str(tmp_path / "cp.json"))
+    pools = []
+
+    def make_pool(*args, **kwargs) -> FakePool:
+        pools.append(FakePool(failing_page=None if pools else 2))
+        return pools[-1]
+
+    monkeypatch.setattr(BatchSendMQ, "PublisherPool", make_pool)
+
+    with pytest.raises(SystemExit):
+        BatchSendMQ.main("2024-07-23")
+    assert pools[0].sent == [(["1", "2", "3", "4"], 0), (["5", "6", "7", "8"], 4)]
+    assert load_checkpoint(BatchSendMQ.CHECKPOINT_PATH, "2024-07-23") == 4
+
+    BatchSendMQ.main("2024-07-23")
+    assert [bodies for bodies, _ in pools[1].sent] == [
+        ["5", "6", "7", "8"],
+        ["9", "10"],
+    ]
+    assert load_checkpoint(BatchSendMQ.CHECKPOINT_PATH, "2024-07-23") == 0
@@ -0,0 +1,99 @@
+import os
+import pandas as pd
+import pytest
+
+# 报表流程的基准测试，在合成数据替身库上执行：
+#   BENCHMARK_SCALES=10000,100000 pytest tests/test_benchmark_reports.py --benchmark-autosave
+# 之后用 --benchmark-compare --benchmark-compare-fail=median:20% 与保存的结果对比，
+# 中位数耗时增长超过 20% 时失败
+pytest.importorskip("pytest_benchmark")
+
+import ConsultantTradeReport  # noqa: E402
+import ExportOrder  # noqa: E402
+import ProfitAnalysisReport  # noqa: E402
+from report_runner import ReportRunner, generate_excel  # noqa: E402
+from standin_db import (  # noqa: E402
+    STANDIN_DATABASES,
+    create_standin_engine,
+    standin_url_template,
+)
+from synthetic_data import load_standin  # noqa: E402
+
+# 订单规模，逗号分隔（如 10000,100000,1000000,10000000）
+SCALES = [int(scale) for scale in os.getenv("BENCHMARK_SCALES", "10000").split(",")]
+# 替身库目录，设置后各规模的替身库生成一次后复用
+STANDIN_DIR = os.getenv("BENCHMARK_STANDIN_DIR")
+# process_data 处理的订单数上限
+EXPORT_ORDERS = int(os.getenv("BENCHMARK_EXPORT_ORDERS", "100000"))
+REPORTS = [ProfitAnalysisReport, ConsultantTradeReport]
+
+
+# 准备某个规模的替身库，已经生成过的直接复用
+def prepare_standin(orders: int, tmp_path_factory) -> str:
+    if STANDIN_DIR:
+        scale_dir = os.path.join(STANDIN_DIR, str(orders))
+    else:
+        scale_dir = str(tmp_path_factory.mktemp(f"standin_{orders}"))
+    if not all(
+        os.path.exists(os.path.join(scale_dir, f"{database}.db"))
+        for database in STANDIN_DATABASES
+    ):
+        load_standin(orders, scale_dir)
+    return standin_url_template(scale_dir)
+
+
+@pytest.fixture(scope="module", params=SCALES, ids=lambda orders: f"{orders}_orders")
+def runner(request, tmp_path_factory):
+    url_template = prepare_standin(request.param, tmp_path_factory)
+    runner = ReportRunner(
+        engine_factory=lambda database: create_standin_engine(url_template, database)
+    )
+    # 基准测试只测数据库和计算本身，不使用查询缓存和 EXPLAIN
+    runner.cache = None
+    runner.explain = False
+    with runner:
+        yield runner
+
+
+@pytest.fixture(scope="module")
+def report_results(runner) -> dict:
+    return {
+        report: runner.execute_queries(report.build_report_spec().queries)
+        for report in REPORTS
+    }
+
+
+@pytest.mark.parametrize("report", REPORTS, ids=lambda report: report.__name__)
+def test_execute_queries(benchmark, runner, report):
+    queries = report.build_report_spec().queries
+    results = benchmark(runner.execute_queries, queries)
+    assert set(results) == set(queries)
+
+
+@pytest.mark.parametrize("report", REPORTS, ids=lambda report: report.__name__)
+def test_process_query_results(benchmark, runner, report_results, report):
+    spec = report.build_report_spec()
+    if not spec.process:
+        pytest.skip(f"{spec.name} 没有后处理步骤")
+    sheets = benchmark(spec.process, report_results[report], runner)
+    assert sheets
+
+
+def test_process_data(benchmark, runner):
+    df_orders = pd.read_sql(
+        f"SELECT bwc_order_id FROM ko_order LIMIT {EXPORT_ORDERS}",
+        runner.get_engine("kestrel"),
+    )
+    df_profit = benchmark(
+        ExportOrder.process_data, df_orders, runner.get_engine("bwcmall")
+    )
+    assert len(df_profit)
+
+
+def test_generate_excel(benchmark, runner, report_results, tmp_path):
+    sheets = {}
+    for report, results in report_results.items():
+        spec = report.build_report_spec()
+        sheets.update(spec.process(results, runner) if spec.process else results)
+    output_file = str(tmp_path / "benchmark.xlsx")
+    assert benchmark(generate_excel, sheets, output_file) == output_file
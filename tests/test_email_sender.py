@@ -0,0 +1,111 @@
+import email
+import os
+import time
+from email import policy
+import EmailSender as mail
+
+
+def _sender(server, pool_size: int = 2, timeout: float = 60) -> mail.EmailSender:
+    return mail.EmailSender(
+        "me@example.com", "", "127.0.0.1", server.port, False, pool_size, timeout
+    )
+
+
+def _write(path, size: int) -> str:
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def _attachments(raw: bytes) -> dict:
+    message = email.message_from_bytes(raw)
+    return {
+        part.get_filename(): part.get_payload(decode=True)
+        for part in message.walk()
+        if part.get_filename()
+    }
+
+
+# 连接池复用已登录的连接，发送多封邮件时连接数不超过 pool_size
+def test_send_many_reuses_connections(smtp_server, tmp_path):
+    file_path = _write(tmp_path / "a.bin", 1024)
+    emails = [
+        mail.Email(file_path, "to@example.com", None, f"主题 {i}", "")
+        for i in range(10)
+    ]
+    with _sender(smtp_server, pool_size=2) as sender:
+        assert sender.send_many(emails) == [None] * 10
+        sender.send(emails[0])
+    assert smtp_server.messages == 11
+    assert smtp_server.connections <= 2
+
+
+# 邮件内容写到一半出错时丢弃连接，同一批的下一封不会写进上一封未完成的内容
+def test_send_many_discards_connection_after_partial_data(
+    smtp_server, tmp_path, monkeypatch
+):
+    broken = _write(tmp_path / "broken.bin", 200 * 1024)
+    intact = _write(tmp_path / "intact.bin", 1024)
+    iter_base64 = mail._iter_base64
+
+    def fail_midway(path):
+        for i, chunk in enumerate(iter_base64(path)):
+            if path == broken and i == 1:
+                raise FileNotFoundError(path)
+            yield chunk
+
+    monkeypatch.setattr(mail, "_iter_base64", fail_midway)
+    emails = [
+        mail.Email(broken, "to@example.com", None, "主题 1", ""),
+        mail.Email(intact, "to@example.com", None, "主题 2", ""),
+    ]
+    # 沿用半封邮件的连接时，下一封的 MAIL 命令被当作邮件内容，要等到超时才会重连
+    start = time.monotonic()
+    with _sender(smtp_server, pool_size=1, timeout=3) as sender:
+        errors = sender.send_many(emails)
+    assert time.monotonic() - start < 3
+    assert isinstance(errors[0], FileNotFoundError) and errors[1] is None
+    (raw,) = smtp_server.received
+    assert email.message_from_bytes(raw, policy=policy.default)["Subject"] == "主题 2"
+    assert _attachments(raw) == {"intact.bin": open(intact, "rb").read()}
+    assert smtp_server.connections == 2
+
+
+# 附件边读边编码发送，收到的内容解码后与原文件一致
+def test_streamed_attachment_roundtrip(smtp_server, tmp_path):
+    file_path = _write(tmp_path / "报表.xlsx", 300 * 1024 + 7)
+    with _sender(smtp_server) as sender:
+        sender.send(
+            mail.Email(file_path, "to@example.com", "cc@example.com", "主题", "正文")
+        )
+    (raw,) = smtp_server.received
+    assert _attachments(raw) == {"报表.xlsx": open(file_path, "rb").read()}
+    assert email.message_from_bytes(raw)["Cc"] == "cc@example.com"
+
+
+# 拆分为多封的邮件从 skip_parts 之后继续发送，每封发送后回调序号
+def test_split_message_resumes_after_sent_parts(smtp_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(mail, "MAX_MESSAGE_BYTES", 6000)
+    paths = [_write(tmp_path / f"{name}.bin", 3000) for name in "xyz"]
+    message = mail.Email(
+        paths[0], "to@example.com", None, "主题", "", paths[1:], message_id="k@test"
+    )
+    sent = []
+    with _sender(smtp_server) as sender:
+        sender.send(message, 1, sent.append)
+    assert sent == [2, 3]
+    assert [
+        email.message_from_bytes(raw)["Message-ID"] for raw in smtp_server.received
+    ] == ["<2.k@test>", "<3.k@test>"]
+
+
+# 超大附件复制到共享目录，同一文件重复发送时复用同一个文件和链接
+def test_drop_file_reuses_copy(tmp_path, monkeypatch):
+    drop_dir = tmp_path / "drop" / "reports"
+    monkeypatch.setattr(mail, "FILE_DROP_DIR", str(drop_dir))
+    file_path = _write(tmp_path / "big.xlsx", 2048)
+    sender = mail.EmailSender("me@example.com", "", "127.0.0.1", 0, False)
+    first = sender.drop_file(file_path)
+    second = sender.drop_file(file_path)
+    assert first == second
+    assert len(os.listdir(drop_dir)) == 1
+    assert open(first, "rb").read() == open(file_path, "rb").read()
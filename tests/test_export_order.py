@@ -0,0 +1,78 @@
+import pandas as pd
+from sqlalchemy import create_engine, text
+import ExportOrder
+from stream_export import read_keyset_chunks
+
+
+def _kestrel_orders(standin_engine, limit: int) -> pd.DataFrame:
+    return pd.read_sql(
+        f"select bwc_order_id from ko_order where bwc_order_id is not null "
+        f"limit {limit}",
+        standin_engine("kestrel"),
+    )
+
+
+def _sorted(df: pd.DataFrame) -> pd.DataFrame:
+    return df.sort_values("bwc_order_id").reset_index(drop=True)
+
+
+# id 总数超过阈值时整体使用临时表关联，结果与分批 IN 查询一致
+def test_process_data_temp_table_matches_batches(standin_engine, caplog):
+    df_orders = _kestrel_orders(standin_engine, 400)
+    bwcmall = standin_engine("bwcmall")
+    batched = ExportOrder.process_data(df_orders, bwcmall, batch_size=50)
+    caplog.clear()
+    with caplog.at_level("INFO"):
+        joined = ExportOrder.process_data(
+            df_orders, bwcmall, batch_size=50, temp_table_threshold=100
+        )
+    assert "使用临时表关联查询" in caplog.text
+    assert "批次的数据查询完成" not in caplog.text
+    pd.testing.assert_frame_equal(_sorted(batched), _sorted(joined))
+    assert batched["order_amount"].sum() > 0
+
+
+def test_fetch_changed_order_ids_binds_since(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'bwcmall.db'}")
+    tables = {
+        "bo_order": {"id": [1, 2], "p_order_id": [11, 12]},
+        "bo_order_after_sale": {"order_id": [1], "purchase_id": [0]},
+        "bo_purchase": {"id": [5]},
+        "bo_order_purchase_rela": {"order_id": [2], "purchase_id": [5]},
+        "bo_purchase_after_sale": {"purchase_id": [5]},
+    }
+    modify_times = {
+        "bo_order": ["2024-01-01", "2024-01-01"],
+        "bo_order_after_sale": ["2024-03-01"],
+        "bo_purchase": ["2024-01-01"],
+        "bo_order_purchase_rela": ["2024-01-01"],
+        "bo_purchase_after_sale": ["2024-05-01"],
+    }
+    for table, columns in tables.items():
+        pd.DataFrame({**columns, "modify_time": modify_times[table]}).to_sql(
+            table, engine, index=False
+        )
+    assert ExportOrder.fetch_changed_order_ids(engine, "2024-02-01") == {11, 12}
+    assert ExportOrder.fetch_changed_order_ids(engine, "2024-04-01") == {12}
+    assert not ExportOrder.fetch_changed_order_ids(engine, "2024-06-01")
+
+
+# 销售数据按键集分页读取，全部页合起来与一次查询的结果一致
+def test_query_order_keyset_pages_cover_all_rows(standin_engine):
+    kestrel = standin_engine("kestrel")
+    pages = list(
+        read_keyset_chunks(
+            kestrel,
+            ExportOrder.QUERY_ORDER,
+            ExportOrder.QUERY_ORDER_KEYSET,
+            chunksize=100,
+            descending=True,
+        )
+    )
+    expected = pd.read_sql(
+        text(ExportOrder.QUERY_ORDER.format(keyset="")),
+        kestrel,
+        params={"page_size": -1},
+    )
+    assert len(pages) > 1
+    pd.testing.assert_frame_equal(pd.concat(pages, ignore_index=True), expected)
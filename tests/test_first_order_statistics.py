@@ -0,0 +1,116 @@
+import pandas as pd
+from sqlalchemy import create_engine, text
+import FirstOrderStatistics
+
+
+def _terminal_engine(tmp_path, terminals: pd.DataFrame):
+    engine = create_engine(f"sqlite:///{tmp_path / 'kestrel.db'}")
+    terminals.to_sql("kc_user_terminal_info", engine, index=False)
+    return engine
+
+
+def _orders(terminal_ids: list) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "user_terminal_info_id": terminal_ids,
+            "create_time": pd.to_datetime(["2024-05-10"] * len(terminal_ids)),
+            "bwc_order_id": range(1, len(terminal_ids) + 1),
+            "receivable": [100.0] * len(terminal_ids),
+        }
+    )
+
+
+def test_customer_type_maps_integer_codes_with_missing_terminal(tmp_path):
+    # 终端 3 不存在，左关联后 customer_type 变成带空值的浮点数
+    engine = _terminal_engine(
+        tmp_path,
+        pd.DataFrame(
+            {"id": [1, 2], "crop_name": ["甲", "乙"], "customer_type": [1, 2]}
+        ),
+    )
+    df = FirstOrderStatistics.aggregate_first_orders(
+        _orders([1, 2, 3]), engine, "2024-04-01", "2024-05-01", "2024-06-01"
+    )
+    by_name = dict(zip(df["crop_name"].fillna("-"), df["customer_type"]))
+    assert by_name["甲"] == "终端"
+    assert by_name["乙"] == "贸易商"
+    assert pd.isna(by_name["-"])
+
+
+def test_customer_type_maps_string_codes(tmp_path):
+    engine = _terminal_engine(
+        tmp_path,
+        pd.DataFrame(
+            {"id": [1, 2], "crop_name": ["甲", "乙"], "customer_type": ["1", "2"]}
+        ),
+    )
+    df = FirstOrderStatistics.aggregate_first_orders(
+        _orders([1, 2]), engine, "2024-04-01", "2024-05-01", "2024-06-01"
+    )
+    assert sorted(df["customer_type"]) == ["终端", "贸易商"]
+
+
+def _first_orders_sql(engine, *period: str) -> pd.DataFrame:
+    return pd.read_sql(
+        text(FirstOrderStatistics.build_order_query()),
+        engine,
+        params=FirstOrderStatistics.period_params(*period),
+    )
+
+
+# 窗口之前下过单的客户不是新客；同一时间的多笔首单取最小订单号；金额按月份分开
+def test_first_orders_use_full_history(tmp_path):
+    engine = _terminal_engine(
+        tmp_path,
+        pd.DataFrame(
+            {"id": [1, 2], "crop_name": ["老客", "新客"], "customer_type": [1, 2]}
+        ),
+    )
+    pd.DataFrame(
+        {
+            "user_terminal_info_id": [1, 1, 2, 2, 2, 2],
+            "create_time": [
+                "2024-01-10 09:00:00",
+                "2024-04-15 09:00:00",
+                "2024-04-20 09:00:00",
+                "2024-04-20 09:00:00",
+                "2024-05-03 09:00:00",
+                "2024-06-03 09:00:00",
+            ],
+            "bwc_order_id": [1, 2, 4, 3, 5, 6],
+            "receivable": [10.0, 20.0, 30.0, 40.0, 50.0, 60.0],
+            "record_status": 1,
+            "order_type": 2,
+            "order_status": 4,
+        }
+    ).to_sql("ko_order", engine, index=False)
+    period = ("2024-04-01", "2024-05-01", "2024-06-01")
+
+    df_sql = _first_orders_sql(engine, *period)
+    df_pandas = FirstOrderStatistics.fetch_first_orders_pandas(engine, *period)
+    for df in (df_sql, df_pandas):
+        assert df["crop_name"].tolist() == ["新客"]
+        assert df["bwc_order_id"].tolist() == [3]
+        assert df["two_months_ago_amount"].tolist() == [70.0]
+        assert df["last_month_amount"].tolist() == [50.0]
+
+
+# pandas 聚合与 SQL 聚合在替身库上的结果一致
+def test_pandas_aggregation_matches_sql(standin_engine):
+    engine = standin_engine("kestrel")
+    period = FirstOrderStatistics.get_previous_two_months()[2:]
+    df_pandas = FirstOrderStatistics.fetch_first_orders_pandas(engine, *period)
+    df_sql = _first_orders_sql(engine, *period)
+    assert len(df_pandas) == len(df_sql) > 0
+    columns = [
+        "bwc_order_id",
+        "crop_name",
+        "customer_type",
+        "two_months_ago_amount",
+        "last_month_amount",
+    ]
+    pd.testing.assert_frame_equal(
+        df_pandas[columns].sort_values("bwc_order_id").reset_index(drop=True),
+        df_sql[columns].sort_values("bwc_order_id").reset_index(drop=True),
+        check_dtype=False,
+    )
@@ -0,0 +1,120 @@
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+import monthly_fact_store
+from monthly_fact_store import (
+    FactSource,
+    MonthlyFactStore,
+    is_settled,
+    load_months,
+    materialize_months,
+    month_bounds,
+    previous_months,
+)
+from report_runner import QuerySpec, ReportRunner
+
+
+def test_month_helpers():
+    assert month_bounds("2024-12") == ("2024-12-01", "2025-01-01")
+    assert previous_months(3, datetime(2024, 2, 15)) == [
+        "2023-11",
+        "2023-12",
+        "2024-01",
+    ]
+
+
+@pytest.fixture
+def runner(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'orders.db'}")
+    pd.DataFrame(
+        {
+            "create_time": ["2024-01-05", "2024-02-03", "2024-02-20"],
+            "amount": [10, 20, 30],
+        }
+    ).to_sql("orders", engine, index=False)
+    with ReportRunner(engine_factory=lambda database: engine) as runner:
+        yield runner
+
+
+@pytest.fixture
+def source():
+    built = []
+
+    def build_queries(start: str, end: str) -> dict:
+        built.append(start)
+        return {
+            "total": QuerySpec(
+                "bwcmall",
+                "select sum(amount) as amount from orders "
+                "where create_time >= :start and create_time < :end",
+                params={"start": start, "end": end},
+            )
+        }
+
+    fact_source = FactSource("order_facts", build_queries, lambda r: r["total"])
+    fact_source.built = built
+    return fact_source
+
+
+def test_load_months_materializes_once(runner, source, tmp_path):
+    store = MonthlyFactStore(str(tmp_path / "facts.db"))
+    df = load_months(runner, store, source, ["2024-01", "2024-02"])
+    assert dict(zip(df["month"], df["amount"])) == {"2024-01": 10, "2024-02": 50}
+
+    load_months(runner, store, source, ["2024-01", "2024-02"])
+    assert source.built == ["2024-01-01", "2024-02-01"]
+
+    materialize_months(runner, store, source, ["2024-02"], refresh=["2024-02"])
+    assert source.built == ["2024-01-01", "2024-02-01", "2024-02-01"]
+    assert store.materialized_months("order_facts") == ["2024-01", "2024-02"]
+
+
+# 数据到齐之前物化的月份在下次读取时重新计算
+def test_load_months_refreshes_unsettled_month(runner, source, tmp_path):
+    store = MonthlyFactStore(str(tmp_path / "facts.db"))
+    load_months(runner, store, source, ["2024-01", "2024-02"])
+    with closing(sqlite3.connect(store.db_path)) as conn, conn:
+        conn.execute(
+            "UPDATE materialized_month SET refreshed_at = '2024-03-02T01:00:00' "
+            "WHERE month = '2024-02'"
+        )
+    load_months(runner, store, source, ["2024-01", "2024-02"])
+    assert source.built == ["2024-01-01", "2024-02-01", "2024-02-01"]
+    assert is_settled("2024-02", store.refreshed_at("order_facts")["2024-02"])
+
+
+# 写入失败时整个月份回滚，保留原来的数据和物化标记
+def test_replace_month_is_atomic(tmp_path, monkeypatch):
+    store = MonthlyFactStore(str(tmp_path / "facts.db"))
+    store.replace_month("facts", "2024-01", pd.DataFrame({"amount": [10]}))
+    refreshed_at = store.refreshed_at("facts")
+
+    class Crash(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            raise RuntimeError("crash")
+
+    # 新数据写入之后、物化标记写入之前失败
+    monkeypatch.setattr(monthly_fact_store, "datetime", Crash)
+    with pytest.raises(RuntimeError):
+        store.replace_month("facts", "2024-01", pd.DataFrame({"amount": [20]}))
+    assert store.load("facts", ["2024-01"])["amount"].tolist() == [10]
+    assert store.refreshed_at("facts") == refreshed_at
+
+
+# 物化查询总是经过 runner.run_query（受数据库并发上限和调度预算约束），不走异步路径
+def test_materialize_uses_run_query(runner, source, tmp_path, monkeypatch):
+    names = []
+    run_query = runner.run_query
+    monkeypatch.setattr(runner, "use_async", True)
+    monkeypatch.setattr(
+        runner,
+        "run_query",
+        lambda query, name=None: names.append(name) or run_query(query, name),
+    )
+    store = MonthlyFactStore(str(tmp_path / "facts.db"))
+    materialize_months(runner, store, source, ["2024-01"])
+    assert names == ["order_facts/total"]
@@ -0,0 +1,25 @@
+from datetime import datetime
+from operator_cache import OperatorCache
+
+
+def test_save_and_load(tmp_path):
+    cache = OperatorCache(str(tmp_path / "operators.db"))
+    synced_until = datetime(2024, 6, 1, 8, 30)
+    cache.save(
+        {"1": ("张三", datetime(2024, 5, 20, 10, 0)), "2": (None, None)},
+        synced_until,
+    )
+    assert cache.load() == {
+        "1": ("张三", datetime(2024, 5, 20, 10, 0), synced_until),
+        "2": (None, None, synced_until),
+    }
+
+
+# 再次保存同一客户时覆盖之前的记录
+def test_save_replaces_existing(tmp_path):
+    cache = OperatorCache(str(tmp_path / "operators.db"))
+    cache.save({"1": ("张三", datetime(2024, 5, 1))}, datetime(2024, 5, 2))
+    cache.save({"1": ("李四", datetime(2024, 6, 1))}, datetime(2024, 6, 2))
+    assert cache.load() == {
+        "1": ("李四", datetime(2024, 6, 1), datetime(2024, 6, 2)),
+    }
@@ -0,0 +1,21 @@
+import pandas as pd
+from ProfitAnalysisReport import build_top_level_category_map, to_top_level
+
+
+# 明细品类的金额合并为一级品类之后只舍入一次，与按一级品类 ROUND(SUM(...), 2) 一致
+def test_to_top_level_rounds_after_merge():
+    category_map = build_top_level_category_map(
+        pd.DataFrame(
+            {
+                "id": [1, 2, 3, 4],
+                "parent_id": [0, 1, 1, 0],
+                "path": ["1", "1,2", "1,3", "4"],
+                "name": ["家电", "冰箱", "空调", "家具"],
+            }
+        )
+    )
+    df = to_top_level(
+        pd.DataFrame({"品类ID": [2, 3, 4], "总价": [0.004, 0.004, 1.25]}),
+        category_map,
+    )
+    assert dict(zip(df["一级品类"], df["总价"])) == {"家电": 1, "家具": 125}
@@ -0,0 +1,46 @@
+import pandas as pd
+from query_cache import QueryCache
+
+
+def test_get_or_load_caches_result(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    calls = []
+
+    def loader() -> pd.DataFrame:
+        calls.append(1)
+        return pd.DataFrame({"a": [1, 2]})
+
+    first = cache.get_or_load("db", "select a from t", loader)
+    second = cache.get_or_load("db", "select   a from t", loader)
+    assert calls == [1]
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_corrupt_entry_is_a_miss(tmp_path, caplog):
+    cache = QueryCache(str(tmp_path))
+    key = cache.make_key("db", "select 1")
+    cache.put(key, pd.DataFrame({"a": [1]}))
+    cache._path(key).write_bytes(b"not a dataframe")
+
+    assert cache.get(key) is None
+    assert not cache._path(key).exists()
+    assert "视为未命中" in caplog.text
+
+    df = cache.get_or_load("db", "select 1", lambda: pd.DataFrame({"a": [2]}))
+    assert df["a"].tolist() == [2]
+
+
+def test_failed_write_is_skipped(tmp_path, caplog):
+    cache = QueryCache(str(tmp_path))
+    key = cache.make_key("db", "select 1")
+
+    # 无法序列化的列使写入失败，结果仍然正常返回
+    class Unpicklable:
+        def __reduce__(self):
+            raise TypeError("cannot pickle")
+
+    df = pd.DataFrame({"a": [Unpicklable()]})
+    cache.put(key, df)
+    assert cache.get(key) is None
+    assert "跳过缓存" in caplog.text
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,124 @@
+import logging
+import threading
+import pandas as pd
+import pytest
+from sqlalchemy import VARCHAR, create_engine
+from query_cache import QueryCache
+from query_runner import (
+    db_slot,
+    fetch_by_ids,
+    get_db_semaphore,
+    rewrite_period_filters,
+    run_query,
+    set_db_budget,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_budget():
+    yield
+    set_db_budget(None)
+
+
+def test_get_db_semaphore_warns_on_different_limit(tmp_path, caplog):
+    engine = create_engine(f"sqlite:///{tmp_path / 'x.db'}")
+    first = get_db_semaphore(engine, 2)
+    with caplog.at_level(logging.WARNING):
+        assert get_db_semaphore(engine, 5) is first
+        assert get_db_semaphore(engine, 5) is first
+    assert caplog.text.count("max_concurrency=5") == 1
+
+
+def test_db_slot_takes_global_budget(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'x.db'}")
+    budget = threading.BoundedSemaphore(1)
+    set_db_budget(budget)
+    with db_slot(engine):
+        assert not budget.acquire(blocking=False)
+    assert budget.acquire(blocking=False)
+
+
+def test_fetch_by_ids_temp_table_matches_chunks(standin_engine):
+    engine = standin_engine("bwcmall")
+    ids = pd.read_sql("select id from bo_order limit 300", engine)["id"]
+    query = "select id, receivable from bo_order where id in :ids"
+
+    chunked = fetch_by_ids(engine, query, ids, temp_table_threshold=10**6)
+    joined = fetch_by_ids(engine, query, ids, temp_table_threshold=100)
+    sort = lambda df: df.sort_values("id").reset_index(drop=True)  # noqa: E731
+    pd.testing.assert_frame_equal(sort(chunked), sort(joined))
+    assert len(chunked) == 300
+
+
+def test_rewrite_period_filters():
+    query, params = rewrite_period_filters(
+        "select * from t where left(create_time,7)='2024-02' and date(d)='2024-03-01'"
+    )
+    assert ":period_0_start" in query and "left(" not in query
+    assert params["period_0_start"] == "2024-02-01"
+    assert params["period_0_end"] == "2024-03-01"
+    assert params["period_1_end"] == "2024-03-02"
+
+
+# 改写后的区间对字符串类型的日期列同样适用，当天 / 当月的行不会因比较方式变化而丢失
+# （SQLite 不支持 left()，这里只执行改写后的 SQL）
+@pytest.mark.parametrize(
+    "condition, expected",
+    [
+        ("left(d,10)='2024-03-01'", ["2024-03-01", "2024-03-01 08:00:00"]),
+        ("date(d)='2024-03-01'", ["2024-03-01", "2024-03-01 08:00:00"]),
+        ("left(d,7)='2024-03'", ["2024-03-01", "2024-03-01 08:00:00", "2024-03-31"]),
+    ],
+)
+def test_rewritten_filter_keeps_rows_of_string_dates(tmp_path, condition, expected):
+    engine = create_engine(f"sqlite:///{tmp_path / 'x.db'}")
+    pd.DataFrame(
+        {"d": ["2024-02-29", "2024-03-01", "2024-03-01 08:00:00", "2024-03-31"]}
+    ).to_sql("t", engine, index=False, dtype={"d": VARCHAR(19)})
+    df = run_query(
+        engine, f"select d from t where {condition} order by d", rewrite_periods=True
+    )
+    assert df["d"].tolist() == expected
+
+
+# 默认不改写，SQL 原样执行
+def test_run_query_rewrites_only_on_request(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'x.db'}")
+    pd.DataFrame({"d": ["2024-03-01", "2024-03-02"]}).to_sql("t", engine, index=False)
+    executed = []
+    query = "select d from t where date(d)='2024-03-01'"
+    for rewrite_periods in (False, True):
+        df = run_query(
+            engine,
+            query,
+            on_miss=lambda sql, params: executed.append(sql),
+            rewrite_periods=rewrite_periods,
+        )
+        assert df["d"].tolist() == ["2024-03-01"]
+    assert executed[0] == query
+    assert ":period_0_start" in executed[1]
+
+
+def test_run_query_checks_plan_only_on_cache_miss(standin_engine, tmp_path):
+    engine = standin_engine("bwcmall")
+    cache = QueryCache(str(tmp_path))
+    misses = []
+    day = pd.read_sql(
+        "select substr(max(create_time), 1, 10) as d from bo_order", engine
+    )["d"][0]
+    query = f"select id, p_order_id from bo_order where date(create_time) = '{day}'"
+
+    def load() -> pd.DataFrame:
+        return run_query(
+            engine,
+            query,
+            cache=cache,
+            on_miss=lambda sql, params: misses.append(sql),
+            rewrite_periods=True,
+        )
+
+    first, second = load(), load()
+    pd.testing.assert_frame_equal(first, second)
+    assert len(first)
+    # on_miss 收到的是改写后的 SQL
+    assert len(misses) == 1 and ":period_0_start" in misses[0]
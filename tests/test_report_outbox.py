@@ -0,0 +1,141 @@
+import asyncio
+import email
+import logging
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timedelta
+import report_outbox
+from EmailSender import EmailSender
+from report_runner import ReportRunner, ReportSpec
+from report_outbox import ReportOutbox, make_idempotency_key, run_worker
+
+
+def _report(tmp_path, name: str = "a.xlsx") -> str:
+    path = tmp_path / name
+    path.write_bytes(b"data")
+    return str(path)
+
+
+def _rows(outbox: ReportOutbox) -> list:
+    with closing(sqlite3.connect(outbox.db_path)) as conn:
+        return conn.execute(
+            "SELECT report, status, attempts, sent_parts FROM outbox ORDER BY id"
+        ).fetchall()
+
+
+# 同一次运行重复入队时丢弃本次文件并记录 WARNING
+def test_duplicate_enqueue_warns(tmp_path, caplog):
+    outbox = ReportOutbox(str(tmp_path / "outbox.db"))
+    first = _report(tmp_path)
+    assert outbox.enqueue("R1", first, "to@example.com", None, "主题", "", "2024-05")
+    second = _report(tmp_path, "b.xlsx")
+    with caplog.at_level(logging.WARNING):
+        assert not outbox.enqueue(
+            "R1", second, "to@example.com", None, "主题", "", "2024-05"
+        )
+    assert "已在发件箱中" in caplog.text
+    assert not os.path.exists(second)
+    assert outbox.pending_count() == 1
+
+
+# 放弃重试的记录再次入队时使用新文件重新发送
+def test_failed_entry_is_requeued(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(report_outbox, "MAX_ATTEMPTS", 1)
+    outbox = ReportOutbox(str(tmp_path / "outbox.db"))
+    outbox.enqueue("R1", _report(tmp_path), "to@example.com", None, "主题", "", "2024-05")
+    unreachable = EmailSender("me@example.com", "", "127.0.0.1", 1, False, timeout=1)
+    asyncio.run(run_worker(outbox, unreachable, once=True))
+    assert _rows(outbox) == [("R1", "failed", 1, 0)]
+
+    with caplog.at_level(logging.WARNING):
+        retry = _report(tmp_path, "b.xlsx")
+        assert outbox.enqueue(
+            "R1", retry, "to@example.com", None, "主题", "", "2024-05"
+        )
+    assert "重新入队" in caplog.text
+    assert _rows(outbox) == [("R1", "pending", 0, 0)]
+    assert len(os.listdir(outbox.spool_dir)) == 1
+
+
+# worker 发送到期的邮件，发送成功后删除发件箱中的文件
+def test_worker_sends_due_entries(tmp_path, smtp_server):
+    outbox = ReportOutbox(str(tmp_path / "outbox.db"))
+    outbox.enqueue("R1", _report(tmp_path), "to@example.com", None, "主题1", "", "1")
+    outbox.enqueue(
+        "R2", _report(tmp_path, "b.xlsx"), "to@example.com", "cc@example.com", "主题2",
+        "", "1",
+    )
+    with EmailSender(
+        "me@example.com", "", "127.0.0.1", smtp_server.port, False
+    ) as sender:
+        asyncio.run(run_worker(outbox, sender, once=True))
+
+    assert [row[1] for row in _rows(outbox)] == ["sent", "sent"]
+    assert outbox.pending_count() == 0
+    assert not os.listdir(outbox.spool_dir)
+    message_ids = sorted(
+        email.message_from_bytes(raw)["Message-ID"] for raw in smtp_server.received
+    )
+    assert all(mid.endswith("@report-outbox>") for mid in message_ids)
+    assert len(set(message_ids)) == 2
+
+
+# 没有 sent_parts 列的旧发件箱在打开时补上该列
+def test_old_outbox_gains_sent_parts(tmp_path):
+    db_path = str(tmp_path / "outbox.db")
+    with closing(sqlite3.connect(db_path)) as conn, conn:
+        conn.execute(
+            """
+            CREATE TABLE outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                report TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                receiver_email TEXT,
+                cc_email TEXT,
+                subject TEXT,
+                body TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TEXT NOT NULL,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                sent_at TEXT
+            )
+            """
+        )
+    outbox = ReportOutbox(db_path)
+    outbox.enqueue("R1", _report(tmp_path), "to@example.com", None, "主题", "", "2024-05")
+    assert _rows(outbox) == [("R1", "pending", 0, 0)]
+
+
+# 幂等键只由报表名称和本次运行决定，跨过零点重试仍是同一封邮件
+def test_idempotency_key_ignores_wall_clock(tmp_path, monkeypatch):
+    key = make_idempotency_key("R1", "2024-05")
+    assert make_idempotency_key("R1", "2024-06") != key
+
+    class NextDay(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + timedelta(days=1)
+
+    monkeypatch.setattr(report_outbox, "datetime", NextDay)
+    assert make_idempotency_key("R1", "2024-05") == key
+    outbox = ReportOutbox(str(tmp_path / "outbox.db"))
+    assert outbox.enqueue("R1", _report(tmp_path), "to@example.com", None, "", "", "a")
+    assert not outbox.enqueue(
+        "R1", _report(tmp_path, "b.xlsx"), "to@example.com", None, "", "", "a"
+    )
+
+
+# 报表按 ReportSpec.period 入队，REPORT_RUN_ID 可以指定运行 id 代替
+def test_runner_deliver_keys_on_period(tmp_path, monkeypatch):
+    monkeypatch.setenv("REPORT_OUTBOX_PATH", str(tmp_path / "outbox.db"))
+    spec = ReportSpec("R1", "主题", "", "r.xlsx", period="2024-05")
+    with ReportRunner() as runner:
+        runner.deliver(spec, _report(tmp_path))
+        runner.deliver(spec, _report(tmp_path, "b.xlsx"))
+        monkeypatch.setenv("REPORT_RUN_ID", "rerun-1")
+        runner.deliver(spec, _report(tmp_path, "c.xlsx"))
+        assert runner.outbox.pending_count() == 2
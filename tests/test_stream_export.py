@@ -0,0 +1,35 @@
+import pandas as pd
+from sqlalchemy import create_engine
+from stream_export import read_keyset_chunks
+
+QUERY = """
+SELECT id, create_time, amount FROM orders
+WHERE amount > 0 {keyset}
+ORDER BY create_time DESC, id DESC
+LIMIT :page_size
+"""
+
+
+# 分页结果与一次查询的结果一致，同一 create_time 的多行跨页时不重复、不遗漏；
+# 处理每一页期间不占用数据库连接
+def test_read_keyset_chunks_pages_without_holding_connection(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'x.db'}")
+    pd.DataFrame(
+        {
+            "id": range(1, 24),
+            "create_time": [f"2024-03-{i % 8 + 1:02d} 10:00:00" for i in range(23)],
+            "amount": [1.0] * 22 + [0.0],
+        }
+    ).to_sql("orders", engine, index=False)
+    expected = pd.read_sql(
+        QUERY.format(keyset="").replace("LIMIT :page_size", ""), engine
+    )
+
+    pages = []
+    for page in read_keyset_chunks(
+        engine, QUERY, ["create_time", "id"], chunksize=5, descending=True
+    ):
+        assert engine.pool.checkedout() == 0
+        pages.append(page)
+    assert [len(page) for page in pages] == [5, 5, 5, 5, 2]
+    pd.testing.assert_frame_equal(pd.concat(pages, ignore_index=True), expected)